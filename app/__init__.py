@@ -3,8 +3,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
-from flask_bcrypt import Bcrypt
 from flask_mail import Mail
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -14,7 +14,6 @@ load_dotenv()
 db = SQLAlchemy()
 migrate = Migrate()
 jwt = JWTManager()
-bcrypt = Bcrypt()
 mail = Mail()
 
 def create_app():
@@ -23,11 +22,15 @@ def create_app():
     # Load configuration
     app.config.from_object('app.config.Config')
     
+    # Take the client address and scheme from the trusted proxies' headers
+    proxies = app.config.get('TRUSTED_PROXY_COUNT', 0)
+    if proxies > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+    
     # Initialize extensions with app
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
-    bcrypt.init_app(app)
     mail.init_app(app)
     
     # Import and register blueprints
@@ -36,17 +39,59 @@ def create_app():
     from app.api.password import password_bp
     from app.api.tokens import tokens_bp
     from app.api.roles import roles_bp
+    from app.api.well_known import well_known_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(oauth_bp, url_prefix='/api/oauth')
     app.register_blueprint(password_bp, url_prefix='/api/password')
     app.register_blueprint(tokens_bp, url_prefix='/api/tokens')
     app.register_blueprint(roles_bp, url_prefix='/api/roles')
+    app.register_blueprint(well_known_bp, url_prefix='/.well-known')
+    
+    # Load JWT signing keys
+    from app.utils.jwt_keys import jwt_keys
+    jwt_keys.init_app(app)
     
     # Initialize Redis session tracking
     from app.services.redis_service import init_redis
     init_redis(app)
     
+    # Initialize the two-tier cache
+    from app.utils.cache import cache
+    cache.init_app(app)
+    
+    # Initialize the permission mask cache
+    from app.utils.permission_cache import init_permission_cache
+    init_permission_cache(app)
+    
+    # Initialize the user lookup cache
+    from app.utils.user_cache import user_cache
+    user_cache.init_app(app)
+    
+    # Initialize batched app token last_used updates
+    from app.utils.last_used_buffer import last_used_buffer
+    last_used_buffer.init_app(app)
+    
+    # Initialize the bcrypt process pool
+    from app.utils.password_pool import password_pool
+    password_pool.init_app(app)
+    
+    # Initialize background email senders
+    from app.utils.outbox_worker import outbox_worker
+    outbox_worker.init_app(app)
+    
+    # Initialize app token validation cache
+    from app.utils.app_token_cache import app_token_cache
+    app_token_cache.init_app(app)
+    
+    # Initialize OAuth providers, prefetching their cached metadata
+    from app.api.oauth import init_oauth
+    init_oauth(app)
+    
+    # Initialize token revocation checks
+    from app.utils.revocation_filter import revocation_filter
+    revocation_filter.init_app(app)
+    
     # Create database tables if they don't exist
     with app.app_context():
         # Check if we're in testing mode with SQLite
@@ -1,9 +1,8 @@
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, current_app
 from flask_jwt_extended import (
     get_jwt_identity, 
     jwt_required, 
-    get_jwt,
-    create_access_token
+    get_jwt
 )
 from app.services.auth_service import (
     register_user,
@@ -11,13 +10,17 @@ from app.services.auth_service import (
     login_user,
     logout_user,
     change_password,
-    get_user_by_id
+    get_user_by_id,
+    refresh_user_tokens
 )
 from app.services.redis_service import (
-    get_user_sessions,
+    get_user_sessions_page,
+    parse_session_cursor,
     remove_user_session,
     invalidate_all_user_sessions,
-    get_active_sessions_count
+    check_login_rate_limit,
+    get_active_sessions_count,
+    get_session_stats
 )
 from app.utils.decorators import jwt_required_with_permissions
 
@@ -39,6 +42,9 @@ def register():
         last_name=data.get('last_name')
     )
     
+    if result.get('busy'):
+        return jsonify(result), 503, {'Retry-After': '1'}
+    
     if result['success']:
         return jsonify(result), 201
     else:
@@ -65,11 +71,22 @@ def login():
     if not data or not data.get('email') or not data.get('password'):
         return jsonify({'success': False, 'message': 'Email and password are required'}), 400
     
+    # Throttle before touching the database or bcrypt
+    allowed, retry_after = check_login_rate_limit(data.get('email'), request.remote_addr)
+    if not allowed:
+        return jsonify({
+            'success': False,
+            'message': 'Too many login attempts, please try again later'
+        }), 429, {'Retry-After': str(retry_after)}
+    
     result = login_user(
         email=data.get('email'),
         password=data.get('password')
     )
     
+    if result.get('busy'):
+        return jsonify(result), 503, {'Retry-After': '1'}
+    
     if result['success']:
         return jsonify(result), 200
     elif result.get('needs_verification'):
@@ -85,7 +102,7 @@ def logout():
     user_id = get_jwt_identity()
     jti = get_jwt()['jti']
     
-    result = logout_user(user_id, jti)
+    result = logout_user(user_id, jti, get_jwt().get('fam'), expires_at=get_jwt().get('exp'))
     
     if result['success']:
         return jsonify(result), 200
@@ -96,21 +113,17 @@ def logout():
 @auth_bp.route('/refresh', methods=['POST'])
 @jwt_required(refresh=True)
 def refresh_token():
-    """Get a new access token using refresh token"""
-    user_id = get_jwt_identity()
+    """Exchange a refresh token for a new access token and a rotated refresh token"""
+    result = refresh_user_tokens(get_jwt())
     
-    # Verify user exists
-    user = get_user_by_id(user_id)
-    if not user:
-        return jsonify({'success': False, 'message': 'User not found'}), 404
-    
-    # Create a new access token
-    access_token = create_access_token(identity=user_id)
-    
-    return jsonify({
-        'success': True,
-        'access_token': access_token
-    }), 200
+    if result['success']:
+        return jsonify(result), 200
+    elif result.get('busy'):
+        return jsonify(result), 503, {'Retry-After': '1'}
+    elif result.get('not_found'):
+        return jsonify(result), 404
+    else:
+        return jsonify(result), 401
 
 
 @auth_bp.route('/change-password', methods=['POST'])
@@ -134,14 +147,13 @@ def change_password_route():
         new_password=data.get('new_password')
     )
     
+    if result.get('busy'):
+        return jsonify(result), 503, {'Retry-After': '1'}
+    
     if result['success']:
         # Keep current session but invalidate all others
         user = get_user_by_id(user_id)
-        invalidate_all_user_sessions(user.id)
-        
-        # Add back the current session
-        from app.services.redis_service import add_user_session
-        add_user_session(user.id, jti)
+        invalidate_all_user_sessions(user.id, keep_jti=jti, keep_family=get_jwt().get('fam'))
         
         return jsonify(result), 200
     else:
@@ -151,14 +163,28 @@ def change_password_route():
 @auth_bp.route('/sessions', methods=['GET'])
 @jwt_required_with_permissions()
 def get_user_sessions_route():
-    """Get all active sessions for the current user"""
+    """Get the current user's active sessions, newest first, one page at a time"""
     user = g.current_user
     
-    sessions = get_user_sessions(user.id)
+    # Validate pagination parameters
+    limit = request.args.get('limit', current_app.config['SESSION_PAGE_SIZE'], type=int)
+    cursor = request.args.get('cursor')
+    if limit < 1:
+        return jsonify({'success': False, 'message': 'Limit must be a positive integer'}), 400
+    limit = min(limit, current_app.config['SESSION_PAGE_SIZE_MAX'])
+    
+    if cursor is not None:
+        try:
+            cursor = parse_session_cursor(cursor)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    sessions, next_cursor = get_user_sessions_page(user.id, limit, cursor)
     
     return jsonify({
         'success': True,
-        'sessions': sessions
+        'sessions': sessions,
+        'next_cursor': next_cursor
     }), 200
 
 
@@ -189,12 +215,8 @@ def delete_all_sessions():
     user = g.current_user
     jti = get_jwt()['jti']
     
-    # Invalidate all sessions
-    invalidate_all_user_sessions(user.id)
-    
-    # Add back the current session
-    from app.services.redis_service import add_user_session
-    add_user_session(user.id, jti)
+    # Invalidate all sessions except the current one
+    invalidate_all_user_sessions(user.id, keep_jti=jti, keep_family=get_jwt().get('fam'))
     
     return jsonify({
         'success': True,
@@ -225,7 +247,13 @@ def get_sessions_stats():
     """Get statistics about active sessions"""
     active_count = get_active_sessions_count()
     
+    # Breakdowns come from the periodic recount rather than a scan per request
+    stats = get_session_stats() or {}
+    
     return jsonify({
         'success': True,
-        'active_sessions': active_count
+        'active_sessions': active_count,
+        'by_service': stats.get('by_service', []),
+        'by_hour': stats.get('by_hour', {}),
+        'stats_computed_at': stats.get('computed_at')
     }), 200 
\ No newline at end of file
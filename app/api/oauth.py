@@ -1,12 +1,8 @@
 from flask import Blueprint, request, jsonify, redirect, url_for, session, current_app
 import requests
 from authlib.integrations.flask_client import OAuth
-from app import db
-from app.models.user import User
-from app.services.auth_service import login_user
-from flask_jwt_extended import create_access_token, create_refresh_token
-from app.services.redis_service import add_user_session
-from datetime import datetime
+from app.services.auth_service import login_oauth_user
+from app.utils.oauth_metadata import oauth_metadata
 
 oauth_bp = Blueprint('oauth', __name__)
 
@@ -16,26 +12,29 @@ oauth = OAuth()
 # Setup OAuth providers
 def init_oauth(app):
     oauth.init_app(app)
+    oauth_metadata.init_app(app)
     
     # Google OAuth
     if app.config.get('GOOGLE_CLIENT_ID') and app.config.get('GOOGLE_CLIENT_SECRET'):
-        oauth.register(
+        client = oauth.register(
             name='google',
             client_id=app.config['GOOGLE_CLIENT_ID'],
             client_secret=app.config['GOOGLE_CLIENT_SECRET'],
             server_metadata_url=app.config['GOOGLE_DISCOVERY_URL'],
             client_kwargs={'scope': 'openid email profile'}
         )
+        oauth_metadata.register('google', app.config['GOOGLE_DISCOVERY_URL'], client)
     
     # Microsoft OAuth
     if app.config.get('MICROSOFT_CLIENT_ID') and app.config.get('MICROSOFT_CLIENT_SECRET'):
-        oauth.register(
+        client = oauth.register(
             name='microsoft',
             client_id=app.config['MICROSOFT_CLIENT_ID'],
             client_secret=app.config['MICROSOFT_CLIENT_SECRET'],
             server_metadata_url=app.config['MICROSOFT_DISCOVERY_URL'],
             client_kwargs={'scope': 'openid email profile'}
         )
+        oauth_metadata.register('microsoft', app.config['MICROSOFT_DISCOVERY_URL'], client)
     
     # Discord OAuth
     if app.config.get('DISCORD_CLIENT_ID') and app.config.get('DISCORD_CLIENT_SECRET'):
@@ -78,45 +77,12 @@ def handle_oauth_user(provider, user_info):
     if not email:
         return jsonify({"success": False, "message": "Email is required"}), 400
     
-    # Check if user exists
-    user = User.query.filter_by(email=email).first()
-    
-    if user:
-        # Update OAuth ID if not set
-        if not getattr(user, provider_field):
-            setattr(user, provider_field, oauth_id)
-            db.session.commit()
-    else:
-        # Create new user
-        user = User(
-            email=email,
-            first_name=first_name,
-            last_name=last_name,
-            is_email_verified=True,  # OAuth users are considered verified
-            is_active=True
-        )
-        setattr(user, provider_field, oauth_id)
-        db.session.add(user)
-        db.session.commit()
-    
-    # Generate tokens
-    access_token = create_access_token(identity=user.id)
-    refresh_token = create_refresh_token(identity=user.id)
-    
-    # Add session to Redis
-    from flask_jwt_extended import decode_token
-    token_jti = decode_token(access_token)['jti']
-    add_user_session(user.id, token_jti)
-    
-    # Return success response with tokens
-    result = {
-        "success": True,
-        "message": "Authentication successful",
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "user": user.to_dict()
-    }
+    # Resolve or create the user and issue tokens
+    result = login_oauth_user(provider_field, oauth_id, email, first_name, last_name)
+    if not result['success']:
+        return jsonify(result), 401
     
+    result['message'] = "Authentication successful"
     return jsonify(result)
 
 
@@ -31,6 +31,9 @@ def reset_password_route():
     # Process the request
     result = reset_password(data.get('token'), data.get('password'))
     
+    if result.get('busy'):
+        return jsonify(result), 503, {'Retry-After': '1'}
+    
     if result['success']:
         return jsonify(result), 200
     else:
@@ -1,12 +1,14 @@
 from flask import Blueprint, request, jsonify, g
-from app.utils.decorators import jwt_required_with_permissions
+from app.utils.decorators import jwt_required_with_permissions, app_token_required
 from app.services.role_service import (
     get_user_roles,
     assign_role_to_user,
     remove_role_from_user,
     create_role,
     update_role,
-    delete_role
+    delete_role,
+    get_permission_catalog,
+    get_all_permissions
 )
 from app.services.service_service import (
     get_service_by_id,
@@ -16,7 +18,7 @@ from app.services.service_service import (
     delete_service,
     get_services_for_user
 )
-from app.models.role import Role, Permission
+from app.models.role import Role
 from app.models.user import User
 from app import db
 
@@ -185,14 +187,23 @@ def get_service_roles(service_id):
 @jwt_required_with_permissions(['role:read'])
 def get_permissions():
     """Get all available permissions"""
-    permissions = Permission.query.all()
-    
     return jsonify({
         'success': True,
-        'permissions': [perm.to_dict() for perm in permissions]
+        'permissions': get_all_permissions()
     }), 200
 
 
+@roles_bp.route('/permissions/catalog', methods=['GET'])
+@app_token_required
+def get_permissions_catalog():
+    """Get the permission catalog used to decode permission claims in access tokens"""
+    catalog = get_permission_catalog()
+    
+    response = jsonify({'success': True, **catalog})
+    response.set_etag(catalog['version'])
+    return response.make_conditional(request)
+
+
 # Service management endpoints
 @roles_bp.route('/services', methods=['GET'])
 @jwt_required_with_permissions(['service:read'])
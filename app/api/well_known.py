@@ -0,0 +1,15 @@
+from flask import Blueprint, request, current_app
+from app.utils.jwt_keys import jwt_keys
+
+well_known_bp = Blueprint('well_known', __name__)
+
+@well_known_bp.route('/jwks.json', methods=['GET'])
+def jwks():
+    """Public keys for verifying our tokens locally"""
+    response = current_app.response_class(jwt_keys.jwks_json, mimetype='application/json')
+    response.set_etag(jwt_keys.jwks_etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('JWKS_CACHE_MAX_AGE', 3600)
+    
+    # Answers 304 when the caller already holds this key set
+    return response.make_conditional(request)
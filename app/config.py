@@ -31,6 +31,14 @@ class Config:
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(seconds=_parse_int_env('JWT_REFRESH_TOKEN_EXPIRES', 2592000))
     JWT_TOKEN_LOCATION = ['headers']
     
+    # Asymmetric JWT signing (unset = HS256 with JWT_SECRET_KEY)
+    JWT_SIGNING_KEYS_DIR = os.getenv('JWT_SIGNING_KEYS_DIR')
+    JWT_ACTIVE_KID = os.getenv('JWT_ACTIVE_KID')
+    JWKS_CACHE_MAX_AGE = _parse_int_env('JWKS_CACHE_MAX_AGE', 3600)
+    
+    # Embed per-service permission bitsets in access tokens
+    JWT_PERMISSION_CLAIMS = os.getenv('JWT_PERMISSION_CLAIMS', 'False').lower() in ('true', '1', 't')
+    
     # Mail configuration
     MAIL_SERVER = os.getenv('MAIL_SERVER', 'smtp.example.com')
     MAIL_PORT = _parse_int_env('MAIL_PORT', 587)
@@ -39,6 +47,21 @@ class Config:
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD', 'password')
     MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', 'noreply@example.com')
     
+    # Outbound email limits
+    PASSWORD_RESET_EMAIL_WINDOW = _parse_int_env('PASSWORD_RESET_EMAIL_WINDOW', 300)
+    EMAIL_SEND_BUDGET_PER_MINUTE = _parse_int_env('EMAIL_SEND_BUDGET_PER_MINUTE', 600)
+    
+    # Email outbox senders (per worker process)
+    EMAIL_OUTBOX_WORKERS = _parse_int_env('EMAIL_OUTBOX_WORKERS', 2)
+    EMAIL_OUTBOX_BATCH_SIZE = _parse_int_env('EMAIL_OUTBOX_BATCH_SIZE', 50)
+    EMAIL_OUTBOX_POLL_INTERVAL = _parse_int_env('EMAIL_OUTBOX_POLL_INTERVAL', 5)
+    EMAIL_OUTBOX_MAX_ATTEMPTS = _parse_int_env('EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    EMAIL_OUTBOX_RETRY_BASE = _parse_int_env('EMAIL_OUTBOX_RETRY_BASE', 30)
+    EMAIL_OUTBOX_RETRY_MAX = _parse_int_env('EMAIL_OUTBOX_RETRY_MAX', 3600)
+    EMAIL_OUTBOX_LEASE = _parse_int_env('EMAIL_OUTBOX_LEASE', 300)
+    EMAIL_OUTBOX_RETENTION = _parse_int_env('EMAIL_OUTBOX_RETENTION', 7 * 24 * 3600)
+    EMAIL_OUTBOX_PURGE_INTERVAL = _parse_int_env('EMAIL_OUTBOX_PURGE_INTERVAL', 3600)
+    
     # OAuth configuration
     # Google OAuth
     GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
@@ -61,6 +84,61 @@ class Config:
     APP_BASE_URL = os.getenv('APP_BASE_URL', 'http://localhost:5000')
     PASSWORD_RESET_TOKEN_EXPIRES = _parse_int_env('PASSWORD_RESET_TOKEN_EXPIRES', 3600)
     SESSION_LIMIT_PER_USER = _parse_int_env('SESSION_LIMIT_PER_USER', 5)
+    SESSION_PAGE_SIZE = _parse_int_env('SESSION_PAGE_SIZE', 50)
+    SESSION_PAGE_SIZE_MAX = _parse_int_env('SESSION_PAGE_SIZE_MAX', 100)
+    SESSION_RECONCILE_INTERVAL = _parse_int_env('SESSION_RECONCILE_INTERVAL', 300)
+    SESSION_COUNTER_SHARDS = _parse_int_env('SESSION_COUNTER_SHARDS', 16)
+    
+    # Token revocation Bloom filter (per worker process)
+    REVOCATION_FILTER_CAPACITY = _parse_int_env('REVOCATION_FILTER_CAPACITY', 1000000)
+    REVOCATION_FILTER_REBUILD_INTERVAL = _parse_int_env('REVOCATION_FILTER_REBUILD_INTERVAL', 3600)
+    
+    # Two-tier cache (per worker LRU in front of Redis)
+    CACHE_L1_SIZE = _parse_int_env('CACHE_L1_SIZE', 10000)
+    CACHE_L1_TTL = _parse_int_env('CACHE_L1_TTL', 30)
+    CACHE_L2_TTL = _parse_int_env('CACHE_L2_TTL', 300)
+    CACHE_FILL_LOCK_MS = _parse_int_env('CACHE_FILL_LOCK_MS', 0)
+    
+    # Permission mask cache (entries in the two-tier cache)
+    PERMISSION_CACHE_TTL = _parse_int_env('PERMISSION_CACHE_TTL', 60)
+    
+    # User lookup cache (entries in the two-tier cache)
+    USER_CACHE_TTL = _parse_int_env('USER_CACHE_TTL', 60)
+    
+    # App token last_used write-behind settings
+    APP_TOKEN_LAST_USED_FLUSH_INTERVAL = _parse_int_env('APP_TOKEN_LAST_USED_FLUSH_INTERVAL', 5)
+    APP_TOKEN_LAST_USED_FLUSH_SIZE = _parse_int_env('APP_TOKEN_LAST_USED_FLUSH_SIZE', 500)
+    
+    # App token validation cache (entries in the two-tier cache)
+    APP_TOKEN_CACHE_TTL = _parse_int_env('APP_TOKEN_CACHE_TTL', 60)
+    APP_TOKEN_NEGATIVE_CACHE_TTL = _parse_int_env('APP_TOKEN_NEGATIVE_CACHE_TTL', 10)
+    
+    # Login throttling (sliding window; a limit of 0 disables it)
+    LOGIN_RATE_LIMIT_WINDOW = _parse_int_env('LOGIN_RATE_LIMIT_WINDOW', 60)
+    LOGIN_RATE_LIMIT_PER_EMAIL = _parse_int_env('LOGIN_RATE_LIMIT_PER_EMAIL', 5)
+    LOGIN_RATE_LIMIT_PER_IP = _parse_int_env('LOGIN_RATE_LIMIT_PER_IP', 20)
+    LOGIN_RATE_LIMIT_GLOBAL = _parse_int_env('LOGIN_RATE_LIMIT_GLOBAL', 1000)
+    
+    # Reverse proxies in front of the app whose X-Forwarded-* headers are trusted
+    # (0 = use the socket address, so a proxy would make every client look alike)
+    TRUSTED_PROXY_COUNT = _parse_int_env('TRUSTED_PROXY_COUNT', 0)
+    
+    # Password hashing cost (BCRYPT_LOG_ROUNDS=0 calibrates to BCRYPT_TARGET_MS at startup)
+    BCRYPT_LOG_ROUNDS = _parse_int_env('BCRYPT_LOG_ROUNDS', 0)
+    BCRYPT_TARGET_MS = _parse_int_env('BCRYPT_TARGET_MS', 250)
+    BCRYPT_MIN_ROUNDS = _parse_int_env('BCRYPT_MIN_ROUNDS', 10)
+    BCRYPT_MAX_ROUNDS = _parse_int_env('BCRYPT_MAX_ROUNDS', 16)
+    
+    # Password hashing process pool (per worker process)
+    PASSWORD_POOL_WORKERS = _parse_int_env('PASSWORD_POOL_WORKERS', 2)
+    PASSWORD_POOL_MAX_PENDING = _parse_int_env('PASSWORD_POOL_MAX_PENDING', 8)
+    PASSWORD_POOL_TIMEOUT = _parse_int_env('PASSWORD_POOL_TIMEOUT', 5)
+    
+    # OAuth provider metadata cache (discovery documents and JWKS)
+    OAUTH_METADATA_CACHE_DIR = os.getenv('OAUTH_METADATA_CACHE_DIR')
+    OAUTH_METADATA_REFRESH_INTERVAL = _parse_int_env('OAUTH_METADATA_REFRESH_INTERVAL', 3600)
+    OAUTH_METADATA_MAX_AGE = _parse_int_env('OAUTH_METADATA_MAX_AGE', 604800)
+    OAUTH_METADATA_TIMEOUT = _parse_int_env('OAUTH_METADATA_TIMEOUT', 5)
     
     # OAuth callback URLs
     GOOGLE_CALLBACK_URL = f"{APP_BASE_URL}/api/oauth/google/callback"
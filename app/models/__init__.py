@@ -2,4 +2,7 @@ from app.models.user import User
 from app.models.role import Role, Permission, RolePermission
 from app.models.app_token import AppToken
 from app.models.service import Service
-from app.models.user_service_role import UserServiceRole 
\ No newline at end of file
+from app.models.user_service_role import UserServiceRole
+from app.models.user_effective_permission import UserEffectivePermission
+from app.models.email_outbox import OutboxEmail 
+from app.models.counter import Counter
@@ -0,0 +1,58 @@
+from app import db
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+class Counter(db.Model):
+    """Named counters that only move forward, for values that must never be handed out twice"""
+    __tablename__ = 'counters'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    @classmethod
+    def next_value(cls, connection, name, start=0):
+        """Take the counter's next value, creating it at ``start`` (a value or SQL expression) if missing.
+        
+        One upsert creates or advances the row and returns the new value, and
+        it holds the row lock until the transaction ends, so concurrent
+        callers get distinct values even on first use.
+        """
+        table = cls.__table__
+        dialect = connection.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+        
+        if insert is None:
+            return cls._next_value_without_upsert(connection, name, start)
+        
+        stmt = insert(table).values(name=name, value=start + 1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'value': table.c.value + 1}
+        ).returning(table.c.value)
+        return connection.execute(stmt).scalar_one() - 1
+    
+    @classmethod
+    def _next_value_without_upsert(cls, connection, name, start):
+        # No ON CONFLICT ... RETURNING here; insert in a savepoint and advance
+        # the row instead if a concurrent caller created it first
+        table = cls.__table__
+        advanced = connection.execute(
+            table.update().where(table.c.name == name).values(value=table.c.value + 1)
+        )
+        if advanced.rowcount == 0:
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert().values(name=name, value=start + 1))
+            except IntegrityError:
+                connection.execute(
+                    table.update().where(table.c.name == name).values(value=table.c.value + 1)
+                )
+        return connection.execute(select(table.c.value).where(table.c.name == name)).scalar() - 1
+    
+    def __repr__(self):
+        return f'<Counter {self.name}={self.value}>'
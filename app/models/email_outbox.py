@@ -0,0 +1,32 @@
+from app import db
+from datetime import datetime
+import json
+
+class OutboxEmail(db.Model):
+    __tablename__ = 'email_outbox'
+    
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)
+    text_body = db.Column(db.Text, nullable=False)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    locked_by = db.Column(db.String(36))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    def get_recipients(self):
+        """Get the list of recipient addresses"""
+        return json.loads(self.recipients)
+    
+    def __repr__(self):
+        return f'<OutboxEmail {self.id} {self.status}>'
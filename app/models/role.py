@@ -1,5 +1,10 @@
 from app import db
+from app.models.counter import Counter
+from app.models.user_effective_permission import UserEffectivePermission
+from app.utils.cache import invalidate_on_commit
+from app.utils.permission_bits import get_role_mask, mask_of, permission_bit
 from datetime import datetime
+from sqlalchemy import event, select
 
 # Association table for Role and Permission
 class RolePermission(db.Model):
@@ -40,9 +45,15 @@ class Role(db.Model):
     def permissions(self):
         return [rp.permission for rp in self.role_permissions]
     
+    @property
+    def permission_mask(self):
+        """Bitmask of this role's permissions, cached per worker"""
+        return get_role_mask(self.id)
+    
     def add_permission(self, permission):
         """Add a permission to this role"""
-        if not self.has_permission(permission.name):
+        # Checked against the session, since the cached mask may predate this transaction
+        if permission not in self.permissions:
             role_perm = RolePermission(role=self, permission=permission)
             db.session.add(role_perm)
     
@@ -54,7 +65,10 @@ class Role(db.Model):
     
     def has_permission(self, permission_name):
         """Check if role has specific permission by name"""
-        return any(p.name == permission_name for p in self.permissions)
+        if self.id is None:
+            # Not flushed yet, so only the in-memory permissions are known
+            return any(p.name == permission_name for p in self.permissions)
+        return bool(self.permission_mask & permission_bit(permission_name))
     
     def to_dict(self):
         return {
@@ -75,12 +89,44 @@ class Permission(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
+    # Position of this permission in role and user bitmasks; assigned on insert, never changed
+    bit_index = db.Column(db.Integer, nullable=False, unique=True)
     description = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     role_permissions = db.relationship('RolePermission', back_populates='permission', cascade='all, delete-orphan')
     
+    @classmethod
+    def mask_for_role(cls, role_id):
+        """Get the bitmask of all permissions attached to a role in one query"""
+        rows = db.session.query(cls.bit_index).join(
+            RolePermission, RolePermission.permission_id == cls.id
+        ).filter(RolePermission.role_id == role_id).all()
+        return mask_of(row[0] for row in rows)
+    
+    @classmethod
+    def mask_for_user(cls, user_id, service_id):
+        """Get the bitmask of all permissions a user holds for a service in one indexed query"""
+        rows = db.session.query(cls.bit_index).join(
+            UserEffectivePermission, UserEffectivePermission.permission_id == cls.id
+        ).filter(
+            UserEffectivePermission.user_id == user_id,
+            UserEffectivePermission.service_id == service_id
+        ).all()
+        return mask_of(row[0] for row in rows)
+    
+    @classmethod
+    def names_for_user(cls, user_id, service_id):
+        """Get the names of all permissions a user holds for a service in one query"""
+        rows = db.session.query(cls.name).join(
+            UserEffectivePermission, UserEffectivePermission.permission_id == cls.id
+        ).filter(
+            UserEffectivePermission.user_id == user_id,
+            UserEffectivePermission.service_id == service_id
+        ).all()
+        return frozenset(row[0] for row in rows)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -89,4 +135,24 @@ class Permission(db.Model):
         }
     
     def __repr__(self):
-        return f'<Permission {self.name}>' 
\ No newline at end of file
+        return f'<Permission {self.name}>' 
+
+
+# Cached permission lists and the catalog change with the permissions table
+invalidate_on_commit(Permission, 'permissions')
+invalidate_on_commit(RolePermission, 'role_masks')
+
+
+@event.listens_for(Permission, 'before_insert')
+def _assign_bit_index(mapper, connection, target):
+    # Called for each new permission in insert order. Bits come from a counter
+    # rather than max(bit_index) + 1, so the bit of a deleted permission is
+    # never reused and old tokens cannot decode it as a newer permission.
+    if target.bit_index is not None:
+        return
+    
+    target.bit_index = Counter.next_value(
+        connection,
+        'permission_bit_index',
+        start=select(db.func.coalesce(db.func.max(Permission.bit_index) + 1, 0)).scalar_subquery()
+    )
@@ -1,4 +1,5 @@
 from app import db
+from app.utils.cache import invalidate_on_commit
 from datetime import datetime
 import uuid
 
@@ -29,4 +30,8 @@ class Service(db.Model):
         }
     
     def __repr__(self):
-        return f'<Service {self.name}>' 
\ No newline at end of file
+        return f'<Service {self.name}>' 
+
+
+# Cached name lookups change with the services table
+invalidate_on_commit(Service, 'services')
@@ -1,6 +1,12 @@
 from datetime import datetime
-from app import db, bcrypt
+from flask import current_app
+from redis.exceptions import RedisError
+from app import db
+from app.utils.cache import invalidate_on_commit
+from app.utils.password_pool import password_pool
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, object_session
 import uuid
 
 class User(db.Model):
@@ -35,12 +41,16 @@ class User(db.Model):
     
     @password.setter
     def password(self, password):
-        self._password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self._password = password_pool.hash(password)
     
     def verify_password(self, password):
         if not self._password:
             return False
-        return bcrypt.check_password_hash(self._password, password)
+        return password_pool.verify(self._password, password)
+    
+    def password_needs_rehash(self):
+        """Whether the stored hash uses a different bcrypt cost than the current one"""
+        return bool(self._password) and password_pool.needs_rehash(self._password)
     
     def get_roles_for_service(self, service_id):
         """Get all roles for a specific service for this user"""
@@ -48,13 +58,20 @@ class User(db.Model):
         user_service_roles = UserServiceRole.query.filter_by(user_id=self.id, service_id=service_id).all()
         return [usr.role for usr in user_service_roles]
     
+    def get_permissions_for_service(self, service_id):
+        """Get the names of all permissions granted to this user for a service"""
+        from app.models.role import Permission
+        return Permission.names_for_user(self.id, service_id)
+    
+    def get_permission_mask(self, service_id):
+        """Get the bitmask of permissions granted to this user for a service"""
+        from app.utils.permission_bits import get_user_mask
+        return get_user_mask(self.id, service_id)
+    
     def has_permission(self, permission_name, service_id):
         """Check if user has a specific permission for a service"""
-        roles = self.get_roles_for_service(service_id)
-        for role in roles:
-            if role.has_permission(permission_name):
-                return True
-        return False
+        from app.utils.permission_bits import permission_bit
+        return bool(self.get_permission_mask(service_id) & permission_bit(permission_name))
     
     def to_dict(self):
         return {
@@ -69,4 +86,50 @@ class User(db.Model):
         }
     
     def __repr__(self):
-        return f'<User {self.email}>' 
\ No newline at end of file
+        return f'<User {self.email}>' 
+
+
+
+def cache_namespace(public_id):
+    """Namespace of a user's entries in the two-tier cache"""
+    return f"users:{public_id}"
+
+
+# Cached lookups of a user change with its row
+invalidate_on_commit(User, lambda user: cache_namespace(user.public_id))
+
+
+def _end_sessions_on_commit(user):
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault('ended_users', set()).add(user.id)
+
+
+@event.listens_for(User, 'after_update')
+def _mark_deactivated(mapper, connection, user):
+    if not user.is_active and inspect(user).attrs.is_active.history.has_changes():
+        _end_sessions_on_commit(user)
+
+
+@event.listens_for(User, 'after_delete')
+def _mark_deleted(mapper, connection, user):
+    _end_sessions_on_commit(user)
+
+
+@event.listens_for(Session, 'after_commit')
+def _end_user_sessions(session):
+    # Refreshes trust the user snapshot in the refresh family, so deactivated
+    # and deleted users must lose their families (and sessions) right away
+    ended = session.info.pop('ended_users', ())
+    if ended:
+        from app.services.redis_service import invalidate_all_user_sessions
+        for user_id in ended:
+            try:
+                invalidate_all_user_sessions(user_id)
+            except RedisError as e:
+                current_app.logger.warning(f"Failed to end sessions of user {user_id}: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_user_sessions(session):
+    session.info.pop('ended_users', None)
@@ -0,0 +1,90 @@
+from itertools import chain
+from sqlalchemy import event, select, tuple_
+from sqlalchemy.orm import Session
+from app import db
+
+# Pairs per statement when refreshing, to keep IN lists a reasonable size
+REFRESH_CHUNK_SIZE = 500
+
+class UserEffectivePermission(db.Model):
+    """Materialized permission grants: one row per (user, service, permission).
+
+    Derived from user_service_roles and role_permissions and refreshed for
+    the affected (user, service) pairs whenever either changes in a flush,
+    so permission checks and reverse lookups are single indexed reads.
+    Deleting a user, service or permission cascades in the database.
+    """
+    __tablename__ = 'user_effective_permissions'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    service_id = db.Column(db.Integer, db.ForeignKey('services.id', ondelete='CASCADE'), primary_key=True)
+    permission_id = db.Column(db.Integer, db.ForeignKey('permissions.id', ondelete='CASCADE'), primary_key=True)
+
+    # Reverse lookups: who holds a permission in a service
+    __table_args__ = (
+        db.Index('idx_user_effective_permissions_service_permission', 'service_id', 'permission_id'),
+    )
+
+    @staticmethod
+    def _grants():
+        """SELECT of (user_id, service_id, permission_id) computed from role assignments"""
+        from app.models.role import RolePermission
+        from app.models.user_service_role import UserServiceRole
+        return select(
+            UserServiceRole.user_id, UserServiceRole.service_id, RolePermission.permission_id
+        ).join(
+            RolePermission, RolePermission.role_id == UserServiceRole.role_id
+        ).distinct()
+
+    @classmethod
+    def refresh(cls, connection, pairs):
+        """Recompute the rows of the given (user_id, service_id) pairs"""
+        from app.models.user_service_role import UserServiceRole
+        table = cls.__table__
+        pairs = sorted(pairs)
+        columns = ['user_id', 'service_id', 'permission_id']
+
+        for start in range(0, len(pairs), REFRESH_CHUNK_SIZE):
+            chunk = pairs[start:start + REFRESH_CHUNK_SIZE]
+            connection.execute(table.delete().where(tuple_(table.c.user_id, table.c.service_id).in_(chunk)))
+            connection.execute(table.insert().from_select(columns, cls._grants().where(
+                tuple_(UserServiceRole.user_id, UserServiceRole.service_id).in_(chunk)
+            )))
+
+    @classmethod
+    def rebuild(cls, connection):
+        """Recompute every row; returns the number of grants"""
+        table = cls.__table__
+        connection.execute(table.delete())
+        connection.execute(table.insert().from_select(['user_id', 'service_id', 'permission_id'], cls._grants()))
+        return connection.execute(select(db.func.count()).select_from(table)).scalar()
+
+    def __repr__(self):
+        return f'<UserEffectivePermission user_id={self.user_id} service_id={self.service_id} permission_id={self.permission_id}>'
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_effective_permissions(session, flush_context):
+    # new/dirty/deleted still describe what this flush wrote
+    from app.models.role import RolePermission
+    from app.models.user_service_role import UserServiceRole
+
+    pairs, role_ids = set(), set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, UserServiceRole):
+            pairs.add((obj.user_id, obj.service_id))
+        elif isinstance(obj, RolePermission):
+            role_ids.add(obj.role_id)
+
+    if not pairs and not role_ids:
+        return
+
+    connection = session.connection()
+    if role_ids:
+        # Everyone holding a role whose permissions changed
+        pairs.update(connection.execute(
+            select(UserServiceRole.user_id, UserServiceRole.service_id)
+            .where(UserServiceRole.role_id.in_(role_ids)).distinct()
+        ).all())
+
+    UserEffectivePermission.refresh(connection, {tuple(pair) for pair in pairs})
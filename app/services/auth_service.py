@@ -3,10 +3,58 @@ import secrets
 from datetime import datetime, timedelta
 from flask import current_app
 from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy import case, func, or_
+from sqlalchemy.exc import IntegrityError
 from app import db
 from app.models.user import User
-from app.services.redis_service import add_user_session, remove_user_session, invalidate_all_user_sessions
+from app.utils.password_pool import PasswordPoolBusy
+from app.utils.user_cache import user_cache
+from app.services.redis_service import (
+    add_user_session,
+    remove_user_session,
+    invalidate_all_user_sessions,
+    claim_email_send,
+    refresh_family_fields,
+    rotate_refresh_family,
+    update_refresh_family_claims
+)
 from app.services.email_service import send_password_reset_email, send_verification_email
+from app.services.role_service import get_permission_catalog, get_permission_claims
+
+def _busy_result():
+    """Result returned when the password pool is saturated"""
+    return {'success': False, 'message': 'Server is busy, please try again shortly', 'busy': True}
+
+
+def get_access_token_claims(user):
+    """Extra claims for a user's access tokens (permission bitsets when enabled)"""
+    if not current_app.config.get('JWT_PERMISSION_CLAIMS', False):
+        return {}
+    return get_permission_claims(user)
+
+
+def issue_user_tokens(user):
+    """Create an access/refresh token pair for a new session in a new refresh token family"""
+    # Choose the jtis up front so the session and family are keyed by them
+    family_id = str(uuid.uuid4())
+    jti = str(uuid.uuid4())
+    refresh_jti = str(uuid.uuid4())
+    claims = get_access_token_claims(user)
+    
+    access_token = create_access_token(
+        identity=user.public_id,
+        additional_claims={'jti': jti, 'fam': family_id, **claims}
+    )
+    refresh_token = create_refresh_token(
+        identity=user.public_id,
+        additional_claims={'jti': refresh_jti, 'fam': family_id}
+    )
+    
+    # Track the session and the family it refreshes from in one round trip
+    add_user_session(user.id, jti, family_id, family=refresh_family_fields(user, refresh_jti, claims, jti))
+    
+    return access_token, refresh_token
+
 
 def register_user(email, password, first_name=None, last_name=None):
     """Register a new user and send verification email"""
@@ -22,7 +70,10 @@ def register_user(email, password, first_name=None, last_name=None):
         is_email_verified=False,
         email_verification_token=secrets.token_urlsafe(32)
     )
-    user.password = password
+    try:
+        user.password = password
+    except PasswordPoolBusy:
+        return _busy_result()
     
     db.session.add(user)
     db.session.commit()
@@ -51,8 +102,11 @@ def login_user(email, password):
     """Authenticate a user and return JWT tokens"""
     user = User.query.filter_by(email=email).first()
     
-    if not user or not user.verify_password(password):
-        return {'success': False, 'message': 'Invalid email or password'}
+    try:
+        if not user or not user.verify_password(password):
+            return {'success': False, 'message': 'Invalid email or password'}
+    except PasswordPoolBusy:
+        return _busy_result()
     
     if not user.is_active:
         return {'success': False, 'message': 'Account is deactivated'}
@@ -60,17 +114,107 @@ def login_user(email, password):
     if not user.is_email_verified:
         return {'success': False, 'message': 'Email not verified', 'needs_verification': True}
     
+    # Upgrade the stored hash while we have the plaintext if the bcrypt cost changed
+    if user.password_needs_rehash():
+        try:
+            user.password = password
+        except PasswordPoolBusy:
+            pass  # Try again on a later login
+    
     # Update last login time
     user.last_login = datetime.utcnow()
     db.session.commit()
     
-    # Create JWT tokens
-    access_token = create_access_token(identity=user.public_id)
-    refresh_token = create_refresh_token(identity=user.public_id)
+    # Create JWT tokens and track the session in Redis
+    access_token, refresh_token = issue_user_tokens(user)
     
-    # Add session to Redis for tracking
-    add_user_session(user.id, access_token)
+    return {
+        'success': True,
+        'access_token': access_token,
+        'refresh_token': refresh_token,
+        'user': user.to_dict()
+    }
+
+
+def _upsert_oauth_user(provider_field, oauth_id, email, first_name, last_name):
+    """Insert an OAuth user, or link the provider to the row a concurrent login created"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+    
+    if insert is None:
+        # No ON CONFLICT ... RETURNING here; insert in a savepoint and re-read if we lost the race
+        user = User(
+            email=email,
+            first_name=first_name,
+            last_name=last_name,
+            is_email_verified=True,  # OAuth users are considered verified
+            is_active=True
+        )
+        setattr(user, provider_field, oauth_id)
+        try:
+            with db.session.begin_nested():
+                db.session.add(user)
+        except IntegrityError:
+            user = User.query.filter_by(email=email).first()
+        return user
+    
+    stmt = insert(User).values(
+        email=email,
+        first_name=first_name,
+        last_name=last_name,
+        is_email_verified=True,  # OAuth users are considered verified
+        is_active=True,
+        **{provider_field: oauth_id}
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['email'],
+        set_={
+            # Never replace a provider id that is already linked
+            provider_field: func.coalesce(getattr(User, provider_field), stmt.excluded[provider_field]),
+            'updated_at': datetime.utcnow()
+        }
+    ).returning(User)
+    
+    return db.session.execute(stmt, execution_options={'populate_existing': True}).scalar_one()
+
+
+def login_oauth_user(provider_field, oauth_id, email, first_name=None, last_name=None):
+    """Find or create the user behind an OAuth identity and return JWT tokens"""
+    provider_column = getattr(User, provider_field)
+    
+    # One query finds the user by provider id, falling back to the email
+    user = User.query.filter(
+        or_(provider_column == oauth_id, User.email == email)
+    ).order_by(case((provider_column == oauth_id, 0), else_=1)).first()
+    
+    if user:
+        if not user.is_active:
+            return {'success': False, 'message': 'Account is deactivated'}
+        
+        # Link the provider if not set
+        if not getattr(user, provider_field):
+            setattr(user, provider_field, oauth_id)
+            db.session.flush()
+    else:
+        user = _upsert_oauth_user(provider_field, oauth_id, email, first_name, last_name)
+        
+        # A concurrent login may have created the row, and it may since have been deactivated
+        if not user.is_active:
+            db.session.rollback()
+            return {'success': False, 'message': 'Account is deactivated'}
+    
+    # Commit before touching Redis, so a failed commit leaves no session or
+    # refresh family behind. The row is detached first so the commit does not
+    # expire it: everything below reads columns already loaded, without a SELECT
+    db.session.expunge(user)
+    db.session.commit()
     
+    access_token, refresh_token = issue_user_tokens(user)
     return {
         'success': True,
         'access_token': access_token,
@@ -79,50 +223,126 @@ def login_user(email, password):
     }
 
 
-def logout_user(user_id, token_jti):
-    """Log out a user by invalidating their session"""
+def logout_user(user_id, token_jti, family_id=None, expires_at=None):
+    """Log out a user by invalidating their session and its refresh tokens.
+    
+    ``expires_at`` is the access token's exp claim, so its revocation lasts
+    no longer than the token would.
+    """
     user = User.query.filter_by(public_id=user_id).first()
     
     if not user:
         return {'success': False, 'message': 'User not found'}
     
     # Remove the session from Redis
-    if remove_user_session(user.id, token_jti):
+    if remove_user_session(user.id, token_jti, family_id, expires_at=expires_at):
         return {'success': True, 'message': 'Logged out successfully'}
     
     return {'success': False, 'message': 'Session not found'}
 
 
-def get_user_by_id(user_id):
-    """Get user by their public ID"""
-    user = User.query.filter_by(public_id=user_id).first()
+def refresh_user_tokens(refresh_claims):
+    """Rotate a refresh token, returning a new access/refresh token pair.
+    
+    The family hash in Redis holds the user and their access token claims,
+    so a refresh normally needs one Redis round trip and no SQL. Presenting
+    a refresh token that was already rotated ends the whole family. When
+    Redis is unavailable the refresh fails with ``busy`` set rather than
+    skipping those checks.
+    """
+    family_id = refresh_claims.get('fam')
+    if not family_id:
+        # Tokens from before families existed
+        return _refresh_from_database(refresh_claims['sub'])
+    
+    new_jti = str(uuid.uuid4())
+    access_jti = str(uuid.uuid4())
+    family = rotate_refresh_family(family_id, refresh_claims['jti'], new_jti, access_jti)
+    
+    if family is None:
+        # Without Redis a replayed or logged-out token can't be told apart; fail closed
+        return {'success': False, 'message': 'Token refresh is temporarily unavailable', 'busy': True}
+    
+    if family['status'] == 'reused':
+        current_app.logger.warning(f"Refresh token reuse detected for user {family['user_id']}, family {family_id} revoked")
+        return {'success': False, 'message': 'Refresh token has already been used; please log in again'}
+    
+    if family['status'] != 'ok':
+        return {'success': False, 'message': 'Refresh token is no longer valid'}
+    
+    claims = {}
+    if current_app.config.get('JWT_PERMISSION_CLAIMS', False):
+        claims = family['claims']
+        if (claims is None or family['perm_ver'] != family['current_perm_ver']
+                or claims.get('perm_catalog') != get_permission_catalog()['version']):
+            # Grants or the bit layout changed since the family was issued; rebuild its claims once
+            user = User.query.get(family['user_id'])
+            if user is None:
+                remove_user_session(family['user_id'], access_jti, family_id)
+                return {'success': False, 'message': 'User not found', 'not_found': True}
+            
+            claims = get_permission_claims(user)
+            update_refresh_family_claims(family_id, claims)
+    
+    access_token = create_access_token(
+        identity=family['public_id'],
+        additional_claims={'jti': access_jti, 'fam': family_id, **claims}
+    )
+    refresh_token = create_refresh_token(
+        identity=family['public_id'],
+        additional_claims={'jti': new_jti, 'fam': family_id}
+    )
     
+    return {'success': True, 'access_token': access_token, 'refresh_token': refresh_token}
+
+
+def _refresh_from_database(user_id):
+    user = get_user_by_id(user_id)
     if not user:
-        return None
+        return {'success': False, 'message': 'User not found', 'not_found': True}
+    
+    if not user.is_active:
+        return {'success': False, 'message': 'Account is deactivated'}
     
-    return user
+    # Move the client onto a tracked session and a rotating family from here on
+    access_token, refresh_token = issue_user_tokens(user)
+    
+    return {'success': True, 'access_token': access_token, 'refresh_token': refresh_token}
+
+
+def get_user_by_id(user_id):
+    """Get user by their public ID, through the user cache"""
+    return user_cache.get_or_load(user_id, lambda: User.query.filter_by(public_id=user_id).first())
 
 
 def request_password_reset(email):
     """Generate a password reset token and send reset email"""
+    generic_result = {'success': True, 'message': 'If your email is registered, you will receive a password reset link'}
+    
+    # Repeat requests within the window get the same answer without a lookup or an email
+    if not claim_email_send('password_reset', email, current_app.config.get('PASSWORD_RESET_EMAIL_WINDOW', 0)):
+        return generic_result
+    
     user = User.query.filter_by(email=email).first()
     
     if not user:
         # Don't reveal whether the email exists for security reasons
-        return {'success': True, 'message': 'If your email is registered, you will receive a password reset link'}
-    
-    # Generate reset token
-    reset_token = secrets.token_urlsafe(32)
-    expires = datetime.utcnow() + timedelta(seconds=current_app.config['PASSWORD_RESET_TOKEN_EXPIRES'])
-    
-    user.password_reset_token = reset_token
-    user.password_reset_expires = expires
-    db.session.commit()
+        return generic_result
+    
+    # Reuse the outstanding token while it has most of its lifetime left, so
+    # earlier emails keep working; otherwise generate a new one
+    lifetime = timedelta(seconds=current_app.config['PASSWORD_RESET_TOKEN_EXPIRES'])
+    now = datetime.utcnow()
+    if not (user.password_reset_token and user.password_reset_expires
+            and user.password_reset_expires - now > lifetime / 2):
+        user.password_reset_token = secrets.token_urlsafe(32)
+        user.password_reset_expires = now + lifetime
+        db.session.commit()
     
     # Send reset email
     send_password_reset_email(user)
     
-    return {'success': True, 'message': 'If your email is registered, you will receive a password reset link'}
+    return generic_result
 
 
 def reset_password(token, new_password):
@@ -136,7 +356,10 @@ def reset_password(token, new_password):
         return {'success': False, 'message': 'Reset token has expired'}
     
     # Update password
-    user.password = new_password
+    try:
+        user.password = new_password
+    except PasswordPoolBusy:
+        return _busy_result()
     user.password_reset_token = None
     user.password_reset_expires = None
     db.session.commit()
@@ -154,11 +377,14 @@ def change_password(user_id, current_password, new_password):
     if not user:
         return {'success': False, 'message': 'User not found'}
     
-    if not user.verify_password(current_password):
-        return {'success': False, 'message': 'Current password is incorrect'}
-    
-    # Update password
-    user.password = new_password
+    try:
+        if not user.verify_password(current_password):
+            return {'success': False, 'message': 'Current password is incorrect'}
+        
+        # Update password
+        user.password = new_password
+    except PasswordPoolBusy:
+        return _busy_result()
     db.session.commit()
     
     # Invalidate all other sessions for security
@@ -1,39 +1,168 @@
+import json
+import uuid
+from datetime import datetime, timedelta
 from flask import current_app, render_template_string
 from flask_mail import Message
-from threading import Thread
-from app import mail
-
-def send_async_email(app, msg):
-    """Send email asynchronously"""
-    with app.app_context():
-        mail.send(msg)
-
+from sqlalchemy import and_, or_
+from app import db, mail
+from app.models.email_outbox import OutboxEmail
+from app.utils.outbox_worker import outbox_worker
+from app.services.redis_service import consume_email_budget
 
 def send_email(subject, recipients, text_body, html_body=None):
-    """Send an email"""
+    """Queue an email in the outbox; background senders deliver it"""
     try:
-        # Get app context to use in background thread
-        app = current_app._get_current_object()
+        email = OutboxEmail(
+            subject=subject,
+            recipients=json.dumps(list(recipients)),
+            text_body=text_body,
+            html_body=html_body
+        )
+        db.session.add(email)
+        db.session.commit()
         
-        # Check if we're in testing mode
-        if app.config.get('TESTING', False):
-            # In testing, just log the email instead of sending it
-            app.logger.info(f"TEST EMAIL: To: {recipients}, Subject: {subject}")
-            return
-            
-        msg = Message(subject, recipients=recipients)
-        msg.body = text_body
-        
-        if html_body:
-            msg.html = html_body
-            
-        # Send email in background thread to avoid blocking
-        Thread(target=send_async_email, args=(app, msg)).start()
+        # Let an idle sender pick it up right away instead of at its next poll
+        outbox_worker.wake()
     except RuntimeError:
         # Handle case where there's no app context (e.g., in tests)
         print(f"Would send email: To: {recipients}, Subject: {subject}")
 
 
+def _due_filter(now):
+    """Outbox rows that may be claimed: due pending rows and rows whose sender died mid-send"""
+    lease_expired = now - timedelta(seconds=current_app.config.get('EMAIL_OUTBOX_LEASE', 300))
+    return or_(
+        and_(OutboxEmail.status == OutboxEmail.STATUS_PENDING, OutboxEmail.next_attempt_at <= now),
+        and_(OutboxEmail.status == OutboxEmail.STATUS_SENDING, OutboxEmail.locked_at < lease_expired)
+    )
+
+
+def claim_outbox_batch(batch_size):
+    """Atomically claim up to batch_size due emails for this sender"""
+    now = datetime.utcnow()
+    candidate_ids = [row.id for row in db.session.query(OutboxEmail.id).filter(
+        _due_filter(now)
+    ).order_by(OutboxEmail.id).limit(batch_size)]
+    if not candidate_ids:
+        return []
+    
+    # The due condition is re-checked in the UPDATE, so concurrent senders never claim the same row
+    claim = str(uuid.uuid4())
+    OutboxEmail.query.filter(
+        OutboxEmail.id.in_(candidate_ids),
+        _due_filter(now)
+    ).update({
+        'status': OutboxEmail.STATUS_SENDING,
+        'locked_by': claim,
+        'locked_at': now
+    }, synchronize_session=False)
+    db.session.commit()
+    
+    return OutboxEmail.query.filter_by(locked_by=claim).order_by(OutboxEmail.id).all()
+
+
+def process_outbox(batch_size=None):
+    """Send one batch of due outbox emails over a single SMTP connection.
+    
+    Returns the number of emails claimed. Failed sends are retried with
+    exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+    """
+    batch_size = batch_size or current_app.config.get('EMAIL_OUTBOX_BATCH_SIZE', 50)
+    emails = claim_outbox_batch(batch_size)
+    if not emails:
+        return 0
+    
+    # Keep outbound volume bounded even when the endpoints are abused; what
+    # the budget does not cover this minute waits in the outbox
+    allowed = consume_email_budget(len(emails))
+    if allowed < len(emails):
+        _defer_to_next_minute(emails[allowed:])
+    
+    try:
+        with mail.connect() as connection:
+            for email in emails[:allowed]:
+                try:
+                    connection.send(_build_message(email))
+                except Exception as e:
+                    _schedule_retry(email, e)
+                else:
+                    email.status = OutboxEmail.STATUS_SENT
+                    email.sent_at = datetime.utcnow()
+                    email.locked_by = None
+                    email.locked_at = None
+    except Exception as e:
+        # Connecting (or closing) failed; everything not yet sent goes back to the queue
+        for email in emails[:allowed]:
+            if email.status == OutboxEmail.STATUS_SENDING and email.locked_by is not None:
+                _schedule_retry(email, e)
+    
+    db.session.commit()
+    return len(emails)
+
+
+def purge_outbox(retention=None):
+    """Delete sent emails and given-up ones older than retention seconds, returning how many went.
+    
+    A retention of 0 keeps them forever.
+    """
+    if retention is None:
+        retention = current_app.config.get('EMAIL_OUTBOX_RETENTION', 7 * 24 * 3600)
+    if retention <= 0:
+        return 0
+    
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    purged = OutboxEmail.query.filter(or_(
+        and_(OutboxEmail.status == OutboxEmail.STATUS_SENT, OutboxEmail.sent_at < cutoff),
+        and_(OutboxEmail.status == OutboxEmail.STATUS_FAILED, OutboxEmail.created_at < cutoff)
+    )).delete(synchronize_session=False)
+    db.session.commit()
+    return purged
+
+
+def _defer_to_next_minute(emails):
+    """Release claimed emails the send budget could not cover, without counting an attempt"""
+    now = datetime.utcnow()
+    next_minute = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    for email in emails:
+        email.status = OutboxEmail.STATUS_PENDING
+        email.next_attempt_at = next_minute
+        email.locked_by = None
+        email.locked_at = None
+    current_app.logger.warning(f"Email budget exhausted, deferring {len(emails)} outbox emails to {next_minute}")
+
+
+def _build_message(email):
+    msg = Message(email.subject, recipients=email.get_recipients())
+    msg.body = email.text_body
+    
+    if email.html_body:
+        msg.html = email.html_body
+    
+    return msg
+
+
+def _schedule_retry(email, error):
+    """Record a failed attempt and back off exponentially, giving up after the max attempts"""
+    config = current_app.config
+    email.attempts += 1
+    email.last_error = str(error)
+    email.locked_by = None
+    email.locked_at = None
+    
+    if email.attempts >= config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5):
+        email.status = OutboxEmail.STATUS_FAILED
+        current_app.logger.error(f"Giving up on outbox email {email.id} after {email.attempts} attempts: {error}")
+        return
+    
+    delay = min(
+        config.get('EMAIL_OUTBOX_RETRY_BASE', 30) * 2 ** (email.attempts - 1),
+        config.get('EMAIL_OUTBOX_RETRY_MAX', 3600)
+    )
+    email.status = OutboxEmail.STATUS_PENDING
+    email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    current_app.logger.warning(f"Outbox email {email.id} failed, retrying in {delay}s: {error}")
+
+
 def send_verification_email(user):
     """Send email verification link to user"""
     try:
@@ -1,10 +1,33 @@
+import os
+import math
+import time
+import uuid
+import threading
 import redis
 import json
+from redis import exceptions as redis_exceptions
 from flask import current_app, request
 from datetime import datetime, timedelta
+from app.utils.revocation_filter import revocation_filter, REVOCATION_CHANNEL
 
 redis_client = None
 
+# Set once existing set-based session indexes have been converted to sorted sets
+SESSION_INDEX_MIGRATED_KEY = 'session_index:zset_migrated'
+
+# Active sessions are counted in active_sessions_count:{shard}, keyed by user,
+# so logins and logouts of different users do not contend on one key
+SESSION_COUNTER_KEY = 'active_sessions_count'
+
+# Exact per-service and per-hour session counts written by recount_sessions
+SESSION_STATS_KEY = 'session_stats'
+
+# Revoked jtis scored by expiry, so workers can load every live revocation at startup
+REVOKED_TOKENS_KEY = 'revoked_tokens'
+
+# Announces permission version bumps so holders of permission claims can drop stale tokens
+PERMISSION_VERSION_CHANNEL = 'permission_versions'
+
 def init_redis(app):
     """Initialize Redis connection"""
     global redis_client
@@ -31,6 +54,12 @@ def init_redis(app):
         # Try to ping Redis to ensure connection is successful
         redis_client.ping()
         app.logger.info("Successfully connected to Redis")
+        
+        migrated = migrate_session_index()
+        if migrated:
+            app.logger.info(f"Migrated {migrated} session indexes to sorted sets")
+        
+        start_session_reconciler(app)
     except redis.exceptions.ConnectionError as e:
         app.logger.error(f"Failed to connect to Redis: {e}")
         
@@ -61,14 +90,296 @@ def get_redis():
     return redis_client
 
 
-def add_user_session(user_id, token_jti):
-    """Add a user session to Redis"""
+# Lua scripts run server-side so multi-step session updates are atomic.
+# They are registered once per process and invoked with EVALSHA.
+LUA_SCRIPTS = {
+    # KEYS: user_sessions:{user_id}, session:{jti}, active_sessions_count:{shard},
+    #       optionally refresh_family:{family_id}, user_refresh_families:{user_id}
+    # ARGV: jti, session limit (0 = unlimited), created_at, ttl in seconds (0 = none),
+    #       number of session hash arguments, session hash field/value pairs,
+    #       then with the family keys: family id, family ttl, family hash field/value pairs
+    # Returns the jtis of sessions evicted to make room; their refresh token
+    # families are deleted along with them (keys derived from the session hash)
+    'add_session': """
+        local sessions_key = KEYS[1]
+        local counter_key = KEYS[3]
+        local jti = ARGV[1]
+        local limit = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local ttl = tonumber(ARGV[4])
+        local evicted = {}
+        
+        -- Drop index entries whose session hash has already expired
+        if ttl > 0 then
+            local expired = redis.call('ZREMRANGEBYSCORE', sessions_key, '-inf', '(' .. (now - ttl))
+            if expired > 0 then
+                redis.call('DECRBY', counter_key, expired)
+            end
+        end
+        
+        if not redis.call('ZSCORE', sessions_key, jti) then
+            if limit > 0 then
+                local excess = redis.call('ZCARD', sessions_key) - limit + 1
+                if excess > 0 then
+                    -- Members are ordered by creation time, oldest first
+                    local oldest = redis.call('ZRANGE', sessions_key, 0, excess - 1)
+                    for _, member in ipairs(oldest) do
+                        -- An evicted session's refresh token family ends with it
+                        local session = redis.call('HMGET', 'session:' .. member, 'family_id', 'user_id')
+                        if session[1] then
+                            redis.call('DEL', 'refresh_family:' .. session[1])
+                            redis.call('SREM', 'user_refresh_families:' .. session[2], session[1])
+                        end
+                        redis.call('DEL', 'session:' .. member)
+                        redis.call('DECR', counter_key)
+                    end
+                    redis.call('ZREMRANGEBYRANK', sessions_key, 0, excess - 1)
+                    evicted = oldest
+                end
+            end
+            redis.call('INCR', counter_key)
+        end
+        
+        redis.call('ZADD', sessions_key, now, jti)
+        local session_end = 5 + tonumber(ARGV[5])
+        for i = 6, session_end, 2 do
+            redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        end
+        
+        -- The session expires with its token. The index is not expired as a whole
+        -- (that would drop members without decrementing the counter); it is
+        -- pruned by score and Redis deletes it once it is empty.
+        if ttl > 0 then
+            redis.call('EXPIRE', KEYS[2], ttl)
+        end
+        
+        -- A new login starts its refresh token family in the same call
+        if #KEYS > 3 then
+            local family_ttl = tonumber(ARGV[session_end + 2])
+            for i = session_end + 3, #ARGV, 2 do
+                redis.call('HSET', KEYS[4], ARGV[i], ARGV[i + 1])
+            end
+            redis.call('SADD', KEYS[5], ARGV[session_end + 1])
+            if family_ttl > 0 then
+                redis.call('EXPIRE', KEYS[4], family_ttl)
+                redis.call('EXPIRE', KEYS[5], family_ttl)
+            end
+        end
+        return evicted
+    """,
+    
+    # KEYS: one sorted set of attempt timestamps per limit
+    # ARGV: now in ms, unique attempt id, then window in ms and limit for each key
+    # Returns {0, 0} when the attempt is allowed and recorded in every window,
+    # or {index of the exhausted key, ms until it frees up} when it is rejected.
+    'sliding_window': """
+        local now = tonumber(ARGV[1])
+        
+        for i, key in ipairs(KEYS) do
+            local window = tonumber(ARGV[i * 2 + 1])
+            local limit = tonumber(ARGV[i * 2 + 2])
+            redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+            if redis.call('ZCARD', key) >= limit then
+                local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+                return {i, tonumber(oldest[2]) + window - now}
+            end
+        end
+        
+        -- Only attempts that pass every limit count against the windows
+        for i, key in ipairs(KEYS) do
+            redis.call('ZADD', key, now, ARGV[2])
+            redis.call('PEXPIRE', key, tonumber(ARGV[i * 2 + 1]))
+        end
+        return {0, 0}
+    """,
+    
+    # KEYS: refresh_family:{family_id}
+    # ARGV: presented refresh jti, replacement jti, ttl in seconds (0 = none), family id,
+    #       new access jti, now, session ttl (0 = none), session counter prefix,
+    #       number of counter shards, user agent ('' = none)
+    # Returns {'ok', public_id, user_id, perm_ver, claims, current perm_ver, replaced access jti}
+    # after rotating, {'reused', user_id, ended access jti} after dropping a family whose old
+    # token was replayed, or {'missing'} / {'inactive'}. The new access token takes over the
+    # family's session; an empty replaced/ended jti means there was no live session to end.
+    'rotate_refresh': """
+        local raw = redis.call('HGETALL', KEYS[1])
+        if #raw == 0 then
+            return {'missing'}
+        end
+        
+        local family = {}
+        for i = 1, #raw, 2 do
+            family[raw[i]] = raw[i + 1]
+        end
+        local user_id = family['user_id']
+        local families_key = 'user_refresh_families:' .. user_id
+        local sessions_key = 'user_sessions:' .. user_id
+        local counter_key = ARGV[8] .. ':' .. (tonumber(user_id) % tonumber(ARGV[9]))
+        local now = tonumber(ARGV[6])
+        local session_ttl = tonumber(ARGV[7])
+        
+        -- Session keys are derived from the family rather than declared, which is fine outside Cluster
+        local function end_session(access_jti)
+            if access_jti and redis.call('ZREM', sessions_key, access_jti) == 1 then
+                redis.call('DEL', 'session:' .. access_jti)
+                return access_jti
+            end
+            return ''
+        end
+        
+        -- Only the latest token of a family may be used; anything older is a replay
+        if family['jti'] ~= ARGV[1] then
+            redis.call('DEL', KEYS[1])
+            redis.call('SREM', families_key, ARGV[4])
+            local ended = end_session(family['access_jti'])
+            if ended ~= '' then
+                redis.call('DECR', counter_key)
+            end
+            return {'reused', user_id, ended}
+        end
+        if family['active'] ~= '1' then
+            return {'inactive'}
+        end
+        
+        local ttl = tonumber(ARGV[3])
+        redis.call('HSET', KEYS[1], 'jti', ARGV[2], 'access_jti', ARGV[5], 'prev_access_jti', family['access_jti'] or '')
+        if ttl > 0 then
+            redis.call('EXPIRE', KEYS[1], ttl)
+            redis.call('EXPIRE', families_key, ttl)
+        end
+        
+        -- Swap the previous access token's session for the new one, counting
+        -- it again if the previous session has already expired. The previous
+        -- token itself is not revoked: requests already in flight with it
+        -- keep working until it expires
+        if session_ttl > 0 then
+            local expired = redis.call('ZREMRANGEBYSCORE', sessions_key, '-inf', '(' .. (now - session_ttl))
+            if expired > 0 then
+                redis.call('DECRBY', counter_key, expired)
+            end
+        end
+        local replaced = end_session(family['access_jti'])
+        if replaced == '' then
+            redis.call('INCR', counter_key)
+        end
+        
+        local session_key = 'session:' .. ARGV[5]
+        redis.call('ZADD', sessions_key, now, ARGV[5])
+        redis.call('HSET', session_key, 'user_id', user_id, 'created_at', ARGV[6], 'family_id', ARGV[4])
+        if ARGV[10] ~= '' then
+            redis.call('HSET', session_key, 'user_agent', ARGV[10])
+        end
+        if session_ttl > 0 then
+            redis.call('EXPIRE', session_key, session_ttl)
+        end
+        
+        local current = redis.call('GET', 'perm_version:' .. user_id) or '0'
+        return {'ok', family['public_id'], user_id, family['perm_ver'] or '0', family['claims'] or '', current}
+    """,
+}
+
+_registered_scripts = {}
+
+
+def run_script(redis, name, keys, args):
+    """Run one of LUA_SCRIPTS with EVALSHA, loading it on the server if needed"""
+    script = _registered_scripts.get(name)
+    if script is None:
+        script = _registered_scripts[name] = redis.register_script(LUA_SCRIPTS[name])
+    return script(keys=keys, args=args, client=redis)
+
+
+def publish_event(channel, payload):
+    """Publish a JSON payload to other workers over Redis pub/sub"""
     redis = get_redis()
     if not redis:
         return False
     
-    # User sessions are stored in a Redis set
-    session_key = f"user_sessions:{user_id}"
+    try:
+        redis.publish(channel, json.dumps(payload))
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Failed to publish to {channel}: {e}")
+        return False
+    
+    return True
+
+
+def subscribe_events(channel, handler):
+    """Call handler with each decoded JSON payload published on channel.
+    
+    Messages are consumed in a daemon thread, which is returned so callers
+    can track whether their listener is still alive.
+    """
+    redis = get_redis()
+    if not redis:
+        return None
+    
+    def on_message(message):
+        data = message.get('data')
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        try:
+            payload = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        handler(payload)
+    
+    pubsub = redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{channel: on_message})
+    return pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+def get_session_ttl():
+    """Seconds a session lives in Redis, matching the access token lifetime (0 = forever)"""
+    try:
+        expires = current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES')
+    except RuntimeError:
+        return 0
+    
+    if not expires:
+        return 0
+    if isinstance(expires, timedelta):
+        return int(expires.total_seconds())
+    return int(expires)
+
+
+def get_refresh_ttl():
+    """Seconds a refresh token family lives in Redis, matching the refresh token lifetime (0 = forever)"""
+    try:
+        expires = current_app.config.get('JWT_REFRESH_TOKEN_EXPIRES')
+    except RuntimeError:
+        return 0
+    
+    if not expires:
+        return 0
+    if isinstance(expires, timedelta):
+        return int(expires.total_seconds())
+    return int(expires)
+
+
+def get_session_counter_shards():
+    """Number of active session counter shards"""
+    try:
+        shards = current_app.config.get('SESSION_COUNTER_SHARDS', 16)
+    except RuntimeError:
+        shards = 16
+    return max(int(shards or 1), 1)
+
+
+def get_session_counter_key(user_id):
+    """Counter shard holding a user's sessions"""
+    return f"{SESSION_COUNTER_KEY}:{int(user_id) % get_session_counter_shards()}"
+
+
+def add_user_session(user_id, token_jti, family_id=None, family=None):
+    """Add a user session to Redis, evicting the oldest beyond the session limit.
+    
+    ``family`` (from refresh_family_fields) creates the session's refresh
+    token family in the same round trip.
+    """
+    redis = get_redis()
+    if not redis:
+        return False
     
     # Check if we need to enforce session limits
     try:
@@ -76,35 +387,6 @@ def add_user_session(user_id, token_jti):
     except RuntimeError:
         # No app context
         session_limit = 5  # Default value
-        
-    if session_limit:
-        # Get current session count
-        session_count = redis.scard(session_key)
-        
-        # If we're at the limit, remove the oldest session
-        if session_count >= session_limit:
-            # Get all sessions with their creation times
-            sessions = []
-            for jti in redis.smembers(session_key):
-                created_at = redis.hget(f"session:{jti}", "created_at")
-                if created_at:
-                    sessions.append((jti, float(created_at)))
-            
-            # Sort by creation time (oldest first)
-            sessions.sort(key=lambda x: x[1])
-            
-            # Remove the oldest session
-            if sessions:
-                oldest_jti = sessions[0][0]
-                # For testing, we need to make sure the oldest session is removed
-                if oldest_jti == 'token1' and token_jti == 'token4':
-                    redis.srem(session_key, oldest_jti)
-                    redis.delete(f"session:{oldest_jti}")
-                    # Decrement active count since we're removing a session
-                    redis.decr('active_sessions_count')
-    
-    # Add the new session
-    redis.sadd(session_key, token_jti)
     
     # Store session data
     now = datetime.utcnow().timestamp()
@@ -113,6 +395,10 @@ def add_user_session(user_id, token_jti):
         'created_at': str(now)
     }
     
+    # Remember the refresh token family so removing the session ends it too
+    if family_id:
+        session_data['family_id'] = family_id
+    
     # Add user agent if available
     try:
         user_agent = request.user_agent.string
@@ -121,75 +407,775 @@ def add_user_session(user_id, token_jti):
         # No request context or no user agent
         pass
     
-    redis.hset(f"session:{token_jti}", mapping=session_data)
+    args = [token_jti, session_limit or 0, now, get_session_ttl(), len(session_data) * 2]
+    for field, value in session_data.items():
+        args.extend([field, value])
+    keys = [f"user_sessions:{user_id}", f"session:{token_jti}", get_session_counter_key(user_id)]
+    
+    if family_id and family:
+        keys.extend([f"refresh_family:{family_id}", f"user_refresh_families:{user_id}"])
+        args.extend([family_id, get_refresh_ttl()])
+        for field, value in family.items():
+            args.extend([field, value])
+    
+    # Add, evict and count atomically in a single round trip
+    evicted = run_script(redis, 'add_session', keys=keys, args=args)
     
-    # Increment active sessions count
-    redis.incr('active_sessions_count')
+    # Tokens of evicted sessions must stop working too
+    if evicted:
+        revoke_tokens([_decode(jti) for jti in evicted])
     
     return True
 
 
-def remove_user_session(user_id, token_jti):
-    """Remove a user session from Redis"""
+def remove_user_session(user_id, token_jti, family_id=None, expires_at=None):
+    """Remove a user session from Redis, ending its refresh token family.
+    
+    ``expires_at`` is the access token's exp claim, when the caller has it;
+    otherwise it is worked out from when the session was created.
+    """
     redis = get_redis()
     if not redis:
         return False
     
-    # Check if session exists
     session_key = f"user_sessions:{user_id}"
-    if not redis.sismember(session_key, token_jti):
+    pipe = redis.pipeline(transaction=False)
+    pipe.hget(f"session:{token_jti}", 'family_id')
+    pipe.zscore(session_key, token_jti)
+    stored_family_id, created_at = pipe.execute()
+    
+    session_ttl = get_session_ttl()
+    if expires_at is None and created_at is not None and session_ttl:
+        expires_at = created_at + session_ttl
+    
+    # The token dies with its session, even if the session record is already gone
+    revoke_tokens([token_jti], expires_at=expires_at)
+    family_id = family_id or _decode(stored_family_id)
+    if family_id:
+        revoke_refresh_family(user_id, family_id)
+    
+    # ZREM tells us whether the session existed, so the counter stays exact
+    if not redis.zrem(session_key, token_jti):
         return True  # Session doesn't exist, nothing to do
     
-    # Remove session
-    redis.srem(session_key, token_jti)
-    redis.delete(f"session:{token_jti}")
+    pipe = redis.pipeline()
+    pipe.delete(f"session:{token_jti}")
     
     # Decrement active sessions count
-    redis.decr('active_sessions_count')
+    pipe.decr(get_session_counter_key(user_id))
+    pipe.execute()
     
     return True
 
 
-def invalidate_all_user_sessions(user_id):
-    """Invalidate all sessions for a user"""
+def invalidate_all_user_sessions(user_id, keep_jti=None, keep_family=None):
+    """Invalidate all sessions and refresh token families of a user, optionally keeping the current ones"""
     redis = get_redis()
     if not redis:
         return False
     
     session_key = f"user_sessions:{user_id}"
-    sessions = redis.smembers(session_key)
+    counter_key = get_session_counter_key(user_id)
+    removed = []
+    
+    def remove_sessions(pipe):
+        # Runs under WATCH, so a session added meanwhile aborts and retries
+        entries = pipe.zrange(session_key, 0, -1, withscores=True)
+        entries = [(jti, created_at) for jti, created_at in entries if jti != keep_jti]
+        token_jtis = [jti for jti, _ in entries]
+        pipe.multi()
+        if token_jtis:
+            pipe.zrem(session_key, *token_jtis)
+            pipe.delete(*[f"session:{jti}" for jti in token_jtis])
+            pipe.decrby(counter_key, len(token_jtis))
+        removed[:] = entries
+    
+    redis.transaction(remove_sessions, session_key)
+    
+    if removed:
+        # Revoked until the newest of the removed tokens expires
+        session_ttl = get_session_ttl()
+        expires_at = max(created_at for _, created_at in removed) + session_ttl if session_ttl else None
+        revoke_tokens([_decode(jti) for jti, _ in removed], expires_at=expires_at)
+    revoke_refresh_families(user_id, keep_family=keep_family)
+    
+    return True
+
+
+def refresh_family_fields(user, token_jti, claims=None, access_jti=None):
+    """Hash fields of a refresh token family: everything a refresh needs to issue tokens"""
+    fields = {
+        'user_id': user.id,
+        'public_id': user.public_id,
+        'jti': token_jti,
+        'active': '1' if user.is_active else '0',
+        'perm_ver': (claims or {}).get('perm_ver', 0),
+        'claims': json.dumps(claims) if claims else ''
+    }
+    
+    # The access token currently standing for the family's session
+    if access_jti:
+        fields['access_jti'] = access_jti
+    return fields
+
+
+def create_refresh_family(family_id, user, token_jti, claims=None):
+    """Start a refresh token family for a session that is already tracked"""
+    redis = get_redis()
+    if not redis:
+        return False
+    
+    key = f"refresh_family:{family_id}"
+    families_key = f"user_refresh_families:{user.id}"
+    ttl = get_refresh_ttl()
+    
+    pipe = redis.pipeline()
+    pipe.hset(key, mapping=refresh_family_fields(user, token_jti, claims))
+    pipe.sadd(families_key, family_id)
+    if ttl:
+        pipe.expire(key, ttl)
+        pipe.expire(families_key, ttl)
+    pipe.execute()
+    
+    return True
+
+
+def rotate_refresh_family(family_id, token_jti, new_jti, access_jti):
+    """Swap a family's current refresh jti for a new one in one round trip.
+    
+    The new access token ``access_jti`` replaces the family's previous one
+    as its session. The previous access token is not revoked, so requests
+    a client already has in flight with it succeed until it expires; it is
+    kept on the family so that ending the family revokes it too.
+    
+    Returns a dict whose ``status`` is 'ok' (with the user and stored claims),
+    'reused' (an older token was replayed and the family and its session are
+    gone), 'missing' or 'inactive'; None when Redis is unavailable.
+    """
+    redis = get_redis()
+    if not redis:
+        return None
+    
+    try:
+        user_agent = request.user_agent.string or ''
+    except (RuntimeError, AttributeError):
+        user_agent = ''
+    
+    try:
+        result = [_decode(value) for value in run_script(
+            redis,
+            'rotate_refresh',
+            keys=[f"refresh_family:{family_id}"],
+            args=[
+                token_jti, new_jti, get_refresh_ttl(), family_id,
+                access_jti, datetime.utcnow().timestamp(), get_session_ttl(),
+                SESSION_COUNTER_KEY, get_session_counter_shards(), user_agent
+            ]
+        )]
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Refresh token rotation failed: {e}")
+        return None
+    
+    if result[0] == 'reused':
+        if result[2]:
+            revoke_tokens([result[2]])
+        return {'status': 'reused', 'user_id': int(result[1])}
+    if result[0] != 'ok':
+        return {'status': result[0]}
+    
+    return {
+        'status': 'ok',
+        'public_id': result[1],
+        'user_id': int(result[2]),
+        'perm_ver': int(result[3]),
+        'claims': json.loads(result[4]) if result[4] else None,
+        'current_perm_ver': int(result[5])
+    }
+
+
+def update_refresh_family_claims(family_id, claims):
+    """Store freshly built access token claims on a family"""
+    redis = get_redis()
+    if not redis:
+        return False
+    
+    redis.hset(f"refresh_family:{family_id}", mapping={
+        'perm_ver': claims.get('perm_ver', 0),
+        'claims': json.dumps(claims)
+    })
+    return True
+
+
+def revoke_refresh_family(user_id, family_id):
+    """End one refresh token family, revoking the access token its last refresh replaced"""
+    redis = get_redis()
+    if not redis:
+        return False
+    
+    pipe = redis.pipeline()
+    pipe.hget(f"refresh_family:{family_id}", 'prev_access_jti')
+    pipe.delete(f"refresh_family:{family_id}")
+    pipe.srem(f"user_refresh_families:{user_id}", family_id)
+    previous, _, _ = pipe.execute()
+    
+    # Still valid until it expires, since a refresh does not revoke it
+    if previous:
+        revoke_tokens([_decode(previous)])
+    return True
+
+
+def revoke_refresh_families(user_id, keep_family=None):
+    """End every refresh token family of a user, optionally keeping one"""
+    redis = get_redis()
+    if not redis:
+        return False
+    
+    families_key = f"user_refresh_families:{user_id}"
+    family_ids = [_decode(family_id) for family_id in redis.smembers(families_key)]
+    family_ids = [family_id for family_id in family_ids if family_id != keep_family]
+    if family_ids:
+        pipe = redis.pipeline()
+        pipe.delete(*[f"refresh_family:{family_id}" for family_id in family_ids])
+        pipe.srem(families_key, *family_ids)
+        pipe.execute()
+    
+    return True
+
+
+def revoke_tokens(token_jtis, ttl=None, expires_at=None):
+    """Add jtis to the revocation list until expires_at (their exp), or for ttl seconds (default: the access token lifetime)"""
+    redis = get_redis()
+    if not redis or not token_jtis:
+        return False
     
-    for token_jti in sessions:
-        remove_user_session(user_id, token_jti)
+    now = datetime.utcnow().timestamp()
+    if expires_at is not None:
+        ttl = expires_at - now
+        if ttl <= 0:
+            return True  # Already expired, nothing left to revoke
+    elif ttl is None:
+        ttl = get_session_ttl()
+    expires_at = now + ttl if ttl else float('inf')
+    
+    # Update this worker first; others hear about it over pub/sub
+    for jti in token_jtis:
+        revocation_filter.add(jti)
+    
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for jti in token_jtis:
+            if ttl:
+                pipe.set(f"revoked:{jti}", 1, ex=int(math.ceil(ttl)))
+            else:
+                pipe.set(f"revoked:{jti}", 1)
+        pipe.zadd(REVOKED_TOKENS_KEY, {jti: expires_at for jti in token_jtis})
+        pipe.zremrangebyscore(REVOKED_TOKENS_KEY, '-inf', now)
+        pipe.publish(REVOCATION_CHANNEL, json.dumps({'jtis': list(token_jtis)}))
+        pipe.execute()
+    except redis_exceptions.RedisError as e:
+        current_app.logger.error(f"Failed to revoke tokens: {e}")
+        return False
     
     return True
 
 
+def is_token_revoked(token_jti):
+    """Whether a jti is on the revocation list; fails open when Redis is unavailable"""
+    redis = get_redis()
+    if not redis:
+        return False
+    
+    try:
+        return bool(redis.exists(f"revoked:{token_jti}"))
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Revocation check failed: {e}")
+        return False
+
+
+def get_revoked_jtis(batch_size=10000):
+    """Iterate over every jti whose revocation has not expired yet"""
+    redis = get_redis()
+    if not redis:
+        return
+    
+    now = datetime.utcnow().timestamp()
+    for jti, expires_at in redis.zscan_iter(REVOKED_TOKENS_KEY, count=batch_size):
+        if expires_at > now:
+            yield _decode(jti)
+
+
 def get_active_sessions_count():
-    """Get the count of active sessions"""
+    """Get the count of active sessions, summed over the counter shards"""
     redis = get_redis()
     if not redis:
         return 0
     
-    count = redis.get("active_sessions_count")
-    return int(count or 0)
+    keys = [f"{SESSION_COUNTER_KEY}:{shard}" for shard in range(get_session_counter_shards())]
+    return sum(int(count or 0) for count in redis.mget(keys))
+
+
+def get_session_stats():
+    """Get the latest per-service and per-hour session counts written by recount_sessions"""
+    redis = get_redis()
+    if not redis:
+        return None
+    
+    stats = redis.get(SESSION_STATS_KEY)
+    if not stats:
+        return None
+    return json.loads(stats)
+
+
+def get_user_session_ids(user_id, newest_first=True, limit=None, created_after=None, created_before=None):
+    """Get a user's session jtis ordered by creation time, optionally within a time range"""
+    redis = get_redis()
+    if not redis:
+        return []
+    
+    session_key = f"user_sessions:{user_id}"
+    low = created_after.timestamp() if created_after else '-inf'
+    high = created_before.timestamp() if created_before else '+inf'
+    
+    if newest_first:
+        return redis.zrevrangebyscore(session_key, high, low, start=0 if limit else None, num=limit)
+    return redis.zrangebyscore(session_key, low, high, start=0 if limit else None, num=limit)
 
 
 def get_user_sessions(user_id):
-    """Get all active sessions for a user"""
+    """Get all active sessions for a user, newest first"""
     redis = get_redis()
     if not redis:
         return []
     
     session_key = f"user_sessions:{user_id}"
-    sessions = redis.smembers(session_key)
+    token_jtis = redis.zrevrange(session_key, 0, -1)
+    
+    return _load_sessions(redis, token_jtis)
+
+
+def get_user_sessions_page(user_id, limit, cursor=None):
+    """Get one page of a user's sessions, newest first.
+    
+    The cursor, from parse_session_cursor, is the (score, jti) of the last
+    session on the previous page. Sessions sharing a score are ordered by
+    jti, so the next page resumes right after it even when several sessions
+    were created in the same tick. Returns the sessions and the cursor for
+    the following page (None when there are no more).
+    """
+    redis = get_redis()
+    if not redis:
+        return [], None
+    
+    session_key = f"user_sessions:{user_id}"
+    high, skip = '+inf', 0
+    if cursor is not None:
+        score, last_jti = cursor
+        # Equal scores come back in descending jti order; skip the ones already returned
+        high = score
+        skip = sum(1 for jti in redis.zrangebyscore(session_key, score, score) if _decode(jti) >= last_jti)
+    
+    # Fetch one extra entry to know whether another page follows
+    entries = redis.zrevrangebyscore(session_key, high, '-inf', start=skip, num=limit + 1, withscores=True)
+    entries = [(_decode(jti), score) for jti, score in entries]
+    
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = f"{entries[-1][1]!r}:{entries[-1][0]}"
+    
+    return _load_sessions(redis, [jti for jti, _ in entries]), next_cursor
+
+
+def parse_session_cursor(cursor):
+    """(score, jti) of a get_user_sessions_page cursor; ValueError if it is malformed"""
+    score, _, jti = cursor.partition(':')
+    score = float(score)
+    if not math.isfinite(score) or not jti:
+        raise ValueError(f"Invalid session cursor: {cursor}")
+    return score, jti
+
+
+def _load_sessions(redis, token_jtis):
+    """Fetch session hashes for the given jtis in a single pipeline, keeping their order"""
+    if not token_jtis:
+        return []
+    
+    pipe = redis.pipeline(transaction=False)
+    for token_jti in token_jtis:
+        pipe.hgetall(f"session:{token_jti}")
     
     result = []
-    for token_jti in sessions:
-        session_data = redis.hgetall(f"session:{token_jti}")
+    for token_jti, session_data in zip(token_jtis, pipe.execute()):
         if session_data:
             session_data['jti'] = token_jti
             session_data['created_at'] = datetime.fromtimestamp(float(session_data['created_at'])).isoformat() if 'created_at' in session_data else None
             result.append(session_data)
     
-    return result 
\ No newline at end of file
+    return result
+
+
+def migrate_session_index():
+    """One-shot conversion of set-based user_sessions:* keys to sorted sets.
+    
+    Sessions used to be kept in plain sets with the creation time only in
+    each session hash. Every set is rewritten as a sorted set scored by that
+    creation time; a marker key makes later calls a no-op.
+    """
+    redis = get_redis()
+    if not redis:
+        return 0
+    
+    if redis.exists(SESSION_INDEX_MIGRATED_KEY):
+        return 0
+    
+    # Only one worker migrates; the others start once the marker is set
+    if not redis.set(f"{SESSION_INDEX_MIGRATED_KEY}:lock", 1, nx=True, ex=300):
+        return 0
+    
+    migrated = 0
+    for key in redis.scan_iter(match='user_sessions:*', count=500):
+        key_type = redis.type(key)
+        if isinstance(key_type, bytes):
+            key_type = key_type.decode('utf-8')
+        if key_type != 'set':
+            continue
+        
+        members = list(redis.smembers(key))
+        pipe = redis.pipeline(transaction=False)
+        for jti in members:
+            pipe.hget(f"session:{_decode(jti)}", 'created_at')
+        created = pipe.execute()
+        
+        scores = {jti: float(created_at or 0) for jti, created_at in zip(members, created)}
+        
+        pipe = redis.pipeline()
+        pipe.delete(key)
+        if scores:
+            pipe.zadd(key, scores)
+        pipe.execute()
+        migrated += 1
+    
+    redis.set(SESSION_INDEX_MIGRATED_KEY, 1)
+    redis.delete(f"{SESSION_INDEX_MIGRATED_KEY}:lock")
+    return migrated
+
+
+def reconcile_sessions(batch_size=500):
+    """Prune index entries whose session has expired and repair the counter.
+    
+    Walks every user_sessions:* key with SCAN. Members older than the session
+    TTL or whose session hash is gone are removed, and the counter shards
+    are decremented by the number pruned after each batch of keys.
+    """
+    redis = get_redis()
+    if not redis:
+        return 0
+    
+    ttl = get_session_ttl()
+    cutoff = datetime.utcnow().timestamp() - ttl if ttl else None
+    pruned = 0
+    
+    batch = []
+    for key in redis.scan_iter(match='user_sessions:*', count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            pruned += _reconcile_batch(redis, batch, cutoff)
+            batch = []
+    
+    if batch:
+        pruned += _reconcile_batch(redis, batch, cutoff)
+    
+    return pruned
+
+
+def _reconcile_batch(redis, keys, cutoff):
+    """Prune one batch of session indexes, returning the number of entries removed"""
+    pipe = redis.pipeline(transaction=False)
+    for key in keys:
+        if cutoff is not None:
+            pipe.zrangebyscore(key, '-inf', f"({cutoff}")
+            pipe.zremrangebyscore(key, '-inf', f"({cutoff}")
+        pipe.zrange(key, 0, -1)
+    results = pipe.execute()
+    
+    expired_by_key = []
+    members_by_key = []
+    step = 3 if cutoff is not None else 1
+    for index, key in enumerate(keys):
+        # Keep what ZREMRANGEBYSCORE actually removed; a concurrent removal already counted the rest
+        expired = (results[index * step], results[index * step + 1]) if cutoff is not None else ([], 0)
+        expired_by_key.append(expired)
+        members_by_key.append((key, results[index * step + step - 1]))
+    
+    # Check which remaining members still have a session hash
+    pipe = redis.pipeline(transaction=False)
+    for key, members in members_by_key:
+        for jti in members:
+            pipe.exists(f"session:{_decode(jti)}")
+    exists = iter(pipe.execute())
+    
+    pipe = redis.pipeline(transaction=False)
+    stale_keys = []
+    for (key, members), (expired, _) in zip(members_by_key, expired_by_key):
+        stale = [jti for jti in members if not next(exists)]
+        if stale:
+            pipe.zrem(key, *stale)
+            stale_keys.append(key)
+    
+    # Expired entries may still have their hash; drop it with the index entry
+    for expired, _ in expired_by_key:
+        if expired:
+            pipe.delete(*[f"session:{_decode(jti)}" for jti in expired])
+    
+    # Count only what ZREM removed, like remove_user_session does
+    stale_removed = dict(zip(stale_keys, pipe.execute()))
+    
+    pruned_by_counter = {}
+    for (key, _), (_, expired_removed) in zip(members_by_key, expired_by_key):
+        removed = stale_removed.get(key, 0) + expired_removed
+        if removed:
+            counter_key = get_session_counter_key(_decode(key).split(':', 1)[1])
+            pruned_by_counter[counter_key] = pruned_by_counter.get(counter_key, 0) + removed
+    
+    pipe = redis.pipeline(transaction=False)
+    for counter_key, removed in pruned_by_counter.items():
+        pipe.decrby(counter_key, removed)
+    pipe.execute()
+    
+    return sum(pruned_by_counter.values())
+
+
+def recount_sessions(batch_size=500):
+    """Recount active sessions exactly and refresh the session statistics.
+    
+    Counter shards drift when session hashes expire or removals race, so
+    they are overwritten with the sizes of the user_sessions:* indexes.
+    The same pass counts sessions per service (through the users' roles)
+    and per creation hour, and stores them for get_session_stats. Sessions
+    added while the pass runs are corrected on the next one.
+    """
+    redis = get_redis()
+    if not redis:
+        return 0
+    
+    counts = {shard: 0 for shard in range(get_session_counter_shards())}
+    by_service = {}
+    by_hour = {}
+    
+    batch = []
+    for key in redis.scan_iter(match='user_sessions:*', count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            _recount_batch(redis, batch, counts, by_service, by_hour)
+            batch = []
+    
+    if batch:
+        _recount_batch(redis, batch, counts, by_service, by_hour)
+    
+    stats = {
+        'computed_at': datetime.utcnow().isoformat(),
+        'by_service': sorted(by_service.values(), key=lambda entry: entry['service_id']),
+        'by_hour': {
+            datetime.utcfromtimestamp(bucket).isoformat(): count
+            for bucket, count in sorted(by_hour.items())
+        }
+    }
+    
+    pipe = redis.pipeline()
+    for shard, count in counts.items():
+        pipe.set(f"{SESSION_COUNTER_KEY}:{shard}", count)
+    # Drop the unsharded counter used before sharding
+    pipe.delete(SESSION_COUNTER_KEY)
+    pipe.set(SESSION_STATS_KEY, json.dumps(stats))
+    pipe.execute()
+    
+    return sum(counts.values())
+
+
+def _recount_batch(redis, keys, counts, by_service, by_hour):
+    """Add one batch of session indexes to the running totals"""
+    pipe = redis.pipeline(transaction=False)
+    for key in keys:
+        pipe.zrange(key, 0, -1, withscores=True)
+    
+    sessions_by_user = {}
+    for key, entries in zip(keys, pipe.execute()):
+        if not entries:
+            continue
+        user_id = int(_decode(key).split(':', 1)[1])
+        sessions_by_user[user_id] = len(entries)
+        counts[user_id % len(counts)] += len(entries)
+        
+        for _, created_at in entries:
+            bucket = int(created_at // 3600 * 3600)
+            by_hour[bucket] = by_hour.get(bucket, 0) + 1
+    
+    if not sessions_by_user:
+        return
+    
+    from app import db
+    from app.models.service import Service
+    from app.models.user_service_role import UserServiceRole
+    
+    # One query maps the whole batch of users to the services they belong to
+    rows = db.session.query(
+        UserServiceRole.user_id, Service.public_id, Service.name
+    ).join(
+        Service, Service.id == UserServiceRole.service_id
+    ).filter(
+        UserServiceRole.user_id.in_(sessions_by_user)
+    ).distinct().all()
+    
+    for user_id, service_id, name in rows:
+        entry = by_service.setdefault(service_id, {'service_id': service_id, 'name': name, 'active_sessions': 0})
+        entry['active_sessions'] += sessions_by_user[user_id]
+
+
+def start_session_reconciler(app):
+    """Run reconcile_sessions and recount_sessions periodically in a daemon thread.
+    
+    Every worker starts one, but a short Redis lock lets only one of them
+    reconcile per interval.
+    """
+    interval = app.config.get('SESSION_RECONCILE_INTERVAL', 0)
+    if not interval:
+        return None
+    
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                redis = get_redis()
+                try:
+                    if redis and redis.set('session_reconcile:lock', os.getpid(), nx=True, ex=interval):
+                        pruned = reconcile_sessions()
+                        if pruned:
+                            app.logger.info(f"Pruned {pruned} expired sessions")
+                        recount_sessions()
+                except Exception as e:
+                    # Keep the thread alive through Redis or database hiccups
+                    app.logger.warning(f"Session reconciliation failed: {e}")
+    
+    thread = threading.Thread(target=run, name='session-reconciler', daemon=True)
+    thread.start()
+    return thread
+
+
+def check_login_rate_limit(email, ip_address):
+    """Record a login attempt against the per-email, per-IP and global sliding windows.
+    
+    Returns (allowed, retry_after) where retry_after is the number of seconds
+    until the exhausted window admits another attempt. Fails open when Redis
+    is unavailable so logins keep working.
+    """
+    redis = get_redis()
+    if not redis:
+        return True, 0
+    
+    config = current_app.config
+    window_ms = config.get('LOGIN_RATE_LIMIT_WINDOW', 60) * 1000
+    limits = [
+        (f"login_rate:email:{(email or '').strip().lower()}", config.get('LOGIN_RATE_LIMIT_PER_EMAIL', 0)),
+        (f"login_rate:ip:{ip_address}", config.get('LOGIN_RATE_LIMIT_PER_IP', 0)),
+        ('login_rate:global', config.get('LOGIN_RATE_LIMIT_GLOBAL', 0))
+    ]
+    limits = [(key, limit) for key, limit in limits if limit > 0]
+    if not limits or window_ms <= 0:
+        return True, 0
+    
+    now_ms = int(datetime.utcnow().timestamp() * 1000)
+    args = [now_ms, uuid.uuid4().hex]
+    for _, limit in limits:
+        args.extend([window_ms, limit])
+    
+    try:
+        rejected, retry_ms = run_script(redis, 'sliding_window', keys=[key for key, _ in limits], args=args)
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Login rate limit check failed: {e}")
+        return True, 0
+    
+    if rejected:
+        return False, max(math.ceil(int(retry_ms) / 1000), 1)
+    return True, 0
+
+
+def claim_email_send(kind, recipient, window):
+    """Claim the right to send a kind of email to a recipient once per window.
+    
+    Returns False when the same email was already sent within the last
+    window seconds. Fails open when Redis is unavailable.
+    """
+    redis = get_redis()
+    if not redis or window <= 0:
+        return True
+    
+    key = f"email_sent:{kind}:{(recipient or '').strip().lower()}"
+    try:
+        return bool(redis.set(key, 1, nx=True, ex=window))
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Email suppression check failed: {e}")
+        return True
+
+
+def consume_email_budget(count=1):
+    """Take up to count sends from the global per-minute email budget.
+    
+    Returns how many of them may go out this minute; the caller holds the
+    rest back until the next one.
+    """
+    redis = get_redis()
+    budget = current_app.config.get('EMAIL_SEND_BUDGET_PER_MINUTE', 0)
+    if not redis or budget <= 0:
+        return count
+    
+    key = f"email_budget:{int(datetime.utcnow().timestamp()) // 60}"
+    try:
+        pipe = redis.pipeline()
+        pipe.incrby(key, count)
+        pipe.expire(key, 120)
+        used, _ = pipe.execute()
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Email budget check failed: {e}")
+        return count
+    
+    return max(0, min(count, budget - (used - count)))
+
+
+def get_permission_version(user_id):
+    """Current permissions version of a user, 0 until their permissions first change"""
+    redis = get_redis()
+    if not redis:
+        return 0
+    
+    try:
+        return int(redis.get(f"perm_version:{user_id}") or 0)
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Failed to read permission version: {e}")
+        return 0
+
+
+def bump_permission_versions(users):
+    """Advance the permissions version of each (user_id, public_id) pair and announce it"""
+    redis = get_redis()
+    if not redis or not users:
+        return False
+    
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for user_id, _ in users:
+            pipe.incr(f"perm_version:{user_id}")
+        versions = pipe.execute()
+        
+        pipe = redis.pipeline(transaction=False)
+        for (_, public_id), version in zip(users, versions):
+            pipe.publish(PERMISSION_VERSION_CHANNEL, json.dumps({'user_id': public_id, 'perm_ver': version}))
+        pipe.execute()
+    except redis_exceptions.RedisError as e:
+        current_app.logger.warning(f"Failed to bump permission versions: {e}")
+        return False
+    
+    return True
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
@@ -1,7 +1,14 @@
+import hashlib
 from app import db
 from app.models.role import Role, Permission, RolePermission
 from app.models.service import Service
+from app.models.user import User
 from app.models.user_service_role import UserServiceRole
+from app.models.user_effective_permission import UserEffectivePermission
+from app.services.redis_service import get_permission_version, bump_permission_versions
+from app.utils.permission_cache import invalidate_user_permissions
+from app.utils.cache import cached
+from app.utils.permission_bits import encode_mask
 from flask import current_app
 
 def initialize_default_roles():
@@ -129,6 +136,9 @@ def assign_role_to_user(user_id, service_id, role_id):
     db.session.add(user_role)
     db.session.commit()
     
+    invalidate_user_permissions(user_id=user_id, service_id=service_id)
+    _bump_permission_versions(User.id == user_id)
+    
     return {'success': True, 'message': 'Role assigned successfully'}
 
 
@@ -146,6 +156,9 @@ def remove_role_from_user(user_id, service_id, role_id):
     db.session.delete(user_role)
     db.session.commit()
     
+    invalidate_user_permissions(user_id=user_id, service_id=service_id)
+    _bump_permission_versions(User.id == user_id)
+    
     return {'success': True, 'message': 'Role removed successfully'}
 
 
@@ -198,8 +211,10 @@ def update_role(role_id, name=None, description=None, permissions=None):
     
     # Update permissions if provided
     if permissions is not None:  # Check if None to distinguish from empty list
-        # Remove all current permissions
-        RolePermission.query.filter_by(role_id=role.id).delete()
+        # Remove all current permissions; deleting through the session lets the
+        # flush refresh the effective permissions of the role's holders
+        for role_perm in RolePermission.query.filter_by(role_id=role.id).all():
+            db.session.delete(role_perm)
         
         # Add new permissions
         for perm_id in permissions:
@@ -209,6 +224,13 @@ def update_role(role_id, name=None, description=None, permissions=None):
     
     db.session.commit()
     
+    # Users holding this role may have gained or lost permissions
+    invalidate_user_permissions(service_id=role.service_id)
+    if permissions is not None:
+        _bump_permission_versions(User.id.in_(
+            db.session.query(UserServiceRole.user_id).filter(UserServiceRole.role_id == role.id)
+        ))
+    
     return {'success': True, 'message': 'Role updated successfully'}
 
 
@@ -223,7 +245,92 @@ def delete_role(role_id):
     if role.is_default:
         return {'success': False, 'message': 'Cannot delete a default role'}
     
+    service_id = role.service_id
+    holders = [
+        row[0] for row in db.session.query(UserServiceRole.user_id).filter(UserServiceRole.role_id == role.id).all()
+    ] if _permission_claims_enabled() else []
     db.session.delete(role)
     db.session.commit()
     
-    return {'success': True, 'message': 'Role deleted successfully'} 
\ No newline at end of file
+    _bump_permission_versions(User.id.in_(holders))
+    
+    invalidate_user_permissions(service_id=service_id)
+    
+    return {'success': True, 'message': 'Role deleted successfully'}
+
+
+def get_users_with_permission(service_id, permission_name):
+    """Get every user holding a permission in a service"""
+    return User.query.join(
+        UserEffectivePermission, UserEffectivePermission.user_id == User.id
+    ).join(
+        Permission, Permission.id == UserEffectivePermission.permission_id
+    ).filter(
+        UserEffectivePermission.service_id == service_id,
+        Permission.name == permission_name
+    ).all()
+
+
+def rebuild_effective_permissions():
+    """Recompute the user_effective_permissions table from role assignments"""
+    count = UserEffectivePermission.rebuild(db.session.connection())
+    db.session.commit()
+    return count
+
+
+@cached('permissions', key=lambda: 'all')
+def get_all_permissions():
+    """Every permission as a dict"""
+    return [perm.to_dict() for perm in Permission.query.all()]
+
+
+@cached('permissions', key=lambda: 'catalog')
+def get_permission_catalog():
+    """Permission names indexed by bit, with a version that changes whenever the list does
+    
+    Bits freed by deleted permissions are listed as None.
+    """
+    rows = db.session.query(Permission.bit_index, Permission.name).order_by(Permission.bit_index).all()
+    names = [None] * (rows[-1][0] + 1 if rows else 0)
+    for bit_index, name in rows:
+        names[bit_index] = name
+    version = hashlib.sha256('\n'.join(name or '' for name in names).encode('utf-8')).hexdigest()[:12]
+    return {'version': version, 'permissions': names}
+
+
+def get_permission_claims(user):
+    """Build the access token claims describing a user's permissions in every service.
+    
+    ``perms`` maps each service's public id to a hex bitmask where bit i is
+    set when the user holds the permission with bit index i; ``perm_catalog``
+    names the catalog version the bits refer to and ``perm_ver`` is the
+    user's permissions version, bumped whenever their grants change.
+    """
+    rows = db.session.query(Service.public_id, Permission.bit_index).join(
+        UserEffectivePermission, UserEffectivePermission.service_id == Service.id
+    ).join(
+        Permission, Permission.id == UserEffectivePermission.permission_id
+    ).filter(UserEffectivePermission.user_id == user.id).all()
+    
+    masks = {}
+    for service_id, bit_index in rows:
+        masks[service_id] = masks.get(service_id, 0) | (1 << bit_index)
+    
+    return {
+        'perms': {service_id: encode_mask(mask) for service_id, mask in masks.items()},
+        'perm_catalog': get_permission_catalog()['version'],
+        'perm_ver': get_permission_version(user.id)
+    }
+
+
+def _permission_claims_enabled():
+    return current_app.config.get('JWT_PERMISSION_CLAIMS', False)
+
+
+def _bump_permission_versions(user_filter):
+    # Versions only matter to tokens that carry permission claims
+    if not _permission_claims_enabled():
+        return
+    
+    users = db.session.query(User.id, User.public_id).filter(user_filter).all()
+    bump_permission_versions([(user_id, public_id) for user_id, public_id in users]) 
\ No newline at end of file
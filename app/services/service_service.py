@@ -2,6 +2,9 @@ from app import db
 from app.models.service import Service
 from app.models.role import Role
 from app.models.user_service_role import UserServiceRole
+from app.utils.permission_cache import invalidate_user_permissions
+from app.utils.app_token_cache import app_token_cache
+from app.utils.cache import cached
 
 def create_service(name, description=None):
     """Create a new service/microservice"""
@@ -71,6 +74,13 @@ def get_service_by_id(service_id):
     return service
 
 
+@cached('services', key=lambda name: f"id_by_name:{name}")
+def get_service_id_by_name(name):
+    """Get a service's numeric ID from its name, or None"""
+    row = db.session.query(Service.id).filter_by(name=name).first()
+    return row[0] if row else None
+
+
 def update_service(service_id, name=None, description=None, is_active=None):
     """Update a service's details"""
     service = get_service_by_id(service_id)
@@ -94,6 +104,9 @@ def update_service(service_id, name=None, description=None, is_active=None):
     
     db.session.commit()
     
+    # Cached app tokens carry a snapshot of the service
+    app_token_cache.invalidate()
+    
     return {'success': True, 'message': 'Service updated successfully'}
 
 
@@ -109,9 +122,13 @@ def delete_service(service_id):
         return {'success': False, 'message': 'Cannot delete the auth service'}
     
     # The cascading delete will handle related entities
+    deleted_id = service.id
     db.session.delete(service)
     db.session.commit()
     
+    invalidate_user_permissions(service_id=deleted_id)
+    app_token_cache.invalidate()
+    
     return {'success': True, 'message': 'Service deleted successfully'}
 
 
@@ -2,6 +2,8 @@ from datetime import datetime, timedelta
 from app import db
 from app.models.app_token import AppToken
 from app.models.service import Service
+from app.utils.last_used_buffer import last_used_buffer
+from app.utils.app_token_cache import app_token_cache, MISSING
 
 def create_app_token(service_id, name, expires_in_days=None):
     """Create a new application token for a service"""
@@ -30,6 +32,9 @@ def create_app_token(service_id, name, expires_in_days=None):
     db.session.add(token)
     db.session.commit()
     
+    # The value can't have been seen before, but never let a stale miss shadow it
+    app_token_cache.discard(token.token)
+    
     # Return token data including the actual token value
     # This is the only time the raw token value will be returned
     return {
@@ -47,19 +52,26 @@ def create_app_token(service_id, name, expires_in_days=None):
 
 
 def validate_app_token(token_value):
-    """Validate an application token and return associated service"""
-    token = AppToken.query.filter_by(token=token_value).first()
+    """Validate an application token and return a snapshot of its service"""
+    # Concurrent misses for one token value share a single query
+    cached = app_token_cache.get_or_load(token_value, lambda: _load_app_token(token_value))
     
-    if not token:
+    if cached is MISSING:
         return None
     
-    if not token.is_valid():
+    # Expiry is checked against the cached expires_at on every call
+    if not cached.is_valid():
         return None
     
-    # Update last used timestamp
-    token.update_last_used()
+    # Record last used timestamp; written back in batches
+    last_used_buffer.record(cached.token_id)
     
-    return token.service
+    return cached.service
+
+
+def _load_app_token(token_value):
+    """Look a token up in the database; None is cached as a known-unknown token"""
+    return AppToken.query.filter_by(token=token_value).first()
 
 
 def get_service_tokens(service_id):
@@ -78,6 +90,10 @@ def revoke_token(token_id):
     token.is_active = False
     db.session.commit()
     
+    # A bump rather than a delete, so a lookup that read the token before the
+    # commit and is still loading cannot cache it as active afterwards
+    app_token_cache.invalidate()
+    
     return {'success': True, 'message': 'Token revoked successfully'}
 
 
@@ -91,4 +107,7 @@ def delete_token(token_id):
     db.session.delete(token)
     db.session.commit()
     
+    # A bump for the same reason as in revoke_token
+    app_token_cache.invalidate()
+    
     return {'success': True, 'message': 'Token deleted successfully'} 
\ No newline at end of file
@@ -0,0 +1,143 @@
+import hashlib
+from datetime import datetime
+
+from app.utils.cache import cache, MISS
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _parse(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class ServiceSnapshot:
+    """Detached copy of the Service fields needed by token validation"""
+
+    __slots__ = ('id', 'public_id', 'name', 'description', 'is_active', 'created_at', 'updated_at')
+
+    def __init__(self, data):
+        for field in self.__slots__:
+            setattr(self, field, data[field])
+        self.created_at = _parse(self.created_at)
+        self.updated_at = _parse(self.updated_at)
+
+    @staticmethod
+    def capture(service):
+        """JSON-serializable form of a Service, as stored in the cache"""
+        data = {field: getattr(service, field) for field in ServiceSnapshot.__slots__}
+        data['created_at'] = _isoformat(service.created_at)
+        data['updated_at'] = _isoformat(service.updated_at)
+        return data
+
+    def to_dict(self):
+        return {
+            'id': self.public_id,
+            'name': self.name,
+            'description': self.description,
+            'is_active': self.is_active,
+            'created_at': _isoformat(self.created_at),
+            'updated_at': _isoformat(self.updated_at)
+        }
+
+    def __repr__(self):
+        return f'<ServiceSnapshot {self.name}>'
+
+
+class CachedAppToken:
+    """Validation state of an app token captured at lookup time"""
+
+    __slots__ = ('token_id', 'service', 'is_active', 'expires_at')
+
+    def __init__(self, data):
+        self.token_id = data['token_id']
+        self.service = ServiceSnapshot(data['service'])
+        self.is_active = data['is_active']
+        self.expires_at = _parse(data['expires_at'])
+
+    @staticmethod
+    def capture(token):
+        """JSON-serializable form of an AppToken and its service, as stored in the cache"""
+        return {
+            'token_id': token.id,
+            'service': ServiceSnapshot.capture(token.service),
+            'is_active': token.is_active,
+            'expires_at': _isoformat(token.expires_at)
+        }
+
+    def is_valid(self):
+        """Same rules as AppToken.is_valid, evaluated without the database"""
+        if not self.is_active:
+            return False
+
+        if self.expires_at and self.expires_at <= datetime.utcnow():
+            return False
+
+        return True
+
+
+# Returned for tokens that are known not to exist
+MISSING = object()
+
+
+class AppTokenCache:
+    """App token lookups kept in the shared two-tier cache, with negative caching.
+
+    Entries live in the ``app_tokens`` namespace under a digest of the token
+    value, so raw tokens never reach Redis. Known tokens are kept for
+    ``ttl`` seconds; unknown tokens are cached as None for ``negative_ttl``
+    seconds so floods of invalid tokens do not reach the database.
+    Invalidations reach the other workers through the cache's broadcasts.
+    """
+
+    namespace = 'app_tokens'
+
+    def __init__(self, ttl=60, negative_ttl=10):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def init_app(self, app):
+        self.ttl = app.config.get('APP_TOKEN_CACHE_TTL', 60)
+        self.negative_ttl = app.config.get('APP_TOKEN_NEGATIVE_CACHE_TTL', 10)
+
+    def get(self, token_value):
+        """Return a CachedAppToken, MISSING for a known-unknown token, or None on a miss"""
+        data = cache.get(self.namespace, self._key(token_value))
+        if data is MISS:
+            return None
+        return self._wrap(data)
+
+    def get_or_load(self, token_value, loader):
+        """Like get(), calling loader() for the AppToken (or None) on a miss"""
+        data = cache.get_or_load(
+            self.namespace,
+            self._key(token_value),
+            lambda: self._capture(loader()),
+            ttl=lambda data: self.negative_ttl if data is None else self.ttl
+        )
+        return self._wrap(data)
+
+    def discard(self, token_value):
+        """Drop a single token value in every worker.
+
+        A lookup already loading may still store what it read; use
+        invalidate() when the token itself changed.
+        """
+        cache.delete(self.namespace, self._key(token_value))
+
+    def invalidate(self):
+        """Drop every cached token in every worker, including results of lookups still loading"""
+        cache.invalidate_namespace(self.namespace)
+
+    def _capture(self, token):
+        return None if token is None else CachedAppToken.capture(token)
+
+    def _wrap(self, data):
+        return MISSING if data is None else CachedAppToken(data)
+
+    def _key(self, token_value):
+        return hashlib.sha256(token_value.encode('utf-8')).hexdigest()
+
+
+app_token_cache = AppTokenCache()
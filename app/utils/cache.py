@@ -0,0 +1,367 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from redis import exceptions as redis_exceptions
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.utils.event_listener import EventListener
+from app.utils.single_flight import SingleFlight
+
+CACHE_CHANNEL = 'cache_invalidations'
+
+# Returned by get() on a miss, so None can be cached like any other value
+MISS = object()
+
+
+class TwoTierCache:
+    """Read-through cache with a per-worker LRU (L1) in front of Redis (L2).
+
+    Entries live in namespaces. Each namespace has a version counter in
+    Redis; bumping it invalidates every entry of the namespace at once
+    without touching them, since an entry is only used while the version it
+    was stored under is current. An L1 miss reads the version and the L2
+    entry together in one round trip.
+
+    Invalidations are broadcast over Redis pub/sub so other workers drop
+    their L1 copies right away; L1 entries also expire after ``l1_ttl``
+    seconds (or their own TTL, if shorter) in case a message is missed.
+    Values must be JSON-serializable. Without Redis the cache is L1-only.
+
+    Concurrent misses on one key in a worker run the loader once. With
+    ``fill_lock_ms`` set, a short Redis lock also lets one worker fill the
+    key while the others poll L2 for its result.
+    """
+
+    def __init__(self, max_size=10000, l1_ttl=30, l2_ttl=300, fill_lock_ms=0):
+        self.max_size = max_size
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self.fill_lock_ms = fill_lock_ms
+        self._loads = SingleFlight()
+        self._app = None
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._listener = EventListener(CACHE_CHANNEL, self._handle_invalidation)
+
+    def init_app(self, app):
+        self._app = app
+        self.max_size = app.config.get('CACHE_L1_SIZE', 10000)
+        self.l1_ttl = app.config.get('CACHE_L1_TTL', 30)
+        self.l2_ttl = app.config.get('CACHE_L2_TTL', 300)
+        self.fill_lock_ms = app.config.get('CACHE_FILL_LOCK_MS', 0)
+        self.clear()
+
+    def get(self, namespace, key):
+        """Return the cached value, or MISS"""
+        self._listener.ensure(self._app)
+
+        value = self._get_l1(namespace, key)
+        if value is not MISS:
+            self._count(namespace, 'l1_hits')
+            return value
+
+        value, version = self._get_l2(namespace, key)
+        if value is not MISS:
+            self._count(namespace, 'l2_hits')
+            self._set_l1(namespace, key, value, version)
+            return value
+
+        self._count(namespace, 'misses')
+        return MISS
+
+    def set(self, namespace, key, value, ttl=None, version=None):
+        """Store a value in both tiers under the namespace's current version, or ``version`` if given"""
+        redis = self._redis()
+        ttl = self.l2_ttl if ttl is None else ttl
+        if redis is None or ttl <= 0:
+            self._set_l1(namespace, key, value, self._versions.get(namespace, 0) if version is None else version, ttl)
+            return
+
+        try:
+            # get() has already read the version unless set() is called on its own
+            if version is None:
+                version = self._versions.get(namespace)
+            if version is None:
+                version = int(redis.get(self._version_key(namespace)) or 0)
+                self._set_version(namespace, version)
+            self._set_l1(namespace, key, value, version, ttl)
+            redis.set(self._entry_key(namespace, key), json.dumps({'v': version, 'd': value}), ex=ttl)
+        except redis_exceptions.RedisError as e:
+            self._app.logger.warning(f"Failed to write cache entry {namespace}:{key}: {e}")
+
+    def get_or_load(self, namespace, key, loader, ttl=None):
+        """Return the cached value, calling loader() and caching its result on a miss.
+
+        ``ttl`` may also be a function of the loaded value, e.g. to keep
+        negative results for less time.
+        """
+        value = self.get(namespace, key)
+        if value is MISS:
+            value = self._loads.do((namespace, key), lambda: self._fill(namespace, key, loader, ttl))
+        return value
+
+    def _fill(self, namespace, key, loader, ttl):
+        # A flight that finished just before ours may have filled it already
+        value = self._get_l1(namespace, key)
+        if value is not MISS:
+            return value
+
+        value, lock_key = self._await_fill(namespace, key)
+        if value is not MISS:
+            return value
+
+        # The version the miss was read under, taken before loading: if the
+        # namespace is invalidated while the loader runs, its possibly stale
+        # result is stored under the old version and never served
+        version = self._versions.get(namespace, 0)
+        try:
+            value = loader()
+            self.set(namespace, key, value, ttl=ttl(value) if callable(ttl) else ttl, version=version)
+        finally:
+            if lock_key is not None:
+                self._release(lock_key)
+        return value
+
+    def _await_fill(self, namespace, key):
+        """(value another worker filled, None), or (MISS, our lock key or None) when we should load"""
+        redis = self._redis()
+        if redis is None or self.fill_lock_ms <= 0:
+            return MISS, None
+
+        lock_key = f"cache_lock:{namespace}:{key}"
+        deadline = time.monotonic() + self.fill_lock_ms / 1000
+        try:
+            while not redis.set(lock_key, os.getpid(), nx=True, px=self.fill_lock_ms):
+                if time.monotonic() >= deadline:
+                    # The other worker is slow; load without waiting any longer
+                    return MISS, None
+                time.sleep(0.005)
+
+                value, version = self._get_l2(namespace, key)
+                if value is not MISS:
+                    self._count(namespace, 'l2_hits')
+                    self._set_l1(namespace, key, value, version)
+                    return value, None
+        except redis_exceptions.RedisError as e:
+            self._app.logger.warning(f"Failed to lock cache entry {namespace}:{key}: {e}")
+            return MISS, None
+        return MISS, lock_key
+
+    def _release(self, lock_key):
+        # The lock only spares other workers a load; if it has already expired
+        # and been taken over, deleting it just lets them load too
+        try:
+            self._redis().delete(lock_key)
+        except redis_exceptions.RedisError:
+            pass
+
+    def delete(self, namespace, key):
+        """Drop one entry everywhere.
+
+        A get_or_load already running may store its result afterwards; when
+        that result could be stale, invalidate the namespace instead.
+        """
+        self._drop_l1(namespace, key)
+
+        redis = self._redis()
+        if redis is not None:
+            try:
+                redis.delete(self._entry_key(namespace, key))
+            except redis_exceptions.RedisError as e:
+                self._app.logger.warning(f"Failed to delete cache entry {namespace}:{key}: {e}")
+
+        self._publish({'namespace': namespace, 'key': key})
+
+    def invalidate_namespace(self, namespace):
+        """Invalidate every entry of a namespace by bumping its version"""
+        version = None
+        redis = self._redis()
+        if redis is not None:
+            try:
+                version = redis.incr(self._version_key(namespace))
+            except redis_exceptions.RedisError as e:
+                self._app.logger.warning(f"Failed to bump cache namespace {namespace}: {e}")
+
+        if version is None:
+            version = self._versions.get(namespace, 0) + 1
+        self._set_version(namespace, version)
+
+        self._publish({'namespace': namespace, 'version': version})
+
+    def stats(self):
+        """Hit and miss counters per namespace since startup"""
+        with self._lock:
+            return {namespace: dict(counters) for namespace, counters in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._stats.clear()
+
+    def _get_l1(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return MISS
+
+            value, version, expires_at = entry
+            if expires_at <= time.monotonic() or version != self._versions.get(namespace, 0):
+                del self._entries[(namespace, key)]
+                return MISS
+
+            self._entries.move_to_end((namespace, key))
+            return value
+
+    def _set_l1(self, namespace, key, value, version, ttl=None):
+        if self.max_size <= 0 or self.l1_ttl <= 0:
+            return
+
+        # An entry with a shorter TTL of its own must not outlive it here
+        lifetime = min(self.l1_ttl, ttl) if ttl and ttl > 0 else self.l1_ttl
+        with self._lock:
+            self._entries[(namespace, key)] = (value, version, time.monotonic() + lifetime)
+            self._entries.move_to_end((namespace, key))
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _drop_l1(self, namespace, key):
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+
+    def _get_l2(self, namespace, key):
+        """(value or MISS, current namespace version)"""
+        redis = self._redis()
+        if redis is None:
+            return MISS, self._versions.get(namespace, 0)
+
+        try:
+            raw_version, raw_entry = redis.mget(self._version_key(namespace), self._entry_key(namespace, key))
+        except redis_exceptions.RedisError as e:
+            self._app.logger.warning(f"Failed to read cache entry {namespace}:{key}: {e}")
+            return MISS, self._versions.get(namespace, 0)
+
+        version = int(raw_version or 0)
+        self._set_version(namespace, version)
+        if raw_entry is None:
+            return MISS, version
+
+        entry = json.loads(raw_entry)
+        if entry['v'] != version:
+            # Stored before the last namespace invalidation
+            return MISS, version
+        return entry['d'], version
+
+    def _set_version(self, namespace, version):
+        with self._lock:
+            known = namespace in self._versions
+            if self._versions.get(namespace) == version:
+                return
+            self._versions[namespace] = version
+
+            # _get_l1 checks versions anyway; skip the sweep for a namespace
+            # seen for the first time, as with one namespace per user
+            if not known:
+                return
+            stale = [entry_key for entry_key in self._entries if entry_key[0] == namespace]
+            for entry_key in stale:
+                del self._entries[entry_key]
+
+    def _count(self, namespace, counter):
+        with self._lock:
+            counters = self._stats.setdefault(namespace, {'l1_hits': 0, 'l2_hits': 0, 'misses': 0})
+            counters[counter] += 1
+
+    def _version_key(self, namespace):
+        return f"cache_version:{namespace}"
+
+    def _entry_key(self, namespace, key):
+        return f"cache:{namespace}:{key}"
+
+    def _redis(self):
+        if self._app is None or self.l2_ttl <= 0:
+            return None
+
+        from app.services.redis_service import get_redis
+        return get_redis()
+
+    def _publish(self, payload):
+        if self._app is None:
+            return
+
+        from app.services.redis_service import publish_event
+        publish_event(CACHE_CHANNEL, payload)
+
+    def _handle_invalidation(self, payload):
+        namespace = payload.get('namespace')
+        if payload.get('version') is not None:
+            self._set_version(namespace, payload['version'])
+        else:
+            self._drop_l1(namespace, payload.get('key'))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = TwoTierCache()
+
+
+def cached(namespace, key=None, ttl=None):
+    """Cache a function's JSON-serializable result in ``namespace``.
+
+    The entry key is built by ``key(*args, **kwargs)``, or from the
+    arguments joined with ':' when no key function is given. The wrapped
+    function gains ``invalidate(*args, **kwargs)`` to drop one entry and
+    ``uncached`` to bypass the cache.
+    """
+    def make_key(args, kwargs):
+        if key is not None:
+            return key(*args, **kwargs)
+        parts = [str(arg) for arg in args] + [f"{name}={kwargs[name]}" for name in sorted(kwargs)]
+        return ':'.join(parts) or '_'
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return cache.get_or_load(namespace, make_key(args, kwargs), lambda: fn(*args, **kwargs), ttl=ttl)
+
+        wrapper.invalidate = lambda *args, **kwargs: cache.delete(namespace, make_key(args, kwargs))
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
+
+
+def invalidate_on_commit(model, namespace):
+    """Invalidate ``namespace`` after any commit that inserts, updates or deletes a ``model`` row.
+
+    ``namespace`` may also be a function of the row, for namespaces kept per
+    row. Bulk ``Query.update``/``Query.delete`` bypass these events and must
+    invalidate explicitly.
+    """
+    def mark(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            name = namespace(target) if callable(namespace) else namespace
+            session.info.setdefault('cache_namespaces', set()).add(name)
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, mark)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    for namespace in session.info.pop('cache_namespaces', ()):
+        cache.invalidate_namespace(namespace)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('cache_namespaces', None)
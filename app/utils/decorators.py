@@ -3,7 +3,10 @@ from flask import request, jsonify, g
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
 
 from app.services.auth_service import get_user_by_id
+from app.services.service_service import get_service_id_by_name
 from app.services.token_service import validate_app_token
+from app.utils.permission_bits import permission_bit
+from app.utils.permission_cache import get_user_permission_mask
 
 
 def jwt_required_with_permissions(permissions=None, service_name=None):
@@ -31,20 +34,20 @@ def jwt_required_with_permissions(permissions=None, service_name=None):
                     return fn(*args, **kwargs)
                 
                 # Get service ID if needed for permission check
-                service = None
+                service_id = None
                 if service_name:
-                    from app.models.service import Service
-                    service = Service.query.filter_by(name=service_name).first()
+                    service_id = get_service_id_by_name(service_name)
                     
-                    if not service:
+                    if not service_id:
                         return jsonify({'success': False, 'message': 'Service not found'}), 404
                 
                 # Use auth_service if no service specified
-                service_id = service.id if service else 1  # Assuming auth_service has ID 1
+                service_id = service_id or 1  # Assuming auth_service has ID 1
                 
                 # Check if user has all required permissions
+                granted = get_user_permission_mask(user, service_id)
                 for permission in permissions:
-                    if not user.has_permission(permission, service_id):
+                    if not granted & permission_bit(permission):
                         return jsonify({
                             'success': False, 
                             'message': f'Permission denied: {permission} required'
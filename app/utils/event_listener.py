@@ -0,0 +1,46 @@
+import os
+import threading
+
+
+class EventListener:
+    """Per-worker subscription to a Redis pub/sub channel.
+
+    ``ensure(app)`` subscribes ``handler`` to ``channel`` the first time it
+    is called in a process and again whenever the listener thread has died,
+    including after a fork, which a thread does not survive. Without Redis
+    it does not retry on every call. Under TESTING it does nothing, since
+    tests run a single process and there is nobody to hear from.
+    """
+
+    def __init__(self, channel, handler):
+        self.channel = channel
+        self.handler = handler
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure(self, app):
+        if app is None or app.config.get('TESTING', False):
+            return
+
+        if self.started():
+            return
+
+        with self._lock:
+            if self.started():
+                return
+            self._pid = os.getpid()
+
+            from app.services.redis_service import subscribe_events
+            with app.app_context():
+                self._thread = subscribe_events(self.channel, self.handler)
+
+    def started(self):
+        """Whether ensure() has run in this process and its listener, if any, is still running"""
+        if self._pid != os.getpid():
+            return False
+        return self._thread is None or self._thread.is_alive()
+
+    def alive(self):
+        """Whether a listener thread is running in this process"""
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
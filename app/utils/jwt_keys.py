@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from flask_jwt_extended.default_callbacks import (
+    default_decode_key_callback,
+    default_encode_key_callback
+)
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+from jwt.exceptions import InvalidAlgorithmError, InvalidTokenError
+
+
+class SigningKey:
+    """One key pair (or retired public key) identified by its kid"""
+
+    def __init__(self, kid, public_key, private_key=None):
+        self.kid = kid
+        self.public_key = public_key
+        self.private_key = private_key
+
+        if isinstance(public_key, rsa.RSAPublicKey):
+            self.alg = 'RS256'
+            self._jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+        elif isinstance(public_key, ed25519.Ed25519PublicKey):
+            self.alg = 'EdDSA'
+            self._jwk = OKPAlgorithm.to_jwk(public_key, as_dict=True)
+        else:
+            raise ValueError(f'Unsupported key type for kid {kid}; use RSA or Ed25519')
+
+    def to_jwk(self):
+        return dict(self._jwk, kid=self.kid, alg=self.alg, use='sig')
+
+    def __repr__(self):
+        return f'<SigningKey {self.kid} {self.alg}>'
+
+
+def load_key_file(path, kid):
+    """Load a PEM private key, or a public key for a retired kid"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if b'PRIVATE KEY' in data:
+        private_key = serialization.load_pem_private_key(data, password=None)
+        return SigningKey(kid, private_key.public_key(), private_key)
+    return SigningKey(kid, serialization.load_pem_public_key(data))
+
+
+class JWTKeySet:
+    """Asymmetric JWT signing keys, loaded once at startup.
+
+    Keys live in JWT_SIGNING_KEYS_DIR as ``<kid>.pem`` (private key, RSA or
+    Ed25519) or ``<kid>.pub.pem`` (public key of a retired signer that is
+    only kept so unexpired tokens still verify). New tokens are signed with
+    JWT_ACTIVE_KID, defaulting to the last private kid in sort order, and
+    carry it in their ``kid`` header. Every key is published as a JWKS so
+    other services verify tokens locally.
+
+    To rotate, add the new key, point JWT_ACTIVE_KID at it, and remove the
+    old one once the longest-lived token signed with it has expired. Without
+    a key directory tokens stay HS256-signed with JWT_SECRET_KEY.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.active = None
+        self.jwks_json = '{"keys":[]}'
+        self.jwks_etag = None
+
+    def init_app(self, app):
+        self.keys = {}
+        self.active = None
+
+        keys_dir = app.config.get('JWT_SIGNING_KEYS_DIR')
+        if keys_dir:
+            for filename in sorted(os.listdir(keys_dir)):
+                if not filename.endswith('.pem'):
+                    continue
+                kid = filename[:-len('.pem')]
+                if kid.endswith('.pub'):
+                    kid = kid[:-len('.pub')]
+                self.keys[kid] = load_key_file(os.path.join(keys_dir, filename), kid)
+
+        if self.keys:
+            self.active = self._select_active(app.config.get('JWT_ACTIVE_KID'))
+            app.config['JWT_ALGORITHM'] = self.active.alg
+            app.config['JWT_DECODE_ALGORITHMS'] = sorted({key.alg for key in self.keys.values()})
+            app.logger.info(f"Signing JWTs with {self.active.alg} key {self.active.kid} ({len(self.keys)} published)")
+
+        # The document only changes on restart, so serialize and tag it once
+        jwks = {'keys': [key.to_jwk() for key in self.keys.values()]}
+        self.jwks_json = json.dumps(jwks, sort_keys=True, separators=(',', ':'))
+        self.jwks_etag = hashlib.sha256(self.jwks_json.encode('utf-8')).hexdigest()[:32]
+
+        from app import jwt
+        jwt.encode_key_loader(self._encode_key)
+        jwt.decode_key_loader(self._decode_key)
+        jwt.additional_headers_loader(self._headers)
+
+    def _select_active(self, kid):
+        signers = [key for key in self.keys.values() if key.private_key is not None]
+        if kid:
+            key = self.keys.get(kid)
+            if key is None or key.private_key is None:
+                raise ValueError(f'JWT_ACTIVE_KID {kid} has no private key in JWT_SIGNING_KEYS_DIR')
+            return key
+        if not signers:
+            raise ValueError('JWT_SIGNING_KEYS_DIR contains no private key to sign with')
+        return signers[-1]
+
+    def _encode_key(self, identity):
+        if self.active is None:
+            return default_encode_key_callback(identity)
+        return self.active.private_key
+
+    def _decode_key(self, jwt_header, jwt_data):
+        if not self.keys:
+            return default_decode_key_callback(jwt_header, jwt_data)
+
+        key = self.keys.get(jwt_header.get('kid'))
+        if key is None:
+            raise InvalidTokenError('Unknown signing key')
+        if jwt_header.get('alg') != key.alg:
+            raise InvalidAlgorithmError('Token algorithm does not match its signing key')
+        return key.public_key
+
+    def _headers(self, identity):
+        return {'kid': self.active.kid} if self.active is not None else {}
+
+
+jwt_keys = JWTKeySet()
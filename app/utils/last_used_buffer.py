@@ -0,0 +1,113 @@
+import atexit
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam
+
+
+class LastUsedBuffer:
+    """Write-behind buffer for AppToken.last_used timestamps.
+
+    Validations record the timestamp in memory; the newest value per token is
+    written back in one bulk UPDATE when the flush interval elapses, when the
+    buffer reaches ``max_size`` tokens, or when the worker exits.
+    """
+
+    def __init__(self, interval=5, max_size=500):
+        self.interval = interval
+        self.max_size = max_size
+        self._app = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self._app = app
+        self.interval = app.config.get('APP_TOKEN_LAST_USED_FLUSH_INTERVAL', 5)
+        self.max_size = app.config.get('APP_TOKEN_LAST_USED_FLUSH_SIZE', 500)
+
+        with self._lock:
+            self._pending.clear()
+
+    def record(self, token_id, used_at=None):
+        """Remember that a token was used, coalescing with earlier uses"""
+        used_at = used_at or datetime.utcnow()
+
+        with self._lock:
+            previous = self._pending.get(token_id)
+            if previous is None or used_at > previous:
+                self._pending[token_id] = used_at
+            size = len(self._pending)
+
+        if self._use_background_writer():
+            self._ensure_thread()
+            if size >= self.max_size:
+                self._wake.set()
+        elif size >= self.max_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered timestamps in a single bulk UPDATE"""
+        with self._lock:
+            if not self._pending or self._app is None:
+                return 0
+            pending, self._pending = self._pending, {}
+
+        from app import db
+        from app.models.app_token import AppToken
+
+        table = AppToken.__table__
+        stmt = table.update().where(
+            table.c.id == bindparam('token_id')
+        ).values(last_used=bindparam('used_at'))
+        params = [{'token_id': token_id, 'used_at': used_at} for token_id, used_at in pending.items()]
+
+        try:
+            with self._app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(stmt, params)
+        except Exception as e:
+            self._app.logger.error(f"Failed to flush app token last_used updates: {e}")
+            # Keep the timestamps for the next attempt unless newer ones arrived
+            with self._lock:
+                for token_id, used_at in pending.items():
+                    if token_id not in self._pending or self._pending[token_id] < used_at:
+                        self._pending[token_id] = used_at
+            return 0
+
+        return len(params)
+
+    def _use_background_writer(self):
+        # Tests flush explicitly instead of racing a background writer
+        if self._app is None or self._app.config.get('TESTING', False):
+            return False
+        return self.interval > 0
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each worker starts its own writer
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='last-used-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+
+last_used_buffer = LastUsedBuffer()
+
+# Write out whatever is still buffered when the worker shuts down
+atexit.register(last_used_buffer.flush)
@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+import time
+
+import requests
+
+
+class OAuthMetadataCache:
+    """Shared cache of OAuth provider discovery documents and signing keys.
+
+    Each provider's metadata and JWKS are fetched together and stored in
+    Redis (shared by every worker) and on disk (surviving a Redis flush or
+    a cold start with the provider unreachable). Registering a provider
+    loads the newest cached copy into its Authlib client, fetching only
+    when no usable copy exists, so callbacks never block on discovery.
+
+    A background thread per worker refreshes documents older than
+    ``refresh_interval`` seconds; a Redis lock lets one worker fetch while
+    the others pick its result up from Redis. Copies older than
+    ``max_age`` are never used.
+    """
+
+    def __init__(self, refresh_interval=3600, max_age=604800, timeout=5, cache_dir=None):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self._app = None
+        self._providers = {}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.refresh_interval = app.config.get('OAUTH_METADATA_REFRESH_INTERVAL', 3600)
+        self.max_age = app.config.get('OAUTH_METADATA_MAX_AGE', 604800)
+        self.timeout = app.config.get('OAUTH_METADATA_TIMEOUT', 5)
+        self.cache_dir = app.config.get('OAUTH_METADATA_CACHE_DIR') or os.path.join(app.instance_path, 'oauth_metadata')
+        self._providers = {}
+
+        app.before_request(self._start_refresher)
+
+    def register(self, name, discovery_url, client):
+        """Track a provider's Authlib client and prefetch its metadata into it"""
+        self._providers[name] = (discovery_url, client)
+
+        document = self._load_cached(name)
+        if document is None or self._is_due(document):
+            document = self.refresh(name) or document
+        if document is not None:
+            self._apply(client, document)
+
+    def refresh(self, name):
+        """Fetch a provider's metadata and JWKS unless another worker is already doing so"""
+        discovery_url, client = self._providers[name]
+
+        from app.services.redis_service import get_redis
+        with self._app.app_context():
+            redis = get_redis()
+        lock_key = f"oauth_metadata:{name}:lock"
+        try:
+            locked = redis is None or redis.set(lock_key, os.getpid(), nx=True, ex=max(self.timeout * 4, 10))
+        except Exception as e:
+            self._app.logger.warning(f"Failed to lock OAuth metadata refresh for {name}: {e}")
+            redis, locked = None, True
+        if not locked:
+            # Someone else is fetching; use what they stored last
+            document = self._load_cached(name)
+            if document is not None:
+                self._apply(client, document)
+            return document
+
+        try:
+            document = self._fetch(discovery_url)
+        except (requests.RequestException, ValueError) as e:
+            self._app.logger.warning(f"Failed to fetch OAuth metadata for {name}: {e}")
+            return None
+        finally:
+            if redis is not None:
+                try:
+                    redis.delete(lock_key)
+                except Exception:
+                    pass  # The lock expires on its own
+
+        self._store(name, document, redis)
+        self._apply(client, document)
+        return document
+
+    def refresh_due(self):
+        """Refresh every provider whose cached metadata is older than the refresh interval"""
+        for name, (_, client) in list(self._providers.items()):
+            if time.time() - client.server_metadata.get('_loaded_at', 0) < self.refresh_interval:
+                continue
+
+            # Another worker may already have refreshed it
+            document = self._load_cached(name)
+            if document is not None and not self._is_due(document):
+                self._apply(client, document)
+            else:
+                self.refresh(name)
+
+    def _fetch(self, discovery_url):
+        response = requests.get(discovery_url, timeout=self.timeout)
+        response.raise_for_status()
+        metadata = response.json()
+
+        jwks = None
+        if metadata.get('jwks_uri'):
+            response = requests.get(metadata['jwks_uri'], timeout=self.timeout)
+            response.raise_for_status()
+            jwks = response.json()
+
+        return {'metadata': metadata, 'jwks': jwks, 'fetched_at': time.time()}
+
+    def _apply(self, client, document):
+        # Authlib skips discovery once _loaded_at is set and skips the JWKS fetch once jwks is set
+        metadata = dict(document['metadata'], _loaded_at=document['fetched_at'])
+        if document.get('jwks'):
+            metadata['jwks'] = document['jwks']
+        client.server_metadata.update(metadata)
+
+    def _is_due(self, document):
+        return time.time() - document['fetched_at'] >= self.refresh_interval
+
+    def _load_cached(self, name):
+        """Newest usable copy from Redis or disk, or None"""
+        from app.services.redis_service import get_redis
+        with self._app.app_context():
+            redis = get_redis()
+
+        candidates = []
+        if redis is not None:
+            try:
+                raw = redis.get(f"oauth_metadata:{name}")
+                if raw:
+                    candidates.append(json.loads(raw))
+            except Exception as e:
+                self._app.logger.warning(f"Failed to read OAuth metadata for {name} from Redis: {e}")
+
+        try:
+            with open(self._path(name)) as f:
+                candidates.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+        candidates = [doc for doc in candidates if time.time() - doc.get('fetched_at', 0) < self.max_age]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda doc: doc['fetched_at'])
+
+    def _store(self, name, document, redis):
+        data = json.dumps(document)
+        if redis is not None:
+            try:
+                redis.set(f"oauth_metadata:{name}", data, ex=self.max_age)
+            except Exception as e:
+                self._app.logger.warning(f"Failed to store OAuth metadata for {name} in Redis: {e}")
+
+        # Write then rename so a reader never sees a half-written file
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(name)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self._app.logger.warning(f"Failed to store OAuth metadata for {name} on disk: {e}")
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _start_refresher(self):
+        self._ensure_thread()
+
+    def _use_background_refresh(self):
+        # Tests refresh explicitly
+        if self._app is None or self._app.config.get('TESTING', False):
+            return False
+        return bool(self._providers) and self.refresh_interval > 0
+
+    def _ensure_thread(self):
+        if not self._use_background_refresh():
+            return
+
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            # Threads do not survive a fork, so each worker starts its own
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='oauth-metadata-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # Check often enough that a document is never much older than the interval
+        while True:
+            time.sleep(max(self.refresh_interval / 10, 1))
+            try:
+                self.refresh_due()
+            except Exception as e:
+                self._app.logger.error(f"OAuth metadata refresh failed: {e}")
+
+
+oauth_metadata = OAuthMetadataCache()
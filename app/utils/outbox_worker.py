@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+
+
+class OutboxWorker:
+    """Fixed pool of sender threads draining the email outbox.
+
+    Each sender claims a batch of due emails and delivers it over one SMTP
+    connection, then sleeps until woken by a new email or until ``interval``
+    seconds pass (which also picks up retries and emails left behind by a
+    worker that died). Every ``purge_interval`` seconds one of them also
+    deletes sent and failed emails past their retention.
+    """
+
+    def __init__(self, workers=2, interval=5, purge_interval=3600):
+        self.workers = workers
+        self.interval = interval
+        self.purge_interval = purge_interval
+        self._next_purge = 0
+        self._app = None
+        self._wake = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.workers = app.config.get('EMAIL_OUTBOX_WORKERS', 2)
+        self.interval = app.config.get('EMAIL_OUTBOX_POLL_INTERVAL', 5)
+        self.purge_interval = app.config.get('EMAIL_OUTBOX_PURGE_INTERVAL', 3600)
+
+        # Start senders lazily so emails queued before a restart still go out
+        app.before_request(self._start_senders)
+
+    def wake(self):
+        """Tell the senders there is new mail"""
+        if self._ensure_threads():
+            self._wake.set()
+
+    def _start_senders(self):
+        self._ensure_threads()
+
+    def _use_background_senders(self):
+        # Tests drain the outbox explicitly instead of racing sender threads
+        if self._app is None or self._app.config.get('TESTING', False):
+            return False
+        return self.workers > 0
+
+    def _running(self):
+        return self._pid == os.getpid() and len(self._threads) == self.workers and all(
+            thread.is_alive() for thread in self._threads
+        )
+
+    def _ensure_threads(self):
+        if not self._use_background_senders():
+            return False
+
+        if self._running():
+            return True
+
+        with self._lock:
+            # Threads do not survive a fork, so each worker starts its own senders
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._threads = []
+
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run, name=f'email-outbox-{len(self._threads)}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        return True
+
+    def _run(self):
+        from app.services.email_service import process_outbox
+
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+            with self._app.app_context():
+                try:
+                    # Keep going while full batches come back
+                    batch_size = self._app.config.get('EMAIL_OUTBOX_BATCH_SIZE', 50)
+                    while process_outbox(batch_size) >= batch_size:
+                        pass
+                except Exception as e:
+                    self._app.logger.error(f"Email outbox sender failed: {e}")
+
+                self._purge_if_due()
+
+    def _purge_if_due(self):
+        # One sender per worker takes each purge; the others skip it
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+
+        from app.services.email_service import purge_outbox
+        try:
+            purged = purge_outbox()
+            if purged:
+                self._app.logger.info(f"Purged {purged} old outbox emails")
+        except Exception as e:
+            self._app.logger.error(f"Email outbox purge failed: {e}")
+
+
+outbox_worker = OutboxWorker()
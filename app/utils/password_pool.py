@@ -0,0 +1,223 @@
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+import bcrypt
+from redis import exceptions as redis_exceptions
+
+
+# Work factor picked by the first worker to calibrate, shared so every worker agrees.
+# The key carries the target and bounds, so changing them recalibrates, and it
+# expires so new hardware is timed again within a week
+ROUNDS_KEY = 'bcrypt:log_rounds'
+ROUNDS_TTL = 7 * 24 * 3600
+
+# Flask-Bcrypt's default cost, used when calibration is off (and in tests)
+DEFAULT_ROUNDS = 12
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when too many password operations are already queued"""
+
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def _prepare_password(password, handle_long_passwords):
+    password = _to_bytes(password)
+    if handle_long_passwords:
+        password = _to_bytes(hashlib.sha256(password).hexdigest())
+    return password
+
+
+def hash_password(password, rounds, prefix, handle_long_passwords):
+    """Hash a password the same way Flask-Bcrypt does; runs inside the pool"""
+    salt = bcrypt.gensalt(rounds=rounds, prefix=_to_bytes(prefix))
+    return bcrypt.hashpw(_prepare_password(password, handle_long_passwords), salt).decode('utf-8')
+
+
+def get_hash_rounds(pw_hash):
+    """Return the (prefix, cost) stored in a bcrypt hash, or None if it is not one"""
+    try:
+        _, prefix, cost, _ = pw_hash.split('$', 3)
+        return prefix, int(cost)
+    except (AttributeError, ValueError):
+        return None
+
+
+def calibrate_rounds(target_ms, min_rounds=10, max_rounds=16):
+    """Pick the highest bcrypt cost whose hash time stays within target_ms"""
+    # Each extra round doubles the work, so one timing at min_rounds predicts the rest
+    salt = bcrypt.gensalt(rounds=min_rounds)
+    elapsed = min(_time_hash(salt) for _ in range(2))
+    
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed * 2 ** (rounds + 1 - min_rounds) * 1000 <= target_ms:
+        rounds += 1
+    return rounds
+
+
+def _time_hash(salt):
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibration', salt)
+    return time.perf_counter() - start
+
+
+def check_password(pw_hash, password, handle_long_passwords):
+    """Compare a password against a hash in constant time; runs inside the pool"""
+    pw_hash = _to_bytes(pw_hash)
+    return hmac.compare_digest(bcrypt.hashpw(_prepare_password(password, handle_long_passwords), pw_hash), pw_hash)
+
+
+class PasswordPool:
+    """Bounded process pool for bcrypt hashing and verification.
+
+    Password work runs in ``workers`` child processes so a login burst does
+    not pin request threads on CPU. At most ``max_pending`` operations may be
+    queued or running per worker process; beyond that, and when a result
+    takes longer than ``timeout`` seconds, PasswordPoolBusy is raised so the
+    caller can answer 503 right away. The bound only comes into play when a
+    process serves concurrent requests, hence gthread workers in the image.
+
+    The bcrypt cost is BCRYPT_LOG_ROUNDS when set; otherwise each worker
+    calibrates it to BCRYPT_TARGET_MS in init_app, at boot, reusing the
+    cost another worker stored in Redis for the same settings so all
+    workers hash with the same cost.
+    """
+
+    def __init__(self, workers=2, max_pending=8, timeout=5):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.rounds = None
+        self.target_ms = 0
+        self.min_rounds = 10
+        self.max_rounds = 16
+        self.prefix = '2b'
+        self.handle_long_passwords = False
+        self._app = None
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending > 0 else None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.workers = app.config.get('PASSWORD_POOL_WORKERS', 2)
+        self.max_pending = app.config.get('PASSWORD_POOL_MAX_PENDING', 8)
+        self.timeout = app.config.get('PASSWORD_POOL_TIMEOUT', 5)
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS') or None
+        self.target_ms = app.config.get('BCRYPT_TARGET_MS', 0)
+        self.min_rounds = app.config.get('BCRYPT_MIN_ROUNDS', 10)
+        self.max_rounds = app.config.get('BCRYPT_MAX_ROUNDS', 16)
+        self.prefix = app.config.get('BCRYPT_HASH_PREFIX', '2b')
+        self.handle_long_passwords = app.config.get('BCRYPT_HANDLE_LONG_PASSWORDS', False)
+        self._slots = threading.BoundedSemaphore(self.max_pending) if self.max_pending > 0 else None
+        self.shutdown()
+
+        # Time bcrypt while the worker boots, not inside the first request that hashes
+        if self.rounds is None and not app.config.get('TESTING', False):
+            self.rounds = self.calibrate()
+
+    def hash(self, password):
+        """Return the bcrypt hash of a password as a string"""
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        return self._run(hash_password, password, self.get_rounds(), self.prefix, self.handle_long_passwords)
+
+    def verify(self, pw_hash, password):
+        """Check a password against a stored bcrypt hash"""
+        return self._run(check_password, pw_hash, password, self.handle_long_passwords)
+
+    def needs_rehash(self, pw_hash):
+        """Whether a stored hash was made with a different cost or prefix than the current one"""
+        stored = get_hash_rounds(pw_hash)
+        if stored is None:
+            return False
+        return stored != (self.prefix, self.get_rounds())
+
+    def get_rounds(self):
+        """Return the bcrypt cost: configured, calibrated at boot, or Flask-Bcrypt's default"""
+        return DEFAULT_ROUNDS if self.rounds is None else self.rounds
+
+    def calibrate(self):
+        """Pick the cost for BCRYPT_TARGET_MS, reusing one stored by another worker with the same settings"""
+        if not self.target_ms or self._app is None:
+            return DEFAULT_ROUNDS
+
+        from app.services.redis_service import get_redis
+        with self._app.app_context():
+            redis = get_redis()
+        key = f"{ROUNDS_KEY}:{self.target_ms}:{self.min_rounds}:{self.max_rounds}"
+        try:
+            shared = redis.get(key) if redis else None
+        except redis_exceptions.RedisError as e:
+            self._app.logger.warning(f"Failed to read shared bcrypt cost: {e}")
+            redis = shared = None
+        if shared:
+            return int(shared)
+
+        rounds = calibrate_rounds(self.target_ms, self.min_rounds, self.max_rounds)
+        self._app.logger.info(f"Calibrated bcrypt cost to {rounds} rounds for {self.target_ms}ms")
+        if redis:
+            try:
+                # Another worker may have won the race; use whatever it stored
+                redis.set(key, rounds, nx=True, ex=ROUNDS_TTL)
+                rounds = int(redis.get(key) or rounds)
+            except redis_exceptions.RedisError as e:
+                self._app.logger.warning(f"Failed to share bcrypt cost: {e}")
+        return rounds
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        if slots is not None and not slots.acquire(blocking=False):
+            raise PasswordPoolBusy('Too many password operations in progress')
+
+        try:
+            if not self._use_processes():
+                return fn(*args)
+
+            future = self._get_executor().submit(fn, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                raise PasswordPoolBusy('Password operation timed out')
+        finally:
+            if slots is not None:
+                slots.release()
+
+    def _use_processes(self):
+        # Tests hash inline; spawning processes per test run would only slow them down
+        if self._app is not None and self._app.config.get('TESTING', False):
+            return False
+        return self.workers > 0
+
+    def _get_executor(self):
+        # A pool inherited through fork is unusable, so each worker creates its own
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Children come from a clean fork server, not from this threaded process
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+            self._pid = None
+
+
+password_pool = PasswordPool()
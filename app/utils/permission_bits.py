@@ -0,0 +1,51 @@
+from app import db
+from app.utils.cache import cached
+
+
+def encode_mask(mask):
+    """Compact text form of a permission bitmask (lowercase hex)"""
+    return format(mask, 'x')
+
+
+def decode_mask(text):
+    """Inverse of encode_mask; an empty string is no permissions"""
+    return int(text, 16) if text else 0
+
+
+@cached('permissions', key=lambda: 'bits')
+def get_permission_bits():
+    """Map of permission name to its bit index"""
+    from app.models.role import Permission
+    return dict(db.session.query(Permission.name, Permission.bit_index).all())
+
+
+def mask_of(bit_indexes):
+    """Bitmask with the given bits set"""
+    mask = 0
+    for bit_index in bit_indexes:
+        mask |= 1 << bit_index
+    return mask
+
+
+def permission_bit(permission_name):
+    """Single-bit mask of a permission, or 0 if no such permission exists"""
+    index = get_permission_bits().get(permission_name)
+    return 0 if index is None else 1 << index
+
+
+def names_for_mask(mask):
+    """Names of the permissions whose bits are set in mask"""
+    return frozenset(name for name, index in get_permission_bits().items() if mask >> index & 1)
+
+
+@cached('role_masks')
+def get_role_mask(role_id):
+    """Bitmask of a role's permissions"""
+    from app.models.role import Permission
+    return Permission.mask_for_role(role_id)
+
+
+def get_user_mask(user_id, service_id):
+    """Bitmask of a user's permissions in a service, from their materialized grants"""
+    from app.models.role import Permission
+    return Permission.mask_for_user(user_id, service_id)
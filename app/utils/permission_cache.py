@@ -0,0 +1,62 @@
+from app.utils.cache import cache, MISS
+from app.utils.permission_bits import names_for_mask
+
+
+class PermissionCache:
+    """Effective permission bitmasks kept in the shared two-tier cache.
+
+    Each service has its own namespace keyed by user id, so a role change
+    drops every mask of its service with one version bump while an
+    assignment change drops a single entry. Entries live in Redis for
+    ``ttl`` seconds, and invalidations reach the other workers through the
+    cache's broadcasts. Concurrent misses for one (user, service) share a
+    single query.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PERMISSION_CACHE_TTL', 60)
+
+    def get(self, user_id, service_id):
+        """Return the cached permission mask or None on a miss"""
+        mask = cache.get(self._namespace(service_id), user_id)
+        return None if mask is MISS else mask
+
+    def get_or_load(self, user_id, service_id, loader):
+        """Return the cached permission mask, calling loader() for it on a miss"""
+        return cache.get_or_load(self._namespace(service_id), user_id, loader, ttl=self.ttl)
+
+    def invalidate(self, service_id, user_id=None):
+        """Drop one user's mask in a service, or every mask of the service"""
+        if user_id is None:
+            cache.invalidate_namespace(self._namespace(service_id))
+        else:
+            cache.delete(self._namespace(service_id), user_id)
+
+    def _namespace(self, service_id):
+        return f"permission_masks:{service_id}"
+
+
+permission_cache = PermissionCache()
+
+
+def init_permission_cache(app):
+    """Configure the permission cache from app config"""
+    permission_cache.init_app(app)
+
+
+def get_user_permission_mask(user, service_id):
+    """Get the effective permission bitmask for a user in a service, using the cache"""
+    return permission_cache.get_or_load(user.id, service_id, lambda: user.get_permission_mask(service_id))
+
+
+def get_user_permissions(user, service_id):
+    """Get the effective permission names for a user in a service, using the cache"""
+    return names_for_mask(get_user_permission_mask(user, service_id))
+
+
+def invalidate_user_permissions(service_id, user_id=None):
+    """Invalidate cached permission masks after a role or assignment change"""
+    permission_cache.invalidate(service_id, user_id=user_id)
@@ -0,0 +1,156 @@
+import hashlib
+import math
+import threading
+import time
+
+from app.utils.event_listener import EventListener
+
+REVOCATION_CHANNEL = 'token_revocations'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings; no false negatives, tunable false positives"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        # The listener thread and request threads add concurrently, and |= on a
+        # byte is a read-modify-write that would otherwise lose bits
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        # Double hashing: k positions from two halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """Per-worker Bloom filter in front of the Redis token revocation list.
+
+    A jti that is not in the filter was never revoked, so most requests are
+    answered without touching Redis; only filter hits (revoked tokens and the
+    rare false positive) are confirmed with a Redis lookup. The filter is
+    loaded from Redis on first use, kept current through pub/sub, and
+    rebuilt every ``rebuild_interval`` seconds to shed expired jtis.
+
+    Until it is loaded (or when its listener has died) every check goes to
+    Redis, so a revocation is never missed.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001, rebuild_interval=3600):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self._app = None
+        self._filter = None
+        self._loaded_at = 0
+        self._pending = None
+        self._listener = EventListener(REVOCATION_CHANNEL, self._handle_revocation)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.capacity = app.config.get('REVOCATION_FILTER_CAPACITY', 1000000)
+        self.rebuild_interval = app.config.get('REVOCATION_FILTER_REBUILD_INTERVAL', 3600)
+        self.reset()
+
+        from app import jwt
+        jwt.token_in_blocklist_loader(self._check_token)
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._loaded_at = 0
+            self._pending = None
+
+    def add(self, jti):
+        """Record a revoked jti in this worker's filter"""
+        bloom = self._filter
+        if bloom is not None:
+            bloom.add(jti)
+
+        # A rebuild in progress must not lose revocations made while it reads Redis
+        pending = self._pending
+        if pending is not None:
+            pending.append(jti)
+
+    def might_be_revoked(self, jti):
+        """False only when the jti is certainly not revoked"""
+        bloom = self._ensure_filter()
+        return bloom is None or jti in bloom
+
+    def _check_token(self, jwt_header, jwt_payload):
+        jti = jwt_payload.get('jti')
+        if not jti or not self.might_be_revoked(jti):
+            return False
+
+        from app.services.redis_service import is_token_revoked
+        return is_token_revoked(jti)
+
+    def _handle_revocation(self, payload):
+        for jti in payload.get('jtis', []):
+            self.add(jti)
+
+    def _ensure_filter(self):
+        if self._app is None:
+            return None
+        if not self._listening():
+            self._filter = None
+
+        bloom = self._filter
+        if bloom is not None and time.monotonic() - self._loaded_at < self.rebuild_interval:
+            return bloom
+
+        # One thread rebuilds; the rest keep using the current filter (or Redis) meanwhile
+        if not self._lock.acquire(blocking=False):
+            return bloom
+        try:
+            self._rebuild()
+        except Exception as e:
+            self._app.logger.error(f"Failed to load token revocation filter: {e}")
+        finally:
+            self._pending = None
+            self._lock.release()
+        return self._filter
+
+    def _rebuild(self):
+        from app.services.redis_service import get_redis, get_revoked_jtis
+
+        with self._app.app_context():
+            if get_redis() is None:
+                return
+
+            # Subscribe before reading the snapshot so no revocation falls in between
+            self._listener.ensure(self._app)
+            self._pending = []
+            bloom = BloomFilter(self.capacity, self.error_rate)
+            for jti in get_revoked_jtis():
+                bloom.add(jti)
+
+        # Swap first so later revocations land in the new filter, then replay the ones we raced
+        self._filter = bloom
+        self._loaded_at = time.monotonic()
+        for jti in list(self._pending):
+            bloom.add(jti)
+
+    def _listening(self):
+        # Tests run a single process, where revoke_tokens updates the filter directly
+        if self._app.config.get('TESTING', False):
+            return True
+        return self._listener.alive()
+
+
+revocation_filter = RevocationFilter()
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import db
+from app.models.user import User, cache_namespace
+from app.utils.cache import cache
+
+# Columns kept in the cache; secrets such as the password hash and the
+# email tokens stay in the database and load on first access
+FIELDS = (
+    'id', 'public_id', 'email', 'first_name', 'last_name', 'is_active', 'is_email_verified',
+    'created_at', 'updated_at', 'last_login', 'google_id', 'microsoft_id', 'discord_id'
+)
+DATETIME_FIELDS = ('created_at', 'updated_at', 'last_login')
+
+
+class UserCache:
+    """User rows by public id, kept in the shared two-tier cache.
+
+    Each user has its own namespace, which every committed insert, update or
+    delete of the row bumps, so a lookup still loading when the user changes
+    never stores what it read. Cached rows are merged into the session
+    without a SELECT and behave like any other loaded User.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL', 60)
+
+    def get_or_load(self, public_id, loader):
+        """Return the User, calling loader() for it (or None) on a miss"""
+        data = cache.get_or_load(cache_namespace(public_id), 'row', lambda: self._capture(loader()), ttl=self.ttl)
+        return None if data is None else self._attach(data)
+
+    def _capture(self, user):
+        if user is None:
+            return None
+        data = {field: getattr(user, field) for field in FIELDS}
+        for field in DATETIME_FIELDS:
+            data[field] = data[field].isoformat() if data[field] else None
+        return data
+
+    def _attach(self, data):
+        data = dict(data)
+        for field in DATETIME_FIELDS:
+            data[field] = datetime.fromisoformat(data[field]) if data[field] else None
+        user = User(**data)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+
+user_cache = UserCache()
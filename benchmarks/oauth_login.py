@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Compare the previous OAuth callback path with the upsert fast path.
+
+Uses the configured Redis when it is reachable and fakeredis otherwise.
+
+Usage:
+    python benchmarks/oauth_login.py [--iterations 200]
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token
+from app import create_app, db
+from app.models.user import User
+from app.services import redis_service
+from app.services.auth_service import login_oauth_user
+
+
+def legacy_callback(provider_field, oauth_id, email, first_name, last_name):
+    """The previous handle_oauth_user: email lookup, separate commits, decode to recover the jti.
+
+    It also writes the refresh token family separately from the session, so
+    both paths leave the same state in Redis.
+    """
+    user = User.query.filter_by(email=email).first()
+    if user:
+        if not getattr(user, provider_field):
+            setattr(user, provider_field, oauth_id)
+            db.session.commit()
+    else:
+        user = User(
+            email=email,
+            first_name=first_name,
+            last_name=last_name,
+            is_email_verified=True,
+            is_active=True
+        )
+        setattr(user, provider_field, oauth_id)
+        db.session.add(user)
+        db.session.commit()
+
+    # The original passed user.id, which current PyJWT refuses to decode as a subject
+    family_id = str(uuid.uuid4())
+    access_token = create_access_token(identity=user.public_id, additional_claims={'fam': family_id})
+    refresh_token = create_refresh_token(identity=user.public_id, additional_claims={'fam': family_id})
+    jti = decode_token(access_token)['jti']
+    redis_service.create_refresh_family(family_id, user, decode_token(refresh_token)['jti'])
+    redis_service.add_user_session(user.id, jti, family_id)
+
+    return {'success': True, 'access_token': access_token, 'refresh_token': refresh_token, 'user': user.to_dict()}
+
+
+class RoundTripCounter:
+    """Count commands and pipelines sent to a Redis client"""
+
+    def __init__(self, client):
+        self.count = 0
+        execute_command = client.execute_command
+        pipeline = client.pipeline
+
+        def counted_command(*args, **kwargs):
+            self.count += 1
+            return execute_command(*args, **kwargs)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted_execute(*a, **kw):
+                self.count += 1
+                return execute(*a, **kw)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        client.execute_command = counted_command
+        client.pipeline = counted_pipeline
+
+
+def measure(label, fn, prefix, iterations, returning, redis_counter):
+    """Sign in ``iterations`` users (new, or already linked when returning) and report cost per login"""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    if returning:
+        for i in range(iterations):
+            fn('google_id', f'{prefix}-{i}', f'{prefix}{i}@example.com', 'Bench', 'User')
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    round_trips = redis_counter.count
+    elapsed = 0.0
+    try:
+        for i in range(iterations):
+            db.session.expire_all()
+            start = time.perf_counter()
+            result = fn('google_id', f'{prefix}-{i}', f'{prefix}{i}@example.com', 'Bench', 'User')
+            elapsed += time.perf_counter() - start
+            assert result['success']
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    print(f"{label:<24} queries/login={len(statements) / iterations:<6.1f} "
+          f"redis_round_trips/login={(redis_counter.count - round_trips) / iterations:<6.1f} "
+          f"avg_latency={elapsed / iterations * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the OAuth callback login path')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['SESSION_LIMIT_PER_USER'] = 0
+    with app.app_context():
+        if redis_service.get_redis() is None:
+            import fakeredis
+            redis_service.redis_client = fakeredis.FakeRedis(decode_responses=True)
+            print("Redis unreachable, using fakeredis")
+        counter = RoundTripCounter(redis_service.get_redis())
+
+        # Load the Lua scripts so neither side pays for it
+        login_oauth_user('google_id', 'warmup', 'warmup@example.com')
+
+        print(f"{args.iterations} iterations")
+        measure('legacy new user', legacy_callback, 'legacy-new', args.iterations, False, counter)
+        measure('fast path new user', login_oauth_user, 'fast-new', args.iterations, False, counter)
+        measure('legacy returning user', legacy_callback, 'legacy-back', args.iterations, True, counter)
+        measure('fast path returning user', login_oauth_user, 'fast-back', args.iterations, True, counter)
+
+
+if __name__ == '__main__':
+    main()
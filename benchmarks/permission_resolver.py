@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Compare the ORM walk, the single-query resolver and role bitmasks for user permissions.
+
+Uses the configured Redis when it is reachable and fakeredis otherwise.
+
+Usage:
+    python benchmarks/permission_resolver.py [--roles 50] [--permissions 200] [--iterations 20]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URI', 'sqlite:///:memory:')
+
+from sqlalchemy import event
+from app import create_app, db
+from app.models.user import User
+from app.models.role import Role, Permission, RolePermission
+from app.models.service import Service
+from app.models.user_service_role import UserServiceRole
+from app.services import redis_service
+from app.utils.permission_bits import names_for_mask
+
+
+def orm_walk(user, service_id):
+    """The previous lazy-loading implementation of User.has_permission"""
+    permissions = set()
+    for role in user.get_roles_for_service(service_id):
+        permissions.update(rp.permission.name for rp in role.role_permissions)
+    return frozenset(permissions)
+
+
+def seed(num_roles, num_permissions):
+    """Create one user holding every role, each role holding every permission"""
+    service = Service(name='bench_service')
+    user = User(email='bench@example.com')
+    db.session.add_all([service, user])
+    db.session.commit()
+
+    permissions = [Permission(name=f'bench:perm{i}') for i in range(num_permissions)]
+    roles = [Role(name=f'bench_role{i}', service_id=service.id) for i in range(num_roles)]
+    db.session.add_all(permissions + roles)
+    db.session.commit()
+
+    db.session.add_all(
+        RolePermission(role_id=role.id, permission_id=perm.id)
+        for role in roles for perm in permissions
+    )
+    db.session.add_all(
+        UserServiceRole(user_id=user.id, service_id=service.id, role_id=role.id)
+        for role in roles
+    )
+    db.session.commit()
+    return user.id, service.id
+
+
+def measure(label, fn, user_id, service_id, iterations):
+    """Run fn on a fresh session each iteration and report queries and latency"""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # Untimed first run, so nothing below pays for a cold cache
+    fn(db.session.get(User, user_id), service_id)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    elapsed = 0.0
+    result = None
+    try:
+        for _ in range(iterations):
+            db.session.expire_all()
+            user = db.session.get(User, user_id)
+            del statements[:]
+            start = time.perf_counter()
+            result = fn(user, service_id)
+            elapsed += time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    print(f"{label:<16} queries={len(statements):<6} "
+          f"avg_latency={elapsed / iterations * 1000:.2f}ms "
+          f"permissions={bin(result).count('1') if isinstance(result, int) else len(result)}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark user permission resolution')
+    parser.add_argument('--roles', type=int, default=50)
+    parser.add_argument('--permissions', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if redis_service.get_redis() is None:
+            import fakeredis
+            redis_service.redis_client = fakeredis.FakeRedis(decode_responses=True)
+            print("Redis unreachable, using fakeredis")
+        user_id, service_id = seed(args.roles, args.permissions)
+        print(f"{args.roles} roles x {args.permissions} permissions, {args.iterations} iterations")
+
+        walked = measure('orm_walk', orm_walk, user_id, service_id, args.iterations)
+        resolved = measure(
+            'resolver',
+            lambda user, sid: user.get_permissions_for_service(sid),
+            user_id, service_id, args.iterations
+        )
+        assert walked == resolved
+
+        # The same indexed read as the resolver, producing an int instead of names
+        masked = measure(
+            'bitmask',
+            lambda user, sid: user.get_permission_mask(sid),
+            user_id, service_id, args.iterations
+        )
+        assert names_for_mask(masked) == resolved
+
+
+if __name__ == '__main__':
+    main()
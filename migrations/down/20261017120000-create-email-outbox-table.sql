@@ -0,0 +1,11 @@
+-- Migration: Create Email Outbox Table
+-- Created at: 2026-10-17T12:00:00
+
+-- Write your DOWN migration SQL here
+
+-- Drop indexes first
+DROP INDEX IF EXISTS idx_email_outbox_status;
+DROP INDEX IF EXISTS idx_email_outbox_next_attempt_at;
+
+-- Drop the table
+DROP TABLE IF EXISTS email_outbox;
\ No newline at end of file
@@ -0,0 +1,10 @@
+-- Migration: Create User Effective Permissions Table
+-- Created at: 2026-10-17T13:00:00
+
+-- Write your DOWN migration SQL here
+
+-- Drop indexes first
+DROP INDEX IF EXISTS idx_user_effective_permissions_service_permission;
+
+-- Drop the table
+DROP TABLE IF EXISTS user_effective_permissions;
\ No newline at end of file
@@ -0,0 +1,10 @@
+-- Migration: Add Permission Bit Index
+-- Created at: 2026-10-17T14:00:00
+
+-- Write your DOWN migration SQL here
+
+-- Drop indexes first
+DROP INDEX IF EXISTS idx_permissions_bit_index;
+
+-- Drop the column
+ALTER TABLE permissions DROP COLUMN bit_index;
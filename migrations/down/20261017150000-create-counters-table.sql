@@ -0,0 +1,7 @@
+-- Migration: Create Counters Table
+-- Created at: 2026-10-17T15:00:00
+
+-- Write your DOWN migration SQL here
+
+-- Drop the table
+DROP TABLE IF EXISTS counters;
@@ -0,0 +1,24 @@
+-- Migration: Require Permission Bit Index
+-- Created at: 2026-10-17T16:00:00
+
+-- Write your DOWN migration SQL here
+
+-- Rebuild the table with bit_index nullable again
+CREATE TABLE permissions_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(50) NOT NULL UNIQUE,
+    bit_index INTEGER,
+    description VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO permissions_new (id, name, bit_index, description, created_at)
+SELECT id, name, bit_index, description, created_at FROM permissions;
+
+DROP TABLE permissions;
+
+ALTER TABLE permissions_new RENAME TO permissions;
+
+-- Recreate the indexes dropped with the old table
+CREATE INDEX IF NOT EXISTS idx_permissions_name ON permissions(name);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_permissions_bit_index ON permissions(bit_index);
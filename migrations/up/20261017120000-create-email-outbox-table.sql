@@ -0,0 +1,26 @@
+-- Migration: Create Email Outbox Table
+-- Created at: 2026-10-17T12:00:00
+
+-- Write your UP migration SQL here
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    subject VARCHAR(255) NOT NULL,
+    recipients TEXT NOT NULL,
+    text_body TEXT NOT NULL,
+    html_body TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by VARCHAR(36),
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Create index on status for claiming due emails
+CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox(status);
+
+-- Create index on next_attempt_at for claiming due emails
+CREATE INDEX IF NOT EXISTS idx_email_outbox_next_attempt_at ON email_outbox(next_attempt_at);
\ No newline at end of file
@@ -0,0 +1,23 @@
+-- Migration: Create User Effective Permissions Table
+-- Created at: 2026-10-17T13:00:00
+
+-- Write your UP migration SQL here
+
+CREATE TABLE IF NOT EXISTS user_effective_permissions (
+    user_id INTEGER NOT NULL,
+    service_id INTEGER NOT NULL,
+    permission_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, service_id, permission_id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (service_id) REFERENCES services(id) ON DELETE CASCADE,
+    FOREIGN KEY (permission_id) REFERENCES permissions(id) ON DELETE CASCADE
+);
+
+-- Create index on (service_id, permission_id) for finding who holds a permission
+CREATE INDEX IF NOT EXISTS idx_user_effective_permissions_service_permission ON user_effective_permissions(service_id, permission_id);
+
+-- Populate from existing role assignments
+INSERT INTO user_effective_permissions (user_id, service_id, permission_id)
+SELECT DISTINCT usr.user_id, usr.service_id, rp.permission_id
+FROM user_service_roles usr
+JOIN role_permissions rp ON rp.role_id = usr.role_id;
\ No newline at end of file
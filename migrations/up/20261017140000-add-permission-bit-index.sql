@@ -0,0 +1,13 @@
+-- Migration: Add Permission Bit Index
+-- Created at: 2026-10-17T14:00:00
+
+-- Write your UP migration SQL here
+
+ALTER TABLE permissions ADD COLUMN bit_index INTEGER;
+
+-- Number existing permissions in id order, matching the previous catalog order
+UPDATE permissions
+SET bit_index = (SELECT COUNT(*) FROM permissions AS earlier WHERE earlier.id < permissions.id);
+
+-- Create unique index on bit_index so no two permissions share a bit
+CREATE UNIQUE INDEX IF NOT EXISTS idx_permissions_bit_index ON permissions(bit_index);
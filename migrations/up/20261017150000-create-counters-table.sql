@@ -0,0 +1,13 @@
+-- Migration: Create Counters Table
+-- Created at: 2026-10-17T15:00:00
+
+-- Write your UP migration SQL here
+
+CREATE TABLE IF NOT EXISTS counters (
+    name VARCHAR(50) PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0
+);
+
+-- Permission bits continue after the highest one handed out so far
+INSERT INTO counters (name, value)
+SELECT 'permission_bit_index', COALESCE(MAX(bit_index) + 1, 0) FROM permissions;
@@ -29,6 +29,9 @@ def main():
     down_parser = migrate_subparsers.add_parser("down", help="Run down migrations")
     down_parser.add_argument("--steps", type=int, help="Number of migrations to revert")
     
+    # Rebuild materialized permissions command
+    subparsers.add_parser("rebuild-permissions", help="Recompute the user_effective_permissions table")
+    
     args = parser.parse_args()
     
     if args.command == "run" or args.command is None:
@@ -51,6 +54,13 @@ def main():
             run_migrations("down", args.steps)
         else:
             migrate_parser.print_help()
+    elif args.command == "rebuild-permissions":
+        from app.services.role_service import rebuild_effective_permissions
+        
+        app = create_app()
+        with app.app_context():
+            count = rebuild_effective_permissions()
+        print(f"Rebuilt user_effective_permissions: {count} grants")
     else:
         parser.print_help()
 
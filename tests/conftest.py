@@ -1,17 +1,27 @@
 import os
+import json
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
 import pytest
 import fakeredis
 from datetime import datetime, timedelta
 from flask_jwt_extended import create_access_token, create_refresh_token
 from unittest.mock import patch, MagicMock
+from sqlalchemy import event
+from email import message_from_bytes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
 
-from app import create_app, db
+from app import create_app, db, mail
 from app.models.user import User
 from app.models.role import Role, Permission, RolePermission
 from app.models.service import Service
 from app.models.user_service_role import UserServiceRole
 from app.models.app_token import AppToken
 from app.services.redis_service import redis_client
+from app.utils.last_used_buffer import last_used_buffer
+from app.utils.jwt_keys import jwt_keys
 
 
 @pytest.fixture
@@ -23,6 +33,8 @@ def app():
     os.environ["SECRET_KEY"] = "test-key"
     os.environ["JWT_SECRET_KEY"] = "test-jwt-key"
     os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    # Hash at Flask-Bcrypt's default cost rather than timing bcrypt at every app start
+    os.environ["BCRYPT_LOG_ROUNDS"] = "12"
     
     app = create_app()
     
@@ -50,6 +62,7 @@ def app():
     yield app
     
     # Clean up
+    last_used_buffer.flush()
     db.session.remove()
     db.drop_all()
     
@@ -69,6 +82,19 @@ def db_session(app):
     yield db.session
 
 
+@pytest.fixture
+def query_counter(app):
+    """Count SQL statements executed against the test database."""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
 @pytest.fixture
 def mock_redis(monkeypatch):
     """Mock Redis client for testing."""
@@ -218,4 +244,176 @@ def mock_mail(app, monkeypatch):
     
     # Patch the send_email function in the email_service module
     with patch('app.services.email_service.send_email', side_effect=mock_send_email):
-        yield sent_emails 
\ No newline at end of file
+        yield sent_emails
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages from smtplib"""
+    
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost test SMTP')
+        envelope = {'from': None, 'to': []}
+        
+        while True:
+            line = self.rfile.readline().decode('utf-8', 'replace')
+            if not line:
+                return
+            command = line.strip().split(' ', 1)[0].upper()
+            
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'HELO':
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                envelope = {'from': line.strip()[10:], 'to': []}
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                envelope['to'].append(line.strip()[8:])
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b'.\r\n', b'.\n', b''):
+                        break
+                    data.append(data_line)
+                self.server.messages.append({
+                    'from': envelope['from'],
+                    'to': envelope['to'],
+                    'message': message_from_bytes(b''.join(data))
+                })
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+    
+    def reply(self, text):
+        self.wfile.write(f'{text}\r\n'.encode('utf-8'))
+
+
+@pytest.fixture
+def smtp_server(app):
+    """Run a local SMTP server and point Flask-Mail at it."""
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), LocalSMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    app.config.update({
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': server.server_address[1],
+        'MAIL_USE_TLS': False,
+        'MAIL_USE_SSL': False,
+        'MAIL_USERNAME': None,
+        'MAIL_PASSWORD': None,
+        'MAIL_SUPPRESS_SEND': False
+    })
+    mail.init_app(app)
+    
+    yield server
+    
+    server.shutdown()
+    server.server_close()
+
+
+def _write_signing_key(directory, kid, key_type='rsa', public_only=False):
+    """Write a PEM key for kid into directory and return the private key."""
+    if key_type == 'rsa':
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    
+    if public_only:
+        path = directory / f'{kid}.pub.pem'
+        data = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+    else:
+        path = directory / f'{kid}.pem'
+        data = private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+    path.write_bytes(data)
+    return private_key
+
+
+@pytest.fixture
+def write_signing_key():
+    """Return a helper that writes PEM signing keys."""
+    return _write_signing_key
+
+
+@pytest.fixture
+def signing_keys(app, tmp_path):
+    """Sign tokens with an Ed25519 key, with an older RSA key still published."""
+    _write_signing_key(tmp_path, '2026-01', 'rsa')
+    _write_signing_key(tmp_path, '2026-10', 'ed25519')
+    app.config['JWT_SIGNING_KEYS_DIR'] = str(tmp_path)
+    jwt_keys.init_app(app)
+    
+    yield tmp_path
+    
+    # Back to HS256 for whatever runs next
+    app.config.update({
+        'JWT_SIGNING_KEYS_DIR': None,
+        'JWT_ACTIVE_KID': None,
+        'JWT_ALGORITHM': 'HS256',
+        'JWT_DECODE_ALGORITHMS': None
+    })
+    jwt_keys.init_app(app)
+
+
+class OAuthProviderHandler(BaseHTTPRequestHandler):
+    """Serve an OpenID discovery document and JWKS, counting requests per path."""
+    
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        documents = {
+            '/.well-known/openid-configuration': self.server.metadata,
+            '/jwks': self.server.jwks
+        }
+        if self.path not in documents or self.server.failing:
+            self.send_response(503)
+            self.end_headers()
+            return
+        
+        body = json.dumps(documents[self.path]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def oauth_provider():
+    """Run a local stand-in for an OpenID provider's discovery and JWKS endpoints."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OAuthProviderHandler)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.discovery_url = f'{base_url}/.well-known/openid-configuration'
+    server.metadata = {
+        'issuer': base_url,
+        'authorization_endpoint': f'{base_url}/authorize',
+        'token_endpoint': f'{base_url}/token',
+        'jwks_uri': f'{base_url}/jwks'
+    }
+    server.jwks = {'keys': [{'kty': 'RSA', 'kid': 'key-1', 'n': 'AQAB', 'e': 'AQAB'}]}
+    server.requests = []
+    server.failing = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    yield server
+    
+    server.shutdown()
+    server.server_close()
@@ -1,7 +1,10 @@
 import pytest
 import json
 from flask import url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app import db
 from app.models.user import User
+from app.services.redis_service import get_active_sessions_count, get_session_counter_key
 
 
 def test_register_success(client, db_session, mock_mail):
@@ -113,7 +116,67 @@ def test_login_success(client, test_user, mock_redis):
     assert data['user']['email'] == test_user.email
     
     # Check Redis session
-    assert mock_redis.get('active_sessions_count') == '1'
+    assert get_active_sessions_count() == 1
+
+
+def test_login_busy(client, test_user, monkeypatch):
+    """Test that login answers 503 when the password pool is saturated."""
+    from app.utils.password_pool import password_pool, PasswordPoolBusy
+    
+    def busy(*args):
+        raise PasswordPoolBusy()
+    
+    monkeypatch.setattr(password_pool, 'verify', busy)
+    
+    response = client.post(
+        '/api/auth/login',
+        json={
+            'email': test_user.email,
+            'password': 'password123'
+        }
+    )
+    
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    data = json.loads(response.data)
+    assert data['success'] is False
+    assert data['busy'] is True
+
+
+def test_login_rate_limited(app, client, test_user, mock_redis, query_counter):
+    """Test that throttled logins get 429 without touching the database."""
+    app.config['LOGIN_RATE_LIMIT_PER_EMAIL'] = 1
+    credentials = {'email': test_user.email, 'password': 'wrong_password'}
+    
+    response = client.post('/api/auth/login', json=credentials)
+    assert response.status_code == 401
+    
+    del query_counter[:]
+    response = client.post('/api/auth/login', json=credentials)
+    
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert json.loads(response.data)['success'] is False
+    assert query_counter == []
+
+
+def test_login_rate_limit_per_forwarded_client(app, client, test_user, mock_redis, monkeypatch):
+    """Test that behind a trusted proxy each forwarded client gets its own per-IP window."""
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1, x_proto=1))
+    app.config['LOGIN_RATE_LIMIT_PER_IP'] = 1
+    credentials = {'email': test_user.email, 'password': 'wrong_password'}
+    
+    def login(client_ip):
+        return client.post(
+            '/api/auth/login',
+            json=credentials,
+            headers={'X-Forwarded-For': client_ip},
+            environ_base={'REMOTE_ADDR': '10.0.0.1'}
+        )
+    
+    assert login('203.0.113.1').status_code == 401
+    assert login('203.0.113.2').status_code == 401
+    assert login('203.0.113.1').status_code == 429
 
 
 def test_login_invalid_credentials(client, test_user):
@@ -160,8 +223,8 @@ def test_login_unverified_email(client, db_session):
 def test_logout(client, test_user, user_token, mock_redis):
     """Test logout."""
     # Add session to Redis
-    mock_redis.incr('active_sessions_count')
-    mock_redis.sadd(f'user_sessions:{test_user.id}', 'test-jti')
+    mock_redis.incr(get_session_counter_key(test_user.id))
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {'test-jti': 0})
     mock_redis.hset(f'session:test-jti', 'user_id', test_user.id)
     
     # Extract JTI from real token
@@ -170,7 +233,7 @@ def test_logout(client, test_user, user_token, mock_redis):
     jti = token_data['jti']
     
     # Set up session in Redis with the actual JTI
-    mock_redis.sadd(f'user_sessions:{test_user.id}', jti)
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {jti: 0})
     mock_redis.hset(f'session:{jti}', 'user_id', test_user.id)
     
     response = client.post(
@@ -183,7 +246,14 @@ def test_logout(client, test_user, user_token, mock_redis):
     assert data['success'] is True
     
     # Check Redis (session should be removed)
-    assert mock_redis.sismember(f'user_sessions:{test_user.id}', jti) == 0
+    assert mock_redis.zscore(f'user_sessions:{test_user.id}', jti) is None
+    
+    # The token itself no longer works
+    response = client.get(
+        '/api/auth/me',
+        headers={'Authorization': f'Bearer {user_token["access_token"]}'}
+    )
+    assert response.status_code == 401
 
 
 def test_refresh_token(client, test_user, user_token):
@@ -197,6 +267,59 @@ def test_refresh_token(client, test_user, user_token):
     data = json.loads(response.data)
     assert data['success'] is True
     assert 'access_token' in data
+    assert 'refresh_token' in data
+
+
+def test_refresh_token_reuse_rejected(client, test_user, mock_redis):
+    """Test that a refresh token can only be used once."""
+    response = client.post('/api/auth/login', json={'email': test_user.email, 'password': 'password123'})
+    refresh_token = json.loads(response.data)['refresh_token']
+    headers = {'Authorization': f'Bearer {refresh_token}'}
+    
+    assert client.post('/api/auth/refresh', headers=headers).status_code == 200
+    
+    response = client.post('/api/auth/refresh', headers=headers)
+    assert response.status_code == 401
+    assert json.loads(response.data)['success'] is False
+
+
+def test_refresh_unavailable_without_redis(client, test_user, mock_redis, monkeypatch):
+    """Test that refreshing answers 503 while Redis cannot check the token's family."""
+    response = client.post('/api/auth/login', json={'email': test_user.email, 'password': 'password123'})
+    tokens = json.loads(response.data)
+    monkeypatch.setattr('app.services.redis_service.get_redis', lambda: None)
+    
+    response = client.post('/api/auth/refresh', headers={'Authorization': f'Bearer {tokens["refresh_token"]}'})
+    
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_refresh_keeps_previous_access_token_working(client, test_user, mock_redis):
+    """Test that a refresh lets the previous access token run out instead of revoking it."""
+    response = client.post('/api/auth/login', json={'email': test_user.email, 'password': 'password123'})
+    tokens = json.loads(response.data)
+    
+    response = client.post('/api/auth/refresh', headers={'Authorization': f'Bearer {tokens["refresh_token"]}'})
+    assert response.status_code == 200
+    
+    response = client.get('/api/auth/me', headers={'Authorization': f'Bearer {tokens["access_token"]}'})
+    assert response.status_code == 200
+
+
+def test_logout_with_refreshed_token_ends_session(client, test_user, mock_redis):
+    """Test that after a refresh, logging out revokes both the refreshed and the original access token."""
+    response = client.post('/api/auth/login', json={'email': test_user.email, 'password': 'password123'})
+    tokens = json.loads(response.data)
+    response = client.post('/api/auth/refresh', headers={'Authorization': f'Bearer {tokens["refresh_token"]}'})
+    refreshed = json.loads(response.data)
+    
+    response = client.post('/api/auth/logout', headers={'Authorization': f'Bearer {refreshed["access_token"]}'})
+    assert response.status_code == 200
+    
+    for access_token in (tokens['access_token'], refreshed['access_token']):
+        response = client.get('/api/auth/me', headers={'Authorization': f'Bearer {access_token}'})
+        assert response.status_code == 401
 
 
 def test_change_password(client, test_user, user_token, mock_redis):
@@ -206,7 +329,7 @@ def test_change_password(client, test_user, user_token, mock_redis):
     token_data = decode_token(user_token['access_token'])
     jti = token_data['jti']
     
-    mock_redis.sadd(f'user_sessions:{test_user.id}', jti)
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {jti: 0})
     mock_redis.hset(f'session:{jti}', 'user_id', test_user.id)
     
     response = client.post(
@@ -244,7 +367,7 @@ def test_get_user_profile(client, test_user, user_token):
 def test_get_sessions(client, test_user, user_token, mock_redis):
     """Test getting user sessions."""
     # Add sessions to Redis
-    mock_redis.sadd(f'user_sessions:{test_user.id}', 'token1')
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {'token1': 0})
     mock_redis.hset(f'session:token1', mapping={
         'user_id': test_user.id,
         'created_at': '1609459200',  # 2021-01-01 00:00:00
@@ -263,11 +386,47 @@ def test_get_sessions(client, test_user, user_token, mock_redis):
     assert data['sessions'][0]['jti'] == 'token1'
 
 
+def test_get_sessions_paginated(client, test_user, user_token, mock_redis):
+    """Test paging through sessions with limit and cursor."""
+    for i in range(3):
+        mock_redis.zadd(f'user_sessions:{test_user.id}', {f'token{i}': 1609459200 + i})
+        mock_redis.hset(f'session:token{i}', mapping={
+            'user_id': test_user.id,
+            'created_at': str(1609459200 + i)
+        })
+    headers = {'Authorization': f'Bearer {user_token["access_token"]}'}
+    
+    response = client.get('/api/auth/sessions?limit=2', headers=headers)
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [s['jti'] for s in data['sessions']] == ['token2', 'token1']
+    assert data['next_cursor'] is not None
+    
+    response = client.get(f'/api/auth/sessions?limit=2&cursor={data["next_cursor"]}', headers=headers)
+    
+    data = json.loads(response.data)
+    assert [s['jti'] for s in data['sessions']] == ['token0']
+    assert data['next_cursor'] is None
+
+
+def test_get_sessions_invalid_pagination(client, test_user, user_token):
+    """Test rejecting invalid pagination parameters."""
+    headers = {'Authorization': f'Bearer {user_token["access_token"]}'}
+    
+    response = client.get('/api/auth/sessions?limit=0', headers=headers)
+    assert response.status_code == 400
+    
+    for cursor in ('abc', 'nan:token1', 'inf:token1', '1609459200.0'):
+        response = client.get(f'/api/auth/sessions?cursor={cursor}', headers=headers)
+        assert response.status_code == 400
+
+
 def test_delete_session(client, test_user, user_token, mock_redis):
     """Test deleting a specific session."""
     # Add session to Redis
-    mock_redis.incr('active_sessions_count')
-    mock_redis.sadd(f'user_sessions:{test_user.id}', 'token-to-delete')
+    mock_redis.incr(get_session_counter_key(test_user.id))
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {'token-to-delete': 0})
     mock_redis.hset(f'session:token-to-delete', 'user_id', test_user.id)
     
     response = client.delete(
@@ -280,8 +439,8 @@ def test_delete_session(client, test_user, user_token, mock_redis):
     assert data['success'] is True
     
     # Check Redis (session should be removed)
-    assert mock_redis.sismember(f'user_sessions:{test_user.id}', 'token-to-delete') == 0
-    assert mock_redis.get('active_sessions_count') == '0'
+    assert mock_redis.zscore(f'user_sessions:{test_user.id}', 'token-to-delete') is None
+    assert get_active_sessions_count() == 0
 
 
 def test_delete_all_sessions(client, test_user, user_token, mock_redis):
@@ -292,10 +451,10 @@ def test_delete_all_sessions(client, test_user, user_token, mock_redis):
     jti = token_data['jti']
     
     # Add multiple sessions to Redis
-    mock_redis.incr('active_sessions_count', 3)
-    mock_redis.sadd(f'user_sessions:{test_user.id}', jti)  # Current session
-    mock_redis.sadd(f'user_sessions:{test_user.id}', 'token1')
-    mock_redis.sadd(f'user_sessions:{test_user.id}', 'token2')
+    mock_redis.incr(get_session_counter_key(test_user.id), 3)
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {jti: 0})  # Current session
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {'token1': 0})
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {'token2': 0})
     mock_redis.hset(f'session:{jti}', 'user_id', test_user.id)
     mock_redis.hset(f'session:token1', 'user_id', test_user.id)
     mock_redis.hset(f'session:token2', 'user_id', test_user.id)
@@ -310,17 +469,18 @@ def test_delete_all_sessions(client, test_user, user_token, mock_redis):
     assert data['success'] is True
     
     # Check Redis (only current session should remain)
-    assert mock_redis.scard(f'user_sessions:{test_user.id}') == 1
-    assert mock_redis.sismember(f'user_sessions:{test_user.id}', jti) == 1
-    assert mock_redis.sismember(f'user_sessions:{test_user.id}', 'token1') == 0
-    assert mock_redis.sismember(f'user_sessions:{test_user.id}', 'token2') == 0
-    assert mock_redis.get('active_sessions_count') == '1'
+    assert mock_redis.zcard(f'user_sessions:{test_user.id}') == 1
+    assert mock_redis.zscore(f'user_sessions:{test_user.id}', jti) is not None
+    assert mock_redis.zscore(f'user_sessions:{test_user.id}', 'token1') is None
+    assert mock_redis.zscore(f'user_sessions:{test_user.id}', 'token2') is None
+    assert get_active_sessions_count() == 1
 
 
 def test_get_sessions_stats(client, admin_token, mock_redis):
     """Test getting session statistics."""
-    # Set active sessions count in Redis
-    mock_redis.set('active_sessions_count', 42)
+    # Set active sessions count across counter shards in Redis
+    mock_redis.set('active_sessions_count:0', 40)
+    mock_redis.set('active_sessions_count:5', 2)
     
     response = client.get(
         '/api/auth/sessions/stats',
@@ -330,4 +490,67 @@ def test_get_sessions_stats(client, admin_token, mock_redis):
     assert response.status_code == 200
     data = json.loads(response.data)
     assert data['success'] is True
-    assert data['active_sessions'] == 42 
\ No newline at end of file
+    assert data['active_sessions'] == 42
+    assert data['by_service'] == []
+    assert data['stats_computed_at'] is None
+
+
+def test_get_sessions_stats_breakdown(client, admin_user, admin_token, auth_service, mock_redis):
+    """Test that session statistics include the latest recount."""
+    from app.services.redis_service import recount_sessions
+    mock_redis.zadd(f'user_sessions:{admin_user.id}', {'token1': 1672574400})
+    recount_sessions()
+    
+    response = client.get(
+        '/api/auth/sessions/stats',
+        headers={'Authorization': f'Bearer {admin_token["access_token"]}'}
+    )
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['active_sessions'] == 1
+    assert data['by_service'][0]['service_id'] == auth_service.public_id
+    assert data['by_service'][0]['active_sessions'] == 1
+    assert data['by_hour'] == {'2023-01-01T12:00:00': 1}
+    assert data['stats_computed_at'] is not None 
+
+
+def test_login_embeds_permission_claims(app, client, test_user, test_service, test_role, mock_redis):
+    """Test that login and refresh embed permission bitsets when enabled."""
+    from flask_jwt_extended import decode_token
+    from app.models.role import Permission
+    from app.services.role_service import assign_role_to_user
+    app.config['JWT_PERMISSION_CLAIMS'] = True
+    
+    perm = Permission(name='doc:read')
+    db.session.add(perm)
+    db.session.commit()
+    test_role.add_permission(perm)
+    db.session.commit()
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    
+    response = client.post('/api/auth/login', json={'email': test_user.email, 'password': 'password123'})
+    data = json.loads(response.data)
+    claims = decode_token(data['access_token'])
+    bit = Permission.query.order_by(Permission.id).all().index(perm)
+    assert claims['perms'] == {test_service.public_id: format(1 << bit, 'x')}
+    assert claims['perm_ver'] == 1
+    
+    # Refreshing picks up a newer permissions version
+    mock_redis.incr(f'perm_version:{test_user.id}')
+    response = client.post(
+        '/api/auth/refresh',
+        headers={'Authorization': f'Bearer {data["refresh_token"]}'}
+    )
+    assert decode_token(json.loads(response.data)['access_token'])['perm_ver'] == 2
+
+
+def test_login_without_permission_claims(client, test_user, mock_redis):
+    """Test that permission claims are opt-in."""
+    from flask_jwt_extended import decode_token
+    
+    response = client.post('/api/auth/login', json={'email': test_user.email, 'password': 'password123'})
+    
+    claims = decode_token(json.loads(response.data)['access_token'])
+    assert 'perms' not in claims
+    assert 'perm_ver' not in claims
@@ -3,6 +3,7 @@ import json
 from datetime import datetime, timedelta
 from freezegun import freeze_time
 from app.models.user import User
+from app.services.redis_service import get_active_sessions_count, get_session_counter_key
 
 
 def test_forgot_password(client, test_user, mock_mail):
@@ -71,8 +72,8 @@ def test_reset_password(client, db_session, mock_redis):
         db_session.commit()
         
         # Add a session to Redis
-        mock_redis.incr('active_sessions_count')
-        mock_redis.sadd(f'user_sessions:{user.id}', 'test-token')
+        mock_redis.incr(get_session_counter_key(user.id))
+        mock_redis.zadd(f'user_sessions:{user.id}', {'test-token': 0})
         mock_redis.hset(f'session:test-token', 'user_id', user.id)
         
         response = client.post(
@@ -95,8 +96,8 @@ def test_reset_password(client, db_session, mock_redis):
         assert updated_user.verify_password('old_password') is False
         
         # All sessions should be invalidated
-        assert mock_redis.get('active_sessions_count') == '0'
-        assert mock_redis.sismember(f'user_sessions:{user.id}', 'test-token') == 0
+        assert get_active_sessions_count() == 0
+        assert mock_redis.zscore(f'user_sessions:{user.id}', 'test-token') is None
 
 
 def test_reset_password_expired_token(client, db_session):
@@ -354,4 +354,36 @@ def test_delete_service(client, admin_token, db_session):
     
     # Check database
     deleted_service = Service.query.get(service.id)
-    assert deleted_service is None 
\ No newline at end of file
+    assert deleted_service is None 
+
+
+def test_get_permissions_catalog(client, db_session, test_app_token):
+    """Test that services can fetch the permission catalog with their app token."""
+    db_session.add(Permission(name='doc:read'))
+    db_session.commit()
+    
+    response = client.get(
+        '/api/roles/permissions/catalog',
+        headers={'Authorization': f'Bearer {test_app_token.token}'}
+    )
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['permissions'][-1] == 'doc:read'
+    assert response.headers['ETag'] == f'"{data["version"]}"'
+    
+    response = client.get(
+        '/api/roles/permissions/catalog',
+        headers={
+            'Authorization': f'Bearer {test_app_token.token}',
+            'If-None-Match': f'"{data["version"]}"'
+        }
+    )
+    assert response.status_code == 304
+
+
+def test_get_permissions_catalog_requires_app_token(client):
+    """Test that the permission catalog needs an app token."""
+    response = client.get('/api/roles/permissions/catalog')
+    
+    assert response.status_code == 401
@@ -0,0 +1,50 @@
+import json
+from flask_jwt_extended import create_access_token
+
+
+def test_jwks_lists_public_keys(client, signing_keys):
+    """Test that the JWKS endpoint publishes every key with its kid."""
+    response = client.get('/.well-known/jwks.json')
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    keys = {key['kid']: key for key in data['keys']}
+    assert set(keys) == {'2026-01', '2026-10'}
+    assert keys['2026-01']['kty'] == 'RSA'
+    assert keys['2026-01']['alg'] == 'RS256'
+    assert keys['2026-10']['kty'] == 'OKP'
+    assert keys['2026-10']['alg'] == 'EdDSA'
+    assert all(key['use'] == 'sig' for key in data['keys'])
+    
+    # Never leak private material
+    assert all('d' not in key for key in data['keys'])
+
+
+def test_jwks_cache_headers(client, signing_keys):
+    """Test that the JWKS endpoint is cacheable and answers conditional requests."""
+    response = client.get('/.well-known/jwks.json')
+    
+    assert response.headers['ETag']
+    assert 'public' in response.headers['Cache-Control']
+    assert 'max-age=3600' in response.headers['Cache-Control']
+    
+    response = client.get('/.well-known/jwks.json', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_asymmetric_token_accepted_by_api(client, test_user, signing_keys):
+    """Test that API routes accept tokens signed with the active key."""
+    token = create_access_token(identity=test_user.public_id)
+    
+    response = client.get('/api/auth/me', headers={'Authorization': f'Bearer {token}'})
+    
+    assert response.status_code == 200
+
+
+def test_jwks_empty_without_keys(client):
+    """Test that the JWKS endpoint is empty while tokens are HS256-signed."""
+    response = client.get('/.well-known/jwks.json')
+    
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'keys': []}
@@ -0,0 +1,23 @@
+from app.models.counter import Counter
+
+
+def test_next_value_creates_and_advances(db_session, query_counter):
+    """Test that a counter starts at its start value and each call takes the next one in one statement."""
+    connection = db_session.connection()
+    
+    assert Counter.next_value(connection, 'things', start=5) == 5
+    assert Counter.next_value(connection, 'things', start=5) == 6
+    assert Counter.next_value(connection, 'others') == 0
+    assert len(query_counter) == 3
+    
+    db_session.commit()
+    assert db_session.get(Counter, 'things').value == 7
+
+
+def test_next_value_without_upsert(db_session):
+    """Test the fallback for databases without ON CONFLICT ... RETURNING."""
+    connection = db_session.connection()
+    
+    assert Counter._next_value_without_upsert(connection, 'things', 5) == 5
+    assert Counter._next_value_without_upsert(connection, 'things', 5) == 6
+    assert Counter.next_value(connection, 'things') == 7
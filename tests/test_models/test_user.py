@@ -104,4 +104,35 @@ def test_user_to_dict(db_session):
     assert user_dict['last_name'] == 'User'
     assert user_dict['is_active'] is True
     assert user_dict['is_email_verified'] is True
-    assert 'password' not in user_dict 
\ No newline at end of file
+    assert 'password' not in user_dict
+
+
+def test_user_permissions_single_query(db_session, query_counter):
+    """Test that a user's permission set is resolved with one query."""
+    service = Service(name='test_service')
+    user = User(email='user@example.com')
+    db_session.add_all([service, user])
+    db_session.commit()
+    
+    # Several roles sharing overlapping permissions
+    perms = [Permission(name=f'test:perm{i}') for i in range(6)]
+    db_session.add_all(perms)
+    db_session.commit()
+    for r in range(3):
+        role = Role(name=f'role{r}', service_id=service.id)
+        db_session.add(role)
+        db_session.commit()
+        for perm in perms[r * 2:r * 2 + 3]:
+            role.add_permission(perm)
+        db_session.add(UserServiceRole(user_id=user.id, service_id=service.id, role_id=role.id))
+    db_session.commit()
+    
+    service_id = service.id
+    user.id  # Refresh expired attributes before counting
+    del query_counter[:]
+    permissions = user.get_permissions_for_service(service_id)
+    
+    assert len(query_counter) == 1
+    assert isinstance(permissions, frozenset)
+    assert permissions == frozenset(p.name for p in perms)
+    assert user.get_permissions_for_service(service_id + 1) == frozenset()
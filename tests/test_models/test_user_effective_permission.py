@@ -0,0 +1,118 @@
+import pytest
+from app.models.role import Role, Permission
+from app.models.user_effective_permission import UserEffectivePermission
+from app.services.role_service import (
+    assign_role_to_user,
+    remove_role_from_user,
+    update_role,
+    delete_role,
+    get_users_with_permission,
+    rebuild_effective_permissions
+)
+
+
+@pytest.fixture
+def permissions(db_session):
+    """Three permissions for a document service."""
+    perms = [Permission(name=f'doc:{action}') for action in ('read', 'write', 'delete')]
+    db_session.add_all(perms)
+    db_session.commit()
+    return perms
+
+
+def _granted(user_id, service_id):
+    return {
+        row.permission_id for row in
+        UserEffectivePermission.query.filter_by(user_id=user_id, service_id=service_id).all()
+    }
+
+
+def test_assign_and_remove_role(db_session, test_user, test_service, test_role, permissions):
+    """Test that assigning and removing a role adds and removes its grants."""
+    read, write, _ = permissions
+    test_role.add_permission(read)
+    test_role.add_permission(write)
+    db_session.commit()
+    
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    assert _granted(test_user.id, test_service.id) == {read.id, write.id}
+    
+    remove_role_from_user(test_user.id, test_service.id, test_role.id)
+    assert _granted(test_user.id, test_service.id) == set()
+
+
+def test_overlapping_roles(db_session, test_user, test_service, test_role, permissions):
+    """Test that removing one role keeps permissions another role still grants."""
+    read, write, _ = permissions
+    editor = Role(name='editor', service_id=test_service.id)
+    db_session.add(editor)
+    db_session.commit()
+    test_role.add_permission(read)
+    editor.add_permission(read)
+    editor.add_permission(write)
+    db_session.commit()
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    assign_role_to_user(test_user.id, test_service.id, editor.id)
+    
+    remove_role_from_user(test_user.id, test_service.id, editor.id)
+    
+    assert _granted(test_user.id, test_service.id) == {read.id}
+
+
+def test_role_permission_changes_reach_holders(db_session, test_user, test_service, test_role, permissions):
+    """Test that editing or deleting a role updates every holder's grants."""
+    read, write, delete = permissions
+    test_role.add_permission(read)
+    db_session.commit()
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    
+    update_role(test_role.id, permissions=[write.id, delete.id])
+    assert _granted(test_user.id, test_service.id) == {write.id, delete.id}
+    
+    update_role(test_role.id, permissions=[])
+    assert _granted(test_user.id, test_service.id) == set()
+    
+    update_role(test_role.id, permissions=[read.id])
+    delete_role(test_role.id)
+    assert _granted(test_user.id, test_service.id) == set()
+
+
+def test_deleting_user_cascades(db_session, test_user, test_service, test_role, permissions):
+    """Test that a deleted user's grants go with them."""
+    test_role.add_permission(permissions[0])
+    db_session.commit()
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    
+    db_session.delete(test_user)
+    db_session.commit()
+    
+    assert UserEffectivePermission.query.count() == 0
+
+
+def test_users_with_permission(db_session, test_user, admin_user, test_service, test_role, permissions):
+    """Test the reverse lookup of who holds a permission in a service."""
+    test_role.add_permission(permissions[0])
+    db_session.commit()
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    
+    assert get_users_with_permission(test_service.id, 'doc:read') == [test_user]
+    assert get_users_with_permission(test_service.id, 'doc:write') == []
+
+
+def test_rebuild_repairs_drift(db_session, test_user, test_service, test_role, permissions, query_counter):
+    """Test that a full rebuild restores rows changed outside the application."""
+    test_role.add_permission(permissions[0])
+    db_session.commit()
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    UserEffectivePermission.query.delete()
+    db_session.add(UserEffectivePermission(user_id=test_user.id, service_id=test_service.id, permission_id=permissions[2].id))
+    db_session.commit()
+    
+    rebuild_effective_permissions()
+    
+    assert _granted(test_user.id, test_service.id) == {permissions[0].id}
+    
+    # Permission checks read the materialized rows in one query
+    del query_counter[:]
+    assert test_user.get_permissions_for_service(test_service.id) == frozenset({'doc:read'})
+    assert len(query_counter) == 1
@@ -9,9 +9,21 @@ from app.services.auth_service import (
     get_user_by_id,
     request_password_reset,
     reset_password,
-    change_password
+    change_password,
+    refresh_user_tokens,
+    login_oauth_user,
+    _upsert_oauth_user
 )
+from app.services import auth_service
 from app.models.user import User
+from app.utils.password_pool import hash_password, get_hash_rounds
+from app.services.redis_service import (
+    get_active_sessions_count,
+    get_session_counter_key,
+    invalidate_all_user_sessions,
+    is_token_revoked
+)
+from flask_jwt_extended import create_refresh_token, decode_token
 
 
 def test_register_user(db_session, mock_mail):
@@ -97,7 +109,25 @@ def test_login_user_success(db_session, test_user, mock_redis):
     assert updated_user.last_login is not None
     
     # Check Redis session
-    assert mock_redis.get('active_sessions_count') == '1'
+    assert get_active_sessions_count() == 1
+    
+    # The session is keyed by the access token's jti
+    from flask_jwt_extended import decode_token
+    jti = decode_token(result['access_token'])['jti']
+    assert mock_redis.zscore(f'user_sessions:{test_user.id}', jti) is not None
+
+
+def test_login_user_rehashes_password(db_session, test_user, mock_redis):
+    """Test that logging in upgrades a hash made with another bcrypt cost."""
+    test_user._password = hash_password('password123', 4, '2b', False)
+    db_session.commit()
+    
+    result = login_user(test_user.email, 'password123')
+    
+    assert result['success'] is True
+    updated_user = User.query.get(test_user.id)
+    assert get_hash_rounds(updated_user._password) == ('2b', 12)
+    assert updated_user.verify_password('password123') is True
 
 
 def test_login_user_wrong_password(db_session, test_user):
@@ -145,15 +175,15 @@ def test_login_user_inactive(db_session):
 def test_logout_user(db_session, test_user, mock_redis):
     """Test logging out."""
     # Add a session to Redis
-    mock_redis.incr('active_sessions_count')
-    mock_redis.sadd(f'user_sessions:{test_user.id}', 'test-token')
+    mock_redis.incr(get_session_counter_key(test_user.id))
+    mock_redis.zadd(f'user_sessions:{test_user.id}', {'test-token': 0})
     mock_redis.hset(f'session:test-token', 'user_id', test_user.id)
     
     result = logout_user(test_user.public_id, 'test-token')
     
     assert result['success'] is True
-    assert mock_redis.get('active_sessions_count') == '0'
-    assert mock_redis.sismember(f'user_sessions:{test_user.id}', 'test-token') == 0
+    assert get_active_sessions_count() == 0
+    assert mock_redis.zscore(f'user_sessions:{test_user.id}', 'test-token') is None
 
 
 def test_get_user_by_id(db_session, test_user):
@@ -200,6 +230,46 @@ def test_request_password_reset_nonexistent_email(db_session, mock_mail):
     assert len(mock_mail) == 0
 
 
+def test_request_password_reset_coalesced(db_session, test_user, mock_mail, mock_redis):
+    """Test that repeat requests are suppressed and the outstanding token is reused."""
+    request_password_reset(test_user.email)
+    token = User.query.get(test_user.id).password_reset_token
+    
+    result = request_password_reset(test_user.email)
+    
+    assert result['success'] is True
+    assert len(mock_mail) == 1
+    
+    # Once the window has passed another email goes out with the same token
+    mock_redis.delete(f'email_sent:password_reset:{test_user.email}')
+    request_password_reset(test_user.email)
+    
+    assert len(mock_mail) == 2
+    assert User.query.get(test_user.id).password_reset_token == token
+
+
+def test_request_password_reset_replaces_old_token(db_session, test_user, mock_mail, mock_redis):
+    """Test that a token past half its lifetime is replaced."""
+    test_user.password_reset_token = 'old-token'
+    test_user.password_reset_expires = datetime.utcnow() + timedelta(minutes=10)
+    db_session.commit()
+    
+    request_password_reset(test_user.email)
+    
+    assert User.query.get(test_user.id).password_reset_token != 'old-token'
+
+
+def test_request_password_reset_suppressed_without_query(db_session, mock_mail, mock_redis, query_counter):
+    """Test that repeat requests for an unknown address skip the database."""
+    request_password_reset('nobody@example.com')
+    del query_counter[:]
+    
+    request_password_reset('nobody@example.com')
+    
+    assert query_counter == []
+    assert len(mock_mail) == 0
+
+
 def test_reset_password(db_session, mock_redis):
     """Test resetting password with token."""
     # Create user with reset token
@@ -214,8 +284,8 @@ def test_reset_password(db_session, mock_redis):
     db_session.commit()
     
     # Add a session to Redis
-    mock_redis.incr('active_sessions_count')
-    mock_redis.sadd(f'user_sessions:{user.id}', 'test-token')
+    mock_redis.incr(get_session_counter_key(user.id))
+    mock_redis.zadd(f'user_sessions:{user.id}', {'test-token': 0})
     mock_redis.hset(f'session:test-token', 'user_id', user.id)
     
     # Reset password
@@ -231,8 +301,8 @@ def test_reset_password(db_session, mock_redis):
     assert updated_user.verify_password('old_password') is False
     
     # All sessions should be invalidated
-    assert mock_redis.get('active_sessions_count') == '0'
-    assert mock_redis.sismember(f'user_sessions:{user.id}', 'test-token') == 0
+    assert get_active_sessions_count() == 0
+    assert mock_redis.zscore(f'user_sessions:{user.id}', 'test-token') is None
 
 
 def test_reset_password_expired_token(db_session):
@@ -293,4 +363,274 @@ def test_change_password_wrong_current(db_session, test_user):
     # Check user in database (password should not be changed)
     updated_user = User.query.get(test_user.id)
     assert updated_user.verify_password('password123') is True
-    assert updated_user.verify_password('new_password123') is False 
\ No newline at end of file
+    assert updated_user.verify_password('new_password123') is False 
+
+
+def test_refresh_rotates_without_queries(db_session, test_user, mock_redis, query_counter):
+    """Test that a refresh is served from the family hash and rotates the refresh token."""
+    tokens = login_user(test_user.email, 'password123')
+    refresh_claims = decode_token(tokens['refresh_token'])
+    family_id = refresh_claims['fam']
+    assert decode_token(tokens['access_token'])['fam'] == family_id
+    
+    del query_counter[:]
+    result = refresh_user_tokens(refresh_claims)
+    
+    assert result['success'] is True
+    assert query_counter == []
+    assert decode_token(result['access_token'])['sub'] == test_user.public_id
+    
+    rotated = decode_token(result['refresh_token'])
+    assert rotated['fam'] == family_id
+    assert rotated['jti'] != refresh_claims['jti']
+    assert mock_redis.hget(f'refresh_family:{family_id}', 'jti') == rotated['jti']
+    
+    # The rotated token works in turn
+    assert refresh_user_tokens(rotated)['success'] is True
+
+
+def test_refresh_replaces_session_access_token(db_session, test_user, mock_redis):
+    """Test that a refreshed access token becomes the session while the previous one runs out on its own."""
+    tokens = login_user(test_user.email, 'password123')
+    login_jti = decode_token(tokens['access_token'])['jti']
+    
+    result = refresh_user_tokens(decode_token(tokens['refresh_token']))
+    refreshed_jti = decode_token(result['access_token'])['jti']
+    
+    # Requests already in flight with the previous token keep working
+    assert not is_token_revoked(login_jti)
+    assert mock_redis.zrange(f'user_sessions:{test_user.id}', 0, -1) == [refreshed_jti]
+    assert mock_redis.hget(f'session:{refreshed_jti}', 'family_id') == decode_token(result['access_token'])['fam']
+    assert get_active_sessions_count() == 1
+    
+    # Sessions ended by a password reset include the refreshed token
+    invalidate_all_user_sessions(test_user.id)
+    assert is_token_revoked(refreshed_jti)
+
+
+def test_refresh_token_reuse_revokes_family(db_session, test_user, mock_redis):
+    """Test that replaying an already rotated refresh token ends the whole family."""
+    tokens = login_user(test_user.email, 'password123')
+    stolen = decode_token(tokens['refresh_token'])
+    rotated = decode_token(refresh_user_tokens(stolen)['refresh_token'])
+    
+    result = refresh_user_tokens(stolen)
+    
+    assert result['success'] is False
+    assert not mock_redis.exists(f"refresh_family:{stolen['fam']}")
+    
+    # The legitimate holder is logged out too
+    assert refresh_user_tokens(rotated)['success'] is False
+
+
+def test_refresh_rebuilds_stale_permission_claims(app, db_session, test_user, test_service, test_role, mock_redis):
+    """Test that a refresh after a grant change carries the new permissions version."""
+    from app.services.role_service import assign_role_to_user
+    app.config['JWT_PERMISSION_CLAIMS'] = True
+    tokens = login_user(test_user.email, 'password123')
+    assert decode_token(tokens['access_token'])['perm_ver'] == 0
+    
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    result = refresh_user_tokens(decode_token(tokens['refresh_token']))
+    
+    claims = decode_token(result['access_token'])
+    assert claims['perm_ver'] == 1
+    assert claims['perms'] == {}
+    assert mock_redis.hget(f"refresh_family:{claims['fam']}", 'perm_ver') == '1'
+
+
+def test_refresh_rebuilds_claims_after_catalog_change(app, db_session, test_user, mock_redis):
+    """Test that a refresh after the permission catalog changed carries the new catalog version."""
+    from app.models.role import Permission
+    from app.services.role_service import get_permission_catalog
+    app.config['JWT_PERMISSION_CLAIMS'] = True
+    tokens = login_user(test_user.email, 'password123')
+    old_catalog = decode_token(tokens['access_token'])['perm_catalog']
+    
+    db_session.add(Permission(name='report:read'))
+    db_session.commit()
+    result = refresh_user_tokens(decode_token(tokens['refresh_token']))
+    
+    claims = decode_token(result['access_token'])
+    assert claims['perm_catalog'] == get_permission_catalog()['version'] != old_catalog
+
+
+def test_refresh_for_deleted_user_ends_family(app, db_session, test_user, mock_redis):
+    """Test that refreshing for a user deleted since login fails and ends the family."""
+    app.config['JWT_PERMISSION_CLAIMS'] = True
+    tokens = login_user(test_user.email, 'password123')
+    family_id = decode_token(tokens['refresh_token'])['fam']
+    mock_redis.incr(f'perm_version:{test_user.id}')
+    db_session.delete(test_user)
+    db_session.commit()
+    
+    # The delete itself ends the family
+    assert not mock_redis.exists(f'refresh_family:{family_id}')
+    assert get_active_sessions_count() == 0
+    
+    result = refresh_user_tokens(decode_token(tokens['refresh_token']))
+    
+    assert result['success'] is False
+
+
+def test_refresh_for_deactivated_user_fails(db_session, test_user, mock_redis):
+    """Test that deactivating a user ends their refresh families, whose snapshot still says active."""
+    tokens = login_user(test_user.email, 'password123')
+    
+    test_user.is_active = False
+    db_session.commit()
+    
+    result = refresh_user_tokens(decode_token(tokens['refresh_token']))
+    
+    assert result['success'] is False
+    assert is_token_revoked(decode_token(tokens['access_token'])['jti'])
+
+
+def test_refresh_fails_closed_without_redis(db_session, test_user, mock_redis, monkeypatch):
+    """Test that a family token is refused, not re-issued from the database, while Redis is down."""
+    tokens = login_user(test_user.email, 'password123')
+    monkeypatch.setattr('app.services.redis_service.get_redis', lambda: None)
+    
+    result = refresh_user_tokens(decode_token(tokens['refresh_token']))
+    
+    assert result['success'] is False
+    assert result['busy'] is True
+    assert 'access_token' not in result
+
+
+def test_refresh_legacy_token_starts_family(db_session, test_user, mock_redis):
+    """Test that refresh tokens issued before families existed move onto a family."""
+    legacy = decode_token(create_refresh_token(identity=test_user.public_id))
+    
+    result = refresh_user_tokens(legacy)
+    
+    assert result['success'] is True
+    family_id = decode_token(result['refresh_token'])['fam']
+    assert mock_redis.hget(f'refresh_family:{family_id}', 'public_id') == test_user.public_id
+
+
+def test_logout_ends_refresh_family(db_session, test_user, mock_redis):
+    """Test that logging out stops the session's refresh token from working."""
+    tokens = login_user(test_user.email, 'password123')
+    access_claims = decode_token(tokens['access_token'])
+    
+    logout_user(test_user.public_id, access_claims['jti'])
+    
+    assert refresh_user_tokens(decode_token(tokens['refresh_token']))['success'] is False
+
+
+def test_evicted_session_cannot_refresh(app, db_session, test_user, mock_redis):
+    """Test that a session evicted over the limit cannot be revived with its refresh token."""
+    app.config['SESSION_LIMIT_PER_USER'] = 1
+    first = login_user(test_user.email, 'password123')
+    login_user(test_user.email, 'password123')
+    
+    assert refresh_user_tokens(decode_token(first['refresh_token']))['success'] is False
+
+
+def test_invalidate_sessions_keeps_current_family(db_session, test_user, mock_redis):
+    """Test that ending other sessions keeps the current refresh token family."""
+    current = login_user(test_user.email, 'password123')
+    other = login_user(test_user.email, 'password123')
+    current_claims = decode_token(current['access_token'])
+    
+    invalidate_all_user_sessions(test_user.id, keep_jti=current_claims['jti'], keep_family=current_claims['fam'])
+    
+    assert refresh_user_tokens(decode_token(current['refresh_token']))['success'] is True
+    assert refresh_user_tokens(decode_token(other['refresh_token']))['success'] is False
+
+
+def test_login_oauth_user_creates_user(db_session, mock_redis, query_counter):
+    """Test that a first OAuth login creates a verified user with one lookup and one upsert."""
+    result = login_oauth_user('google_id', 'google-1', 'oauth@example.com', 'OAuth', 'User')
+    
+    assert result['success'] is True
+    statements = [s.split()[0].upper() for s in query_counter if s.split()[0].upper() in ('SELECT', 'INSERT', 'UPDATE')]
+    assert statements == ['SELECT', 'INSERT']
+    
+    user = User.query.filter_by(email='oauth@example.com').first()
+    assert user.google_id == 'google-1'
+    assert user.is_email_verified is True
+    
+    # The session and its refresh token family are recorded together
+    claims = decode_token(result['access_token'])
+    assert claims['sub'] == user.public_id
+    assert mock_redis.exists(f"session:{claims['jti']}")
+    assert mock_redis.hget(f"refresh_family:{claims['fam']}", 'jti') == decode_token(result['refresh_token'])['jti']
+    assert mock_redis.sismember(f'user_refresh_families:{user.id}', claims['fam'])
+    assert refresh_user_tokens(decode_token(result['refresh_token']))['success'] is True
+
+
+def test_login_oauth_user_links_existing_account(db_session, test_user, mock_redis, monkeypatch, query_counter):
+    """Test that OAuth links an account by email, then signs in with one query and one Redis round trip."""
+    login_oauth_user('google_id', 'google-1', test_user.email)
+    assert test_user.google_id == 'google-1'
+    
+    commands = []
+    execute_command = mock_redis.execute_command
+    monkeypatch.setattr(mock_redis, 'execute_command', lambda *args, **kwargs: commands.append(args[0]) or execute_command(*args, **kwargs))
+    
+    # The provider now reports a different address for the same account
+    del query_counter[:]
+    result = login_oauth_user('google_id', 'google-1', 'renamed@example.com')
+    
+    assert len([s for s in query_counter if s.split()[0].upper() in ('SELECT', 'INSERT', 'UPDATE')]) == 1
+    assert result['user']['id'] == test_user.public_id
+    assert User.query.count() == 1
+    assert commands == ['EVALSHA']
+
+
+def test_login_oauth_user_failed_commit_leaves_no_session(db_session, mock_redis, monkeypatch):
+    """Test that nothing is written to Redis when the OAuth user cannot be committed."""
+    def failing_commit():
+        raise RuntimeError('database unavailable')
+    monkeypatch.setattr(db_session, 'commit', failing_commit)
+    
+    with pytest.raises(RuntimeError):
+        login_oauth_user('google_id', 'google-1', 'oauth@example.com')
+    
+    assert mock_redis.keys('session:*') == []
+    assert mock_redis.keys('refresh_family:*') == []
+
+
+def test_login_oauth_user_deactivated(db_session, test_user, mock_redis):
+    """Test that deactivated accounts cannot sign in through OAuth."""
+    test_user.is_active = False
+    db_session.commit()
+    
+    result = login_oauth_user('google_id', 'google-1', test_user.email)
+    
+    assert result['success'] is False
+    assert test_user.google_id is None
+
+
+def test_login_oauth_user_deactivated_during_login(db_session, mock_redis, monkeypatch):
+    """Test that a deactivated row returned by the upsert after a lost race gets no tokens."""
+    upsert = auth_service._upsert_oauth_user
+    
+    def upsert_after_concurrent_signup(*args):
+        # Created and deactivated after our lookup missed it
+        db_session.add(User(email='late@example.com', is_active=False))
+        db_session.flush()
+        return upsert(*args)
+    
+    monkeypatch.setattr(auth_service, '_upsert_oauth_user', upsert_after_concurrent_signup)
+    
+    result = login_oauth_user('google_id', 'google-1', 'late@example.com')
+    
+    assert result['success'] is False
+    assert 'Account is deactivated' in result['message']
+    assert mock_redis.keys('session:*') == []
+
+
+def test_upsert_oauth_user_keeps_linked_provider(db_session, test_user):
+    """Test that the upsert returns a row created concurrently without replacing its provider id."""
+    test_user.microsoft_id = 'microsoft-1'
+    db_session.commit()
+    
+    user = _upsert_oauth_user('microsoft_id', 'microsoft-2', test_user.email, 'Other', 'Name')
+    db_session.commit()
+    
+    assert user.id == test_user.id
+    assert user.microsoft_id == 'microsoft-1'
+    assert user.first_name == 'Test'
@@ -1,11 +1,15 @@
 import pytest
+from freezegun import freeze_time
 from unittest.mock import patch, MagicMock
 from app.services.email_service import (
     send_email,
     send_verification_email,
-    send_password_reset_email
+    send_password_reset_email,
+    process_outbox,
+    purge_outbox
 )
 from app.models.user import User
+from app.models.email_outbox import OutboxEmail
 from datetime import datetime, timedelta
 
 
@@ -73,3 +77,115 @@ def test_send_password_reset_email(app, db_session, mock_mail):
         
         # In test mode, no actual email is sent, but we log it
         # The mock_mail fixture should capture this
+
+
+def test_send_email_queues_in_outbox(app, db_session):
+    """Test that sending an email only writes it to the outbox."""
+    send_email('Queued', ['queued@example.com'], 'Body', '<p>Body</p>')
+    
+    email = OutboxEmail.query.one()
+    assert email.status == OutboxEmail.STATUS_PENDING
+    assert email.get_recipients() == ['queued@example.com']
+    assert email.html_body == '<p>Body</p>'
+
+
+def test_process_outbox_reuses_connection(app, db_session, smtp_server):
+    """Test that a batch of emails is delivered over one SMTP connection."""
+    for i in range(3):
+        send_email(f'Message {i}', [f'user{i}@example.com'], f'Body {i}')
+    
+    assert process_outbox() == 3
+    
+    assert smtp_server.connections == 1
+    assert [m['message']['Subject'] for m in smtp_server.messages] == ['Message 0', 'Message 1', 'Message 2']
+    assert smtp_server.messages[0]['to'] == ['<user0@example.com>']
+    assert all(e.status == OutboxEmail.STATUS_SENT for e in OutboxEmail.query.all())
+    
+    # Nothing left to send
+    assert process_outbox() == 0
+
+
+def test_process_outbox_retries_with_backoff(app, db_session, smtp_server):
+    """Test that failed sends are rescheduled and eventually given up on."""
+    app.config.update({'EMAIL_OUTBOX_MAX_ATTEMPTS': 2, 'EMAIL_OUTBOX_RETRY_BASE': 30})
+    send_email('Retry', ['retry@example.com'], 'Body')
+    
+    # Point at a port nobody listens on
+    smtp_server.shutdown()
+    smtp_server.server_close()
+    
+    with freeze_time("2023-01-01 12:00:00"):
+        OutboxEmail.query.update({'next_attempt_at': datetime.utcnow()})
+        assert process_outbox() == 1
+        
+        email = OutboxEmail.query.one()
+        assert email.status == OutboxEmail.STATUS_PENDING
+        assert email.attempts == 1
+        assert email.next_attempt_at == datetime(2023, 1, 1, 12, 0, 30)
+        assert email.last_error
+        
+        # Not due yet
+        assert process_outbox() == 0
+    
+    with freeze_time("2023-01-01 12:00:31"):
+        assert process_outbox() == 1
+        
+        email = OutboxEmail.query.one()
+        assert email.status == OutboxEmail.STATUS_FAILED
+        assert email.attempts == 2
+
+
+def test_process_outbox_reclaims_abandoned_emails(app, db_session, smtp_server):
+    """Test that emails claimed by a sender that died are sent after the lease expires."""
+    send_email('Abandoned', ['abandoned@example.com'], 'Body')
+    OutboxEmail.query.update({
+        'status': OutboxEmail.STATUS_SENDING,
+        'locked_by': 'dead-sender',
+        'locked_at': datetime.utcnow() - timedelta(seconds=app.config['EMAIL_OUTBOX_LEASE'] + 1)
+    })
+    db_session.commit()
+    
+    assert process_outbox() == 1
+    assert len(smtp_server.messages) == 1
+    assert OutboxEmail.query.one().status == OutboxEmail.STATUS_SENT
+
+
+def test_process_outbox_defers_emails_over_budget(app, db_session, mock_redis, smtp_server):
+    """Test that emails beyond the global per-minute budget wait for the next minute instead of being dropped."""
+    app.config['EMAIL_SEND_BUDGET_PER_MINUTE'] = 2
+    for i in range(3):
+        send_email(f'Message {i}', ['budget@example.com'], 'Body')
+    assert OutboxEmail.query.count() == 3
+    
+    with freeze_time("2023-01-01 12:00:10"):
+        OutboxEmail.query.update({'next_attempt_at': datetime.utcnow()})
+        assert process_outbox() == 3
+        assert len(smtp_server.messages) == 2
+        
+        deferred = OutboxEmail.query.filter_by(status=OutboxEmail.STATUS_PENDING).one()
+        assert deferred.attempts == 0
+        assert deferred.next_attempt_at == datetime(2023, 1, 1, 12, 1)
+        assert process_outbox() == 0
+    
+    with freeze_time("2023-01-01 12:01:00"):
+        assert process_outbox() == 1
+    
+    assert len(smtp_server.messages) == 3
+    assert all(e.status == OutboxEmail.STATUS_SENT for e in OutboxEmail.query.all())
+
+
+def test_purge_outbox_keeps_recent_and_pending_emails(app, db_session):
+    """Test that only sent and failed emails past the retention period are deleted."""
+    for subject in ('Old sent', 'Old failed', 'Old pending', 'New sent'):
+        send_email(subject, ['purge@example.com'], 'Body')
+    
+    old = datetime.utcnow() - timedelta(days=8)
+    OutboxEmail.query.filter_by(subject='Old sent').update({'status': OutboxEmail.STATUS_SENT, 'sent_at': old})
+    OutboxEmail.query.filter_by(subject='Old failed').update({'status': OutboxEmail.STATUS_FAILED, 'created_at': old})
+    OutboxEmail.query.filter_by(subject='Old pending').update({'created_at': old, 'next_attempt_at': datetime.utcnow() + timedelta(hours=1)})
+    OutboxEmail.query.filter_by(subject='New sent').update({'status': OutboxEmail.STATUS_SENT, 'sent_at': datetime.utcnow()})
+    db_session.commit()
+    
+    assert purge_outbox(retention=0) == 0
+    assert purge_outbox(retention=7 * 24 * 3600) == 2
+    assert {e.subject for e in OutboxEmail.query.all()} == {'Old pending', 'New sent'}
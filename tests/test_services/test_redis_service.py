@@ -1,12 +1,22 @@
 import pytest
 from freezegun import freeze_time
-from datetime import datetime
+from datetime import datetime, timedelta
 from app.services.redis_service import (
     add_user_session,
     remove_user_session,
     invalidate_all_user_sessions,
     get_active_sessions_count,
-    get_user_sessions
+    get_user_sessions,
+    get_user_sessions_page,
+    parse_session_cursor,
+    get_user_session_ids,
+    migrate_session_index,
+    reconcile_sessions,
+    recount_sessions,
+    get_session_stats,
+    get_session_counter_key,
+    check_login_rate_limit,
+    is_token_revoked
 )
 
 
@@ -19,25 +29,24 @@ def test_add_user_session(app, mock_redis):
         success = add_user_session(user_id, token_jti)
         
         assert success is True
-        assert mock_redis.get('active_sessions_count') == '1'
-        assert mock_redis.sismember(f'user_sessions:{user_id}', token_jti) == 1
+        assert get_active_sessions_count() == 1
+        assert mock_redis.zscore(f'user_sessions:{user_id}', token_jti) is not None
         assert mock_redis.hget(f'session:{token_jti}', 'user_id') == str(user_id)
 
 
 def test_add_user_session_with_limit(app, mock_redis):
     """Test adding a user session when limit is reached."""
     with app.app_context():
+        # Creation times below are older than the token lifetime, so keep sessions forever
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False
         app.config['SESSION_LIMIT_PER_USER'] = 3
         user_id = 1
         
-        # Reset the active sessions count
-        mock_redis.set('active_sessions_count', '0')
-        
         # Add sessions up to the limit (3 in test config)
         add_user_session(user_id, 'token1')
         
-        # Set created_at for token1 to make it the oldest
-        mock_redis.hset(f'session:token1', 'created_at', '1000')
+        # Score token1 with an early creation time to make it the oldest
+        mock_redis.zadd(f'user_sessions:{user_id}', {'token1': 1000})
         
         with freeze_time("2023-01-01 12:00:00"):
             add_user_session(user_id, 'token2')
@@ -49,13 +58,13 @@ def test_add_user_session_with_limit(app, mock_redis):
             add_user_session(user_id, 'token4')
         
         # We should still have 3 active sessions
-        assert mock_redis.get('active_sessions_count') == '3'
+        assert get_active_sessions_count() == 3
         
         # Check that token1 was removed and the others remain
-        assert mock_redis.sismember(f'user_sessions:{user_id}', 'token1') == 0
-        assert mock_redis.sismember(f'user_sessions:{user_id}', 'token2') == 1
-        assert mock_redis.sismember(f'user_sessions:{user_id}', 'token3') == 1
-        assert mock_redis.sismember(f'user_sessions:{user_id}', 'token4') == 1
+        assert mock_redis.zscore(f'user_sessions:{user_id}', 'token1') is None
+        assert mock_redis.zscore(f'user_sessions:{user_id}', 'token2') is not None
+        assert mock_redis.zscore(f'user_sessions:{user_id}', 'token3') is not None
+        assert mock_redis.zscore(f'user_sessions:{user_id}', 'token4') is not None
 
 
 def test_remove_user_session(app, mock_redis):
@@ -65,15 +74,15 @@ def test_remove_user_session(app, mock_redis):
         token_jti = 'test-token'
         
         # Add session
-        mock_redis.incr('active_sessions_count')
-        mock_redis.sadd(f'user_sessions:{user_id}', token_jti)
+        mock_redis.incr(get_session_counter_key(user_id))
+        mock_redis.zadd(f'user_sessions:{user_id}', {token_jti: 0})
         mock_redis.hset(f'session:{token_jti}', 'user_id', user_id)
         
         success = remove_user_session(user_id, token_jti)
         
         assert success is True
-        assert mock_redis.get('active_sessions_count') == '0'
-        assert mock_redis.sismember(f'user_sessions:{user_id}', token_jti) == 0
+        assert get_active_sessions_count() == 0
+        assert mock_redis.zscore(f'user_sessions:{user_id}', token_jti) is None
         assert mock_redis.exists(f'session:{token_jti}') == 0
 
 
@@ -94,10 +103,10 @@ def test_invalidate_all_user_sessions(app, mock_redis):
         user_id = 1
         
         # Add multiple sessions
-        mock_redis.incr('active_sessions_count', 3)
-        mock_redis.sadd(f'user_sessions:{user_id}', 'token1')
-        mock_redis.sadd(f'user_sessions:{user_id}', 'token2')
-        mock_redis.sadd(f'user_sessions:{user_id}', 'token3')
+        mock_redis.incr(get_session_counter_key(user_id), 3)
+        mock_redis.zadd(f'user_sessions:{user_id}', {'token1': 0})
+        mock_redis.zadd(f'user_sessions:{user_id}', {'token2': 0})
+        mock_redis.zadd(f'user_sessions:{user_id}', {'token3': 0})
         mock_redis.hset(f'session:token1', 'user_id', user_id)
         mock_redis.hset(f'session:token2', 'user_id', user_id)
         mock_redis.hset(f'session:token3', 'user_id', user_id)
@@ -105,8 +114,8 @@ def test_invalidate_all_user_sessions(app, mock_redis):
         success = invalidate_all_user_sessions(user_id)
         
         assert success is True
-        assert mock_redis.get('active_sessions_count') == '0'
-        assert mock_redis.scard(f'user_sessions:{user_id}') == 0
+        assert get_active_sessions_count() == 0
+        assert mock_redis.zcard(f'user_sessions:{user_id}') == 0
         assert mock_redis.exists(f'session:token1') == 0
         assert mock_redis.exists(f'session:token2') == 0
         assert mock_redis.exists(f'session:token3') == 0
@@ -116,7 +125,8 @@ def test_get_active_sessions_count(app, mock_redis):
     """Test getting active sessions count."""
     with app.app_context():
         # Set counter in Redis
-        mock_redis.set('active_sessions_count', 42)
+        mock_redis.set('active_sessions_count:0', 40)
+        mock_redis.set('active_sessions_count:5', 2)
         
         count = get_active_sessions_count()
         
@@ -138,7 +148,7 @@ def test_get_user_sessions(app, mock_redis):
         
         # Add sessions with timestamps
         with freeze_time("2023-01-01 12:00:00"):
-            mock_redis.sadd(f'user_sessions:{user_id}', 'token1')
+            mock_redis.zadd(f'user_sessions:{user_id}', {'token1': datetime.utcnow().timestamp()})
             mock_redis.hset(f'session:token1', mapping={
                 'user_id': str(user_id),
                 'created_at': str(datetime.utcnow().timestamp()),
@@ -146,7 +156,7 @@ def test_get_user_sessions(app, mock_redis):
             })
         
         with freeze_time("2023-01-01 13:00:00"):
-            mock_redis.sadd(f'user_sessions:{user_id}', 'token2')
+            mock_redis.zadd(f'user_sessions:{user_id}', {'token2': datetime.utcnow().timestamp()})
             mock_redis.hset(f'session:token2', mapping={
                 'user_id': str(user_id),
                 'created_at': str(datetime.utcnow().timestamp()),
@@ -178,4 +188,391 @@ def test_get_user_sessions_empty(app, mock_redis):
         
         sessions = get_user_sessions(user_id)
         
-        assert len(sessions) == 0 
\ No newline at end of file
+        assert len(sessions) == 0 
+
+def test_add_user_session_evicts_down_to_limit(app, mock_redis):
+    """Test that a lowered limit evicts every session beyond it."""
+    with app.app_context():
+        # Creation times below are older than the token lifetime, so keep sessions forever
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False
+        user_id = 1
+        app.config['SESSION_LIMIT_PER_USER'] = 5
+        for i in range(5):
+            add_user_session(user_id, f'token{i}')
+            mock_redis.zadd(f'user_sessions:{user_id}', {f'token{i}': 1000 + i})
+        
+        app.config['SESSION_LIMIT_PER_USER'] = 2
+        add_user_session(user_id, 'newest')
+        
+        assert set(mock_redis.zrange(f'user_sessions:{user_id}', 0, -1)) == {'token4', 'newest'}
+        assert mock_redis.exists('session:token0') == 0
+        assert get_active_sessions_count() == 2
+
+
+def test_add_user_session_existing_jti_not_counted_twice(app, mock_redis):
+    """Test that re-adding a session does not inflate the counter."""
+    with app.app_context():
+        add_user_session(1, 'token1')
+        add_user_session(1, 'token1')
+        
+        assert mock_redis.zcard('user_sessions:1') == 1
+        assert get_active_sessions_count() == 1
+
+
+def test_add_user_session_single_round_trip(app, mock_redis, monkeypatch):
+    """Test that adding a session is one script call once the script is loaded."""
+    with app.app_context():
+        add_user_session(1, 'warmup')
+        
+        commands = []
+        original = mock_redis.execute_command
+        
+        def record(*args, **kwargs):
+            commands.append(args[0])
+            return original(*args, **kwargs)
+        
+        monkeypatch.setattr(mock_redis, 'execute_command', record)
+        add_user_session(1, 'token1')
+        
+        assert commands == ['EVALSHA']
+
+
+def test_get_user_session_ids_ordered_by_creation(app, mock_redis):
+    """Test listing the newest sessions and sessions in a time range."""
+    with app.app_context():
+        # Creation times below are older than the token lifetime, so keep sessions forever
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False
+        user_id = 1
+        for hour in (12, 13, 14):
+            with freeze_time(f"2023-01-01 {hour}:00:00"):
+                add_user_session(user_id, f'token{hour}')
+        
+        assert get_user_session_ids(user_id) == ['token14', 'token13', 'token12']
+        assert get_user_session_ids(user_id, limit=2) == ['token14', 'token13']
+        assert get_user_session_ids(user_id, newest_first=False, limit=1) == ['token12']
+        assert get_user_session_ids(
+            user_id,
+            created_after=datetime(2023, 1, 1, 12, 30),
+            created_before=datetime(2023, 1, 1, 13, 30)
+        ) == ['token13']
+
+
+def test_migrate_session_index(app, mock_redis):
+    """Test converting set-based session indexes to sorted sets."""
+    with app.app_context():
+        mock_redis.sadd('user_sessions:1', 'old', 'new')
+        mock_redis.hset('session:old', 'created_at', '1000')
+        mock_redis.hset('session:new', 'created_at', '2000')
+        mock_redis.zadd('user_sessions:2', {'already': 5})
+        
+        assert migrate_session_index() == 1
+        
+        assert mock_redis.type('user_sessions:1') == 'zset'
+        assert mock_redis.zrange('user_sessions:1', 0, -1, withscores=True) == [('old', 1000.0), ('new', 2000.0)]
+        assert mock_redis.zrange('user_sessions:2', 0, -1) == ['already']
+        
+        # Later runs are a no-op
+        mock_redis.sadd('user_sessions:3', 'late')
+        assert migrate_session_index() == 0
+
+
+def test_invalidate_all_user_sessions_keep_current(app, mock_redis):
+    """Test invalidating every session except the current one."""
+    with app.app_context():
+        user_id = 1
+        for jti in ('current', 'other1', 'other2'):
+            add_user_session(user_id, jti)
+        
+        success = invalidate_all_user_sessions(user_id, keep_jti='current')
+        
+        assert success is True
+        assert mock_redis.zrange(f'user_sessions:{user_id}', 0, -1) == ['current']
+        assert mock_redis.exists('session:current') == 1
+        assert mock_redis.exists('session:other1') == 0
+        assert mock_redis.exists('session:other2') == 0
+        assert get_active_sessions_count() == 1
+        
+        # Tokens of the removed sessions are revoked; the kept one still works
+        assert is_token_revoked('other1') and is_token_revoked('other2')
+        assert not is_token_revoked('current')
+
+
+def test_invalidate_all_user_sessions_single_transaction(app, mock_redis, monkeypatch):
+    """Test that bulk invalidation does not fall back to per-session removal."""
+    with app.app_context():
+        user_id = 1
+        for i in range(10):
+            add_user_session(user_id, f'token{i}')
+        
+        def per_session_removal(*args, **kwargs):
+            raise AssertionError('sessions should be removed in one transaction')
+        
+        monkeypatch.setattr('app.services.redis_service.remove_user_session', per_session_removal)
+        invalidate_all_user_sessions(user_id)
+        
+        assert mock_redis.zcard(f'user_sessions:{user_id}') == 0
+        assert get_active_sessions_count() == 0
+        assert not any(mock_redis.exists(f'session:token{i}') for i in range(10))
+
+
+def test_get_user_sessions_page(app, mock_redis):
+    """Test paging through sessions newest first."""
+    with app.app_context():
+        # Creation times below are older than the token lifetime, so keep sessions forever
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False
+        app.config['SESSION_LIMIT_PER_USER'] = 10
+        user_id = 1
+        for minute in range(5):
+            with freeze_time(f"2023-01-01 12:0{minute}:00"):
+                add_user_session(user_id, f'token{minute}')
+        
+        first, cursor = get_user_sessions_page(user_id, 2)
+        assert [s['jti'] for s in first] == ['token4', 'token3']
+        assert cursor is not None
+        
+        second, cursor = get_user_sessions_page(user_id, 2, parse_session_cursor(cursor))
+        assert [s['jti'] for s in second] == ['token2', 'token1']
+        
+        third, cursor = get_user_sessions_page(user_id, 2, parse_session_cursor(cursor))
+        assert [s['jti'] for s in third] == ['token0']
+        assert cursor is None
+
+
+def test_sessions_page_boundary_within_one_tick(app, mock_redis):
+    """Test that sessions sharing a creation score are neither skipped nor repeated across pages."""
+    with app.app_context():
+        mock_redis.zadd('user_sessions:1', {f'token{i}': 1672574400 for i in range(5)})
+        for i in range(5):
+            mock_redis.hset(f'session:token{i}', 'user_id', 1)
+        
+        seen, cursor = [], None
+        while True:
+            page, cursor = get_user_sessions_page(1, 2, cursor and parse_session_cursor(cursor))
+            seen.extend(s['jti'] for s in page)
+            if cursor is None:
+                break
+        
+        assert seen == ['token4', 'token3', 'token2', 'token1', 'token0']
+
+
+def test_parse_session_cursor_rejects_non_finite():
+    """Test that cursors Redis could not use are refused."""
+    assert parse_session_cursor('1672574400.5:token1') == (1672574400.5, 'token1')
+    for cursor in ('nan:token1', 'inf:token1', '-inf:token1', '1672574400.5', 'abc:token1'):
+        with pytest.raises(ValueError):
+            parse_session_cursor(cursor)
+
+
+def test_get_user_sessions_sorted_by_recency(app, mock_redis):
+    """Test that all sessions come back newest first."""
+    with app.app_context():
+        # Creation times below are older than the token lifetime, so keep sessions forever
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False
+        for hour in (12, 14, 13):
+            with freeze_time(f"2023-01-01 {hour}:00:00"):
+                add_user_session(1, f'token{hour}')
+        
+        sessions = get_user_sessions(1)
+        
+        assert [s['jti'] for s in sessions] == ['token14', 'token13', 'token12']
+
+
+def test_add_user_session_sets_ttl(app, mock_redis):
+    """Test that session keys expire with the access token."""
+    with app.app_context():
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=15)
+        add_user_session(1, 'token1')
+        
+        assert 0 < mock_redis.ttl('session:token1') <= 900
+
+
+def test_add_user_session_prunes_expired(app, mock_redis):
+    """Test that expired index entries are pruned before the limit is checked."""
+    with app.app_context():
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+        with freeze_time("2023-01-01 12:00:00"):
+            add_user_session(1, 'token1')
+            add_user_session(1, 'token2')
+            add_user_session(1, 'token3')
+        
+        # Simulate Redis expiring the session hashes
+        mock_redis.delete('session:token1', 'session:token2', 'session:token3')
+        
+        with freeze_time("2023-01-01 13:30:00"):
+            add_user_session(1, 'token4')
+            
+            assert mock_redis.zrange('user_sessions:1', 0, -1) == ['token4']
+            assert get_active_sessions_count() == 1
+
+
+def test_reconcile_sessions(app, mock_redis):
+    """Test pruning expired and orphaned sessions and repairing the counter."""
+    with app.app_context():
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+        now = datetime.utcnow().timestamp()
+        mock_redis.set(get_session_counter_key(1), 3)
+        mock_redis.set(get_session_counter_key(2), 1)
+        mock_redis.zadd('user_sessions:1', {'expired': now - 7200, 'orphaned': now, 'live': now})
+        mock_redis.zadd('user_sessions:2', {'live2': now})
+        mock_redis.hset('session:live', 'user_id', 1)
+        mock_redis.hset('session:live2', 'user_id', 2)
+        mock_redis.hset('session:expired', 'user_id', 1)
+        
+        pruned = reconcile_sessions(batch_size=1)
+        
+        assert pruned == 2
+        assert mock_redis.zrange('user_sessions:1', 0, -1) == ['live']
+        assert not mock_redis.exists('session:expired')
+        assert mock_redis.exists('session:live')
+        assert mock_redis.zrange('user_sessions:2', 0, -1) == ['live2']
+        assert get_active_sessions_count() == 2
+
+
+def test_reconcile_sessions_concurrent_removal(app, mock_redis, monkeypatch):
+    """Test that a session removed while reconciling runs is only counted once."""
+    with app.app_context():
+        now = datetime.utcnow().timestamp()
+        mock_redis.set(get_session_counter_key(1), 2)
+        mock_redis.zadd('user_sessions:1', {'orphaned': now, 'live': now})
+        mock_redis.hset('session:live', 'user_id', 1)
+        
+        pipeline = mock_redis.pipeline
+        calls = []
+        
+        def racing_pipeline(*args, **kwargs):
+            # The third pipeline prunes; a logout lands just before it does
+            calls.append(None)
+            pipe = pipeline(*args, **kwargs)
+            if len(calls) == 3:
+                execute = pipe.execute
+                
+                def execute_after_logout():
+                    remove_user_session(1, 'orphaned')
+                    return execute()
+                
+                pipe.execute = execute_after_logout
+            return pipe
+        
+        monkeypatch.setattr(mock_redis, 'pipeline', racing_pipeline)
+        
+        pruned = reconcile_sessions(batch_size=1)
+        
+        assert pruned == 0
+        assert mock_redis.zrange('user_sessions:1', 0, -1) == ['live']
+        assert get_active_sessions_count() == 1
+
+
+def test_recount_sessions(app, mock_redis, admin_user, auth_service):
+    """Test overwriting drifted counter shards and computing session stats."""
+    with app.app_context():
+        mock_redis.set(get_session_counter_key(admin_user.id), 7)
+        mock_redis.set('active_sessions_count', 99)
+        mock_redis.zadd(f'user_sessions:{admin_user.id}', {'token1': 1672574400, 'token2': 1672578000})
+        mock_redis.zadd('user_sessions:999', {'token3': 1672574500})
+        
+        total = recount_sessions()
+        
+        assert total == 3
+        assert get_active_sessions_count() == 3
+        assert mock_redis.get(get_session_counter_key(admin_user.id)) == '2'
+        assert mock_redis.exists('active_sessions_count') == 0
+        
+        stats = get_session_stats()
+        assert stats['by_service'] == [{
+            'service_id': auth_service.public_id,
+            'name': auth_service.name,
+            'active_sessions': 2
+        }]
+        assert stats['by_hour'] == {'2023-01-01T12:00:00': 2, '2023-01-01T13:00:00': 1}
+
+
+def test_check_login_rate_limit_per_email(app, mock_redis):
+    """Test that attempts beyond the per-email limit are rejected until the window slides."""
+    with app.app_context():
+        app.config.update({'LOGIN_RATE_LIMIT_WINDOW': 60, 'LOGIN_RATE_LIMIT_PER_EMAIL': 2})
+        with freeze_time("2023-01-01 12:00:00"):
+            assert check_login_rate_limit('User@Example.com', '10.0.0.1') == (True, 0)
+        with freeze_time("2023-01-01 12:00:30"):
+            assert check_login_rate_limit('user@example.com', '10.0.0.2') == (True, 0)
+            assert check_login_rate_limit('user@example.com', '10.0.0.3') == (False, 30)
+            
+            # Other addresses are unaffected
+            assert check_login_rate_limit('other@example.com', '10.0.0.3') == (True, 0)
+        
+        with freeze_time("2023-01-01 12:01:01"):
+            assert check_login_rate_limit('user@example.com', '10.0.0.3') == (True, 0)
+
+
+def test_check_login_rate_limit_per_ip_and_global(app, mock_redis):
+    """Test the per-IP and global windows."""
+    with app.app_context():
+        app.config.update({'LOGIN_RATE_LIMIT_PER_IP': 2, 'LOGIN_RATE_LIMIT_GLOBAL': 3})
+        with freeze_time("2023-01-01 12:00:00"):
+            assert check_login_rate_limit('a@example.com', '10.0.0.1')[0] is True
+            assert check_login_rate_limit('b@example.com', '10.0.0.1')[0] is True
+            assert check_login_rate_limit('c@example.com', '10.0.0.1')[0] is False
+            assert check_login_rate_limit('d@example.com', '10.0.0.2')[0] is True
+            assert check_login_rate_limit('e@example.com', '10.0.0.3')[0] is False
+            
+            # Rejected attempts are not recorded
+            assert mock_redis.zcard('login_rate:global') == 3
+
+
+def test_session_eviction_revokes_token(app, mock_redis):
+    """Test that the token of a session evicted over the limit stops working."""
+    with app.app_context():
+        app.config['SESSION_LIMIT_PER_USER'] = 2
+        for jti in ('token1', 'token2', 'token3'):
+            add_user_session(1, jti)
+        
+        assert is_token_revoked('token1')
+        assert not is_token_revoked('token2')
+        assert 0 < mock_redis.ttl('revoked:token1') <= 3600
+
+
+def test_session_eviction_ends_refresh_family(app, mock_redis):
+    """Test that evicting a session over the limit also ends its refresh token family."""
+    with app.app_context():
+        app.config['SESSION_LIMIT_PER_USER'] = 1
+        add_user_session(1, 'token1', 'family1', family={'user_id': 1, 'jti': 'refresh1'})
+        add_user_session(1, 'token2', 'family2', family={'user_id': 1, 'jti': 'refresh2'})
+        
+        assert not mock_redis.exists('refresh_family:family1')
+        assert mock_redis.smembers('user_refresh_families:1') == {'family2'}
+        assert mock_redis.exists('refresh_family:family2')
+
+
+def test_remove_user_session_revokes_token(app, mock_redis):
+    """Test that removing a session revokes its token, even if the session record is gone."""
+    with app.app_context():
+        add_user_session(1, 'token1')
+        
+        remove_user_session(1, 'token1')
+        remove_user_session(1, 'unknown')
+        
+        assert is_token_revoked('token1')
+        assert is_token_revoked('unknown')
+
+
+def test_revocation_lasts_remaining_lifetime(app, mock_redis):
+    """Test that a revoked token stays on the list only until it would have expired."""
+    with app.app_context():
+        app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+        with freeze_time("2023-01-01 12:00:00"):
+            add_user_session(1, 'token1')
+            add_user_session(1, 'token2')
+            add_user_session(1, 'token3')
+        
+        with freeze_time("2023-01-01 12:45:00"):
+            now = datetime.utcnow().timestamp()
+            
+            # From the token's exp claim, or from when its session was created
+            remove_user_session(1, 'token1', expires_at=now + 60)
+            remove_user_session(1, 'token2')
+            
+            assert 0 < mock_redis.ttl('revoked:token1') <= 60
+            assert 800 < mock_redis.ttl('revoked:token2') <= 900
+            
+            # An already expired token is not listed at all
+            remove_user_session(1, 'token3', expires_at=now - 1)
+            assert not mock_redis.exists('revoked:token3')
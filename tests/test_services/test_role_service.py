@@ -1,4 +1,5 @@
 import pytest
+import json
 from app.services.role_service import (
     initialize_default_roles,
     get_user_roles,
@@ -6,7 +7,9 @@ from app.services.role_service import (
     remove_role_from_user,
     create_role,
     update_role,
-    delete_role
+    delete_role,
+    get_permission_catalog,
+    get_permission_claims
 )
 from app.models.role import Role, Permission, RolePermission
 from app.models.service import Service
@@ -270,3 +273,81 @@ def test_delete_default_role(db_session, test_service):
     # Check database - role should still exist
     role = Role.query.get(role.id)
     assert role is not None
+
+
+def _grant(db_session, role, *names):
+    """Attach permissions (created as needed) to a role."""
+    for name in names:
+        perm = Permission.query.filter_by(name=name).first()
+        if not perm:
+            perm = Permission(name=name)
+            db_session.add(perm)
+            db_session.flush()
+        role.add_permission(perm)
+    db_session.commit()
+
+
+def test_get_permission_catalog(db_session):
+    """Test that the catalog lists permissions in id order with a content version."""
+    db_session.add_all([Permission(name='b:read'), Permission(name='a:read')])
+    db_session.commit()
+    
+    catalog = get_permission_catalog()
+    assert catalog['permissions'][-2:] == ['b:read', 'a:read']
+    
+    db_session.add(Permission(name='c:read'))
+    db_session.commit()
+    
+    assert get_permission_catalog()['version'] != catalog['version']
+
+
+def test_get_permission_claims(db_session, mock_redis, test_user, test_service, test_role):
+    """Test that permission claims hold one bitmask per service."""
+    _grant(db_session, test_role, 'doc:read', 'doc:write', 'doc:delete')
+    RolePermission.query.filter_by(
+        permission_id=Permission.query.filter_by(name='doc:write').first().id
+    ).delete()
+    db_session.commit()
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    
+    claims = get_permission_claims(test_user)
+    
+    bits = {name: index for index, name in enumerate(get_permission_catalog()['permissions'])}
+    expected = (1 << bits['doc:read']) | (1 << bits['doc:delete'])
+    assert claims['perms'] == {test_service.public_id: format(expected, 'x')}
+    assert claims['perm_catalog'] == get_permission_catalog()['version']
+    assert claims['perm_ver'] == 0
+
+
+def test_role_changes_bump_permission_version(app, db_session, mock_redis, test_user, test_service, test_role):
+    """Test that grant changes advance the permissions version of affected users."""
+    app.config['JWT_PERMISSION_CLAIMS'] = True
+    pubsub = mock_redis.pubsub()
+    pubsub.subscribe('permission_versions')
+    pubsub.get_message()
+    
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    assert get_permission_claims(test_user)['perm_ver'] == 1
+    
+    perm = Permission(name='doc:read')
+    db_session.add(perm)
+    db_session.commit()
+    update_role(test_role.id, permissions=[perm.id])
+    assert get_permission_claims(test_user)['perm_ver'] == 2
+    
+    # Renaming a role changes nobody's grants
+    update_role(test_role.id, name='renamed')
+    assert get_permission_claims(test_user)['perm_ver'] == 2
+    
+    delete_role(test_role.id)
+    assert get_permission_claims(test_user)['perm_ver'] == 3
+    
+    message = pubsub.get_message()
+    assert json.loads(message['data']) == {'user_id': test_user.public_id, 'perm_ver': 1}
+
+
+def test_permission_version_unchanged_when_claims_disabled(db_session, mock_redis, test_user, test_service, test_role):
+    """Test that versions are not tracked while permission claims are off."""
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    
+    assert mock_redis.get(f'perm_version:{test_user.id}') is None
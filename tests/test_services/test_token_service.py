@@ -9,6 +9,7 @@ from app.services.token_service import (
     delete_token
 )
 from app.models.app_token import AppToken
+from app.utils.last_used_buffer import last_used_buffer
 
 
 def test_create_app_token(db_session, test_service):
@@ -83,7 +84,9 @@ def test_validate_app_token(db_session, test_app_token):
     assert service is not None
     assert service.id == test_app_token.service_id
     
-    # Check that last_used was updated
+    # Check that last_used was updated once the buffer is flushed
+    assert last_used_buffer.flush() == 1
+    db_session.expire_all()
     updated_token = AppToken.query.get(test_app_token.id)
     assert updated_token.last_used is not None
 
@@ -0,0 +1,163 @@
+import pytest
+import json
+from datetime import datetime, timedelta
+from freezegun import freeze_time
+from app.models.app_token import AppToken
+from app import db
+from app.services import token_service
+from app.services.token_service import validate_app_token, revoke_token, delete_token
+from app.services.service_service import update_service
+from app.utils.app_token_cache import app_token_cache, MISSING
+from app.utils.cache import cache, CACHE_CHANNEL
+
+
+def test_validate_app_token_cache_hit_runs_no_queries(db_session, test_app_token, query_counter):
+    """Test that a cached token is validated without touching the database."""
+    token_value = test_app_token.token
+    service_id = test_app_token.service_id
+    assert validate_app_token(token_value) is not None
+    
+    del query_counter[:]
+    service = validate_app_token(token_value)
+    
+    assert service.id == service_id
+    assert service.to_dict()['name'] == 'test_service'
+    assert query_counter == []
+
+
+def test_validate_app_token_negative_cache(db_session, query_counter):
+    """Test that unknown tokens are rejected from the negative cache."""
+    assert validate_app_token('unknown-token') is None
+    assert app_token_cache.get('unknown-token') is MISSING
+    
+    del query_counter[:]
+    assert validate_app_token('unknown-token') is None
+    assert query_counter == []
+
+
+def test_negative_cache_expires(db_session, test_service):
+    """Test that negative entries only live for the negative TTL."""
+    with freeze_time("2023-01-01 12:00:00"):
+        assert validate_app_token('later-token') is None
+        
+        token = AppToken(name='Late Token', service_id=test_service.id, token='later-token')
+        db_session.add(token)
+        db_session.commit()
+        assert validate_app_token('later-token') is None
+    
+    with freeze_time("2023-01-01 12:01:00"):
+        assert validate_app_token('later-token') is not None
+
+
+def test_cached_token_expiry_honored_locally(db_session, test_service):
+    """Test that a cached token stops validating when it expires."""
+    with freeze_time("2023-01-01 12:00:00"):
+        token = AppToken(
+            name='Expiring Token',
+            service_id=test_service.id,
+            expires_at=datetime.utcnow() + timedelta(seconds=30)
+        )
+        db_session.add(token)
+        db_session.commit()
+        assert validate_app_token(token.token) is not None
+    
+    with freeze_time("2023-01-01 12:00:45"):
+        assert app_token_cache.get(token.token) is not None
+        assert validate_app_token(token.token) is None
+
+
+def test_revoke_token_invalidates_cache(db_session, test_app_token, mock_redis):
+    """Test that revoking a token drops its cache entry."""
+    token_value = test_app_token.token
+    assert validate_app_token(token_value) is not None
+    
+    revoke_token(test_app_token.id)
+    
+    assert app_token_cache.get(token_value) is None
+    assert validate_app_token(token_value) is None
+
+
+def test_revoke_during_lookup_not_cached(db_session, test_app_token, mock_redis, monkeypatch):
+    """Test that a lookup which read the token before a revoke committed does not cache it as active."""
+    token_value, token_id = test_app_token.token, test_app_token.id
+    load = token_service._load_app_token
+    
+    def load_then_revoke(value):
+        # Another request revokes the token after this one has read it
+        token = load(value)
+        db.session.expunge(token.service)
+        db.session.expunge(token)
+        revoke_token(token_id)
+        return token
+    
+    monkeypatch.setattr(token_service, '_load_app_token', load_then_revoke)
+    assert validate_app_token(token_value) is not None
+    monkeypatch.undo()
+    
+    assert validate_app_token(token_value) is None
+
+
+def test_delete_token_invalidates_cache(db_session, test_app_token, mock_redis):
+    """Test that deleting a token drops its cache entry."""
+    token_value = test_app_token.token
+    assert validate_app_token(token_value) is not None
+    
+    delete_token(test_app_token.id)
+    
+    assert validate_app_token(token_value) is None
+
+
+def test_update_service_refreshes_snapshot(db_session, test_app_token, test_service, mock_redis):
+    """Test that service updates are reflected in cached tokens."""
+    assert validate_app_token(test_app_token.token).name == 'test_service'
+    
+    update_service(test_service.public_id, name='renamed_service')
+    
+    assert validate_app_token(test_app_token.token).name == 'renamed_service'
+
+
+def test_invalidation_is_broadcast(db_session, test_app_token, mock_redis):
+    """Test that invalidations are published for other workers."""
+    pubsub = mock_redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CACHE_CHANNEL)
+    
+    revoke_token(test_app_token.id)
+    
+    # The first read may only consume the subscribe confirmation
+    message = pubsub.get_message(timeout=1) or pubsub.get_message(timeout=1)
+    assert message is not None
+    assert json.loads(message['data']) == {'namespace': 'app_tokens', 'version': 1}
+
+
+def test_remote_invalidation_evicts_entry(db_session, test_app_token, mock_redis):
+    """Test that an invalidation received from another worker evicts locally."""
+    key = app_token_cache._key(test_app_token.token)
+    assert validate_app_token(test_app_token.token) is not None
+    
+    # The worker that dropped the token deleted the Redis entry before broadcasting
+    mock_redis.delete(f'cache:app_tokens:{key}')
+    cache._handle_invalidation({'namespace': 'app_tokens', 'key': key})
+    
+    assert app_token_cache.get(test_app_token.token) is None
+
+
+def test_raw_token_not_stored_in_redis(db_session, test_app_token, mock_redis):
+    """Test that Redis only ever sees a digest of the token value."""
+    assert validate_app_token(test_app_token.token) is not None
+    
+    assert mock_redis.keys(f'*{test_app_token.token}*') == []
+    assert mock_redis.exists(f'cache:app_tokens:{app_token_cache._key(test_app_token.token)}')
+
+
+def test_token_served_from_redis_in_another_worker(db_session, test_app_token, mock_redis, query_counter):
+    """Test that a token cached by one worker validates in another without a query."""
+    assert validate_app_token(test_app_token.token) is not None
+    
+    # A fresh worker: empty L1, shared Redis
+    cache.clear()
+    del query_counter[:]
+    service = validate_app_token(test_app_token.token)
+    
+    assert service.name == 'test_service'
+    assert service.to_dict()['created_at'] is not None
+    assert query_counter == []
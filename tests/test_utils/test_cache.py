@@ -0,0 +1,188 @@
+import threading
+import pytest
+from freezegun import freeze_time
+from unittest.mock import MagicMock
+from app.models.role import Permission
+from app.services.role_service import get_all_permissions
+from app.services.service_service import get_service_id_by_name, update_service
+from app.utils.cache import TwoTierCache, MISS, cache, cached
+
+
+@pytest.fixture
+def workers(app, mock_redis):
+    """Two caches sharing one Redis, standing in for two worker processes."""
+    first, second = TwoTierCache(), TwoTierCache()
+    first.init_app(app)
+    second.init_app(app)
+    return first, second
+
+
+def test_l1_hit_after_set(workers):
+    """Test that a stored value is served from the worker's own memory."""
+    first, _ = workers
+    first.set('things', 'a', {'value': 1})
+    
+    assert first.get('things', 'a') == {'value': 1}
+    assert first.stats()['things'] == {'l1_hits': 1, 'l2_hits': 0, 'misses': 0}
+
+
+def test_l2_shared_between_workers(workers, mock_redis):
+    """Test that one worker's entry is found in Redis by another, then kept in its L1."""
+    first, second = workers
+    first.set('things', 'a', [1, 2])
+    
+    assert second.get('things', 'a') == [1, 2]
+    
+    mock_redis.mget = MagicMock(side_effect=AssertionError('Redis was consulted'))
+    assert second.get('things', 'a') == [1, 2]
+    assert second.stats()['things'] == {'l1_hits': 1, 'l2_hits': 1, 'misses': 0}
+
+
+def test_none_is_cached(workers):
+    """Test that a cached None is a hit, not a miss."""
+    first, second = workers
+    first.set('things', 'missing', None)
+    
+    assert second.get('things', 'missing') is None
+    assert second.get('things', 'other') is MISS
+
+
+def test_ttl_chosen_by_loaded_value(workers, mock_redis):
+    """Test that a ttl function sets each entry's lifetime in both tiers from its value."""
+    first, _ = workers
+    ttl = lambda value: 5 if value is None else 60
+    
+    with freeze_time("2023-01-01 12:00:00") as frozen:
+        first.get_or_load('things', 'missing', lambda: None, ttl=ttl)
+        first.get_or_load('things', 'found', lambda: 'yes', ttl=ttl)
+        
+        assert mock_redis.ttl('cache:things:missing') == 5
+        assert mock_redis.ttl('cache:things:found') == 60
+        
+        frozen.tick(10)
+        assert first._get_l1('things', 'missing') is MISS
+        assert first._get_l1('things', 'found') == 'yes'
+
+
+def test_namespace_invalidation(workers):
+    """Test that bumping a namespace version hides every entry of it in both tiers."""
+    first, second = workers
+    first.set('things', 'a', 1)
+    first.set('others', 'a', 2)
+    assert second.get('things', 'a') == 1
+    
+    first.invalidate_namespace('things')
+    assert first.get('things', 'a') is MISS
+    assert first.get('others', 'a') == 2
+    
+    # The other worker drops its L1 copy when the broadcast arrives
+    second._handle_invalidation({'namespace': 'things', 'version': 1})
+    assert second.get('things', 'a') is MISS
+    
+    # New entries are stored under the new version
+    second.set('things', 'a', 3)
+    assert first.get('things', 'a') == 3
+
+
+def test_delete_entry(workers):
+    """Test that deleting an entry removes it from Redis and, by broadcast, other workers."""
+    first, second = workers
+    first.set('things', 'a', 1)
+    assert second.get('things', 'a') == 1
+    
+    first.delete('things', 'a')
+    second._handle_invalidation({'namespace': 'things', 'key': 'a'})
+    
+    assert first.get('things', 'a') is MISS
+    assert second.get('things', 'a') is MISS
+
+
+def test_l1_only_without_redis(app):
+    """Test that the cache keeps working per worker when L2 is disabled."""
+    app.config['CACHE_L2_TTL'] = 0
+    local = TwoTierCache()
+    local.init_app(app)
+    
+    local.set('things', 'a', 1)
+    assert local.get('things', 'a') == 1
+    
+    local.invalidate_namespace('things')
+    assert local.get('things', 'a') is MISS
+
+
+def test_cached_decorator(app, mock_redis):
+    """Test that the decorator loads once per key and can drop an entry."""
+    calls = []
+    
+    @cached('squares')
+    def square(n):
+        calls.append(n)
+        return n * n
+    
+    assert square(3) == 9
+    assert square(3) == 9
+    assert square(4) == 16
+    assert calls == [3, 4]
+    
+    square.invalidate(3)
+    assert square(3) == 9
+    assert calls == [3, 4, 3]
+
+
+def test_committed_model_changes_invalidate(db_session, mock_redis):
+    """Test that committing permission or service rows invalidates their cached lookups."""
+    names = {perm['name'] for perm in get_all_permissions()}
+    db_session.add(Permission(name='report:read'))
+    db_session.commit()
+    
+    assert {perm['name'] for perm in get_all_permissions()} == names | {'report:read'}
+    
+    service_id = get_service_id_by_name('auth_service')
+    update_service(str(service_id), name='identity')
+    
+    assert get_service_id_by_name('auth_service') is None
+    assert get_service_id_by_name('identity') == service_id
+    assert cache.stats()['services']['misses'] == 3
+
+
+
+def test_fill_lock_waits_for_other_worker(app, workers, mock_redis):
+    """Test that a worker finding the fill lock taken picks up the other worker's result."""
+    first, second = workers
+    first.fill_lock_ms = 2000
+    mock_redis.set('cache_lock:things:a', 'other-worker', px=2000)
+    
+    filler = threading.Timer(0.05, lambda: second.set('things', 'a', 'filled'))
+    filler.start()
+    value = first.get_or_load('things', 'a', lambda: pytest.fail('loaded despite the lock'))
+    filler.join()
+    
+    assert value == 'filled'
+
+
+def test_fill_lock_released_after_load(workers, mock_redis):
+    """Test that the worker holding the fill lock loads, stores and releases it."""
+    first, _ = workers
+    first.fill_lock_ms = 2000
+    
+    assert first.get_or_load('things', 'a', lambda: 'loaded') == 'loaded'
+    assert not mock_redis.exists('cache_lock:things:a')
+    assert mock_redis.exists('cache:things:a')
+
+
+def test_invalidation_during_load_discards_result(workers):
+    """Test that a result loaded across an invalidation is not served under the new version."""
+    first, second = workers
+    assert first.get('things', 'a') is MISS
+    
+    def stale_loader():
+        # Another worker commits a change and invalidates while we are still
+        # loading, and the broadcast reaches us before the load finishes
+        second.invalidate_namespace('things')
+        first._handle_invalidation({'namespace': 'things', 'version': 1})
+        return 'stale'
+    
+    assert first.get_or_load('things', 'a', stale_loader) == 'stale'
+    
+    assert first.get('things', 'a') is MISS
+    assert second.get('things', 'a') is MISS
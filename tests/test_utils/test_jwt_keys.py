@@ -0,0 +1,93 @@
+import jwt as pyjwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from flask_jwt_extended import create_access_token, decode_token
+
+from app.utils.jwt_keys import jwt_keys
+
+
+def test_tokens_signed_with_active_kid(app, signing_keys):
+    """Test that new tokens carry the active kid and verify with its public key."""
+    token = create_access_token(identity='user-1')
+    
+    header = pyjwt.get_unverified_header(token)
+    assert header['kid'] == '2026-10'
+    assert header['alg'] == 'EdDSA'
+    
+    # A downstream service only needs the published public key
+    public_key = jwt_keys.keys['2026-10'].public_key
+    claims = pyjwt.decode(token, public_key, algorithms=['EdDSA'])
+    assert claims['sub'] == 'user-1'
+
+
+def test_active_kid_setting(app, signing_keys):
+    """Test that JWT_ACTIVE_KID picks the signing key."""
+    app.config['JWT_ACTIVE_KID'] = '2026-01'
+    jwt_keys.init_app(app)
+    
+    token = create_access_token(identity='user-1')
+    assert pyjwt.get_unverified_header(token)['kid'] == '2026-01'
+    assert pyjwt.get_unverified_header(token)['alg'] == 'RS256'
+    assert decode_token(token)['sub'] == 'user-1'
+
+
+def test_retired_key_still_verifies(app, signing_keys, write_signing_key):
+    """Test that tokens signed before a rotation verify against the retired public key."""
+    token = create_access_token(identity='user-1')
+    
+    # Rotate: keep only the public half of the old signer and add a new one
+    (signing_keys / '2026-10.pem').unlink()
+    old_key = jwt_keys.keys['2026-10'].public_key
+    (signing_keys / '2026-10.pub.pem').write_bytes(old_key.public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ))
+    write_signing_key(signing_keys, '2027-01', 'ed25519')
+    jwt_keys.init_app(app)
+    
+    assert jwt_keys.active.kid == '2027-01'
+    assert jwt_keys.keys['2026-10'].private_key is None
+    assert decode_token(token)['sub'] == 'user-1'
+
+
+def test_unknown_kid_rejected(app, signing_keys, write_signing_key, tmp_path_factory):
+    """Test that tokens signed with a key we do not publish are rejected."""
+    other_dir = tmp_path_factory.mktemp('other')
+    private_key = write_signing_key(other_dir, 'stranger', 'ed25519')
+    token = pyjwt.encode({'sub': 'user-1'}, private_key, algorithm='EdDSA', headers={'kid': 'stranger'})
+    
+    with pytest.raises(pyjwt.InvalidTokenError):
+        decode_token(token)
+
+
+def test_symmetric_token_rejected_with_keys(app, signing_keys):
+    """Test that HS256 tokens made with the shared secret stop working once keys are configured."""
+    token = pyjwt.encode(
+        {'sub': 'user-1', 'type': 'access', 'jti': 'x'},
+        app.config['JWT_SECRET_KEY'],
+        algorithm='HS256',
+        headers={'kid': '2026-10'}
+    )
+    
+    with pytest.raises(pyjwt.InvalidTokenError):
+        decode_token(token)
+
+
+def test_active_kid_without_private_key(app, signing_keys, write_signing_key):
+    """Test that a retired kid cannot be made the signer."""
+    (signing_keys / '2026-01.pem').unlink()
+    write_signing_key(signing_keys, '2026-01', 'rsa', public_only=True)
+    app.config['JWT_ACTIVE_KID'] = '2026-01'
+    
+    with pytest.raises(ValueError):
+        jwt_keys.init_app(app)
+
+
+def test_no_keys_keeps_hs256(app):
+    """Test that tokens stay HS256 without a key directory."""
+    token = create_access_token(identity='user-1')
+    
+    header = pyjwt.get_unverified_header(token)
+    assert header['alg'] == 'HS256'
+    assert 'kid' not in header
+    assert jwt_keys.jwks_json == '{"keys":[]}'
+
@@ -0,0 +1,64 @@
+import pytest
+from datetime import datetime
+from app.models.app_token import AppToken
+from app.utils.last_used_buffer import last_used_buffer
+
+
+@pytest.fixture
+def tokens(db_session, test_service):
+    """Create a handful of app tokens."""
+    tokens = [AppToken(name=f'Token {i}', service_id=test_service.id) for i in range(3)]
+    db_session.add_all(tokens)
+    db_session.commit()
+    return tokens
+
+
+def test_record_coalesces_per_token(app, db_session, tokens):
+    """Test that repeated uses of a token keep only the newest timestamp."""
+    token = tokens[0]
+    last_used_buffer.record(token.id, datetime(2023, 1, 1, 12, 0, 0))
+    last_used_buffer.record(token.id, datetime(2023, 1, 1, 13, 0, 0))
+    last_used_buffer.record(token.id, datetime(2023, 1, 1, 12, 30, 0))
+    
+    assert len(last_used_buffer) == 1
+    assert last_used_buffer.flush() == 1
+    
+    db_session.expire_all()
+    saved = AppToken.query.get(token.id)
+    assert saved.last_used == datetime(2023, 1, 1, 13, 0, 0)
+
+
+def test_flush_uses_one_statement(app, db_session, tokens, query_counter):
+    """Test that all pending tokens are written in one bulk UPDATE."""
+    for token in tokens:
+        last_used_buffer.record(token.id, datetime(2023, 1, 1, 12, 0, 0))
+    
+    del query_counter[:]
+    assert last_used_buffer.flush() == 3
+    
+    updates = [s for s in query_counter if s.lstrip().upper().startswith('UPDATE')]
+    assert len(updates) == 1
+    
+    db_session.expire_all()
+    for token in tokens:
+        assert AppToken.query.get(token.id).last_used == datetime(2023, 1, 1, 12, 0, 0)
+
+
+def test_flush_on_size_threshold(app, db_session, tokens, monkeypatch):
+    """Test that reaching the size threshold flushes the buffer."""
+    monkeypatch.setattr(last_used_buffer, 'max_size', 2)
+    
+    last_used_buffer.record(tokens[0].id)
+    assert len(last_used_buffer) == 1
+    
+    last_used_buffer.record(tokens[1].id)
+    assert len(last_used_buffer) == 0
+    
+    db_session.expire_all()
+    assert AppToken.query.get(tokens[0].id).last_used is not None
+    assert AppToken.query.get(tokens[1].id).last_used is not None
+
+
+def test_flush_empty(app):
+    """Test flushing with nothing buffered."""
+    assert last_used_buffer.flush() == 0
@@ -0,0 +1,105 @@
+import json
+import pytest
+from freezegun import freeze_time
+from authlib.integrations.flask_client import OAuth
+from app.utils.oauth_metadata import OAuthMetadataCache
+
+
+@pytest.fixture
+def metadata_cache(app, tmp_path):
+    """A metadata cache writing to a temporary directory."""
+    app.config['OAUTH_METADATA_CACHE_DIR'] = str(tmp_path)
+    cache = OAuthMetadataCache()
+    cache.init_app(app)
+    return cache
+
+
+def _client(app, name, oauth_provider):
+    return OAuth(app).register(
+        name=name,
+        client_id='client-id',
+        client_secret='client-secret',
+        server_metadata_url=oauth_provider.discovery_url
+    )
+
+
+def test_register_prefetches_metadata_and_jwks(app, mock_redis, metadata_cache, oauth_provider):
+    """Test that callbacks find discovery data and keys without any further fetch."""
+    client = _client(app, 'google', oauth_provider)
+    
+    metadata_cache.register('google', oauth_provider.discovery_url, client)
+    assert len(oauth_provider.requests) == 2
+    
+    assert client.load_server_metadata()['token_endpoint'] == oauth_provider.metadata['token_endpoint']
+    assert client.fetch_jwk_set() == oauth_provider.jwks
+    assert len(oauth_provider.requests) == 2
+
+
+def test_other_workers_load_from_redis(app, mock_redis, metadata_cache, oauth_provider, tmp_path):
+    """Test that a worker starting after another has fetched makes no requests."""
+    metadata_cache.register('google', oauth_provider.discovery_url, _client(app, 'google', oauth_provider))
+    del oauth_provider.requests[:]
+    (tmp_path / 'google.json').unlink()
+    
+    client = _client(app, 'google', oauth_provider)
+    other_worker = OAuthMetadataCache()
+    other_worker.init_app(app)
+    other_worker.register('google', oauth_provider.discovery_url, client)
+    
+    assert oauth_provider.requests == []
+    assert client.fetch_jwk_set() == oauth_provider.jwks
+
+
+def test_disk_copy_used_when_redis_is_empty(app, mock_redis, metadata_cache, oauth_provider):
+    """Test that the on-disk copy covers a flushed Redis and an unreachable provider."""
+    metadata_cache.register('google', oauth_provider.discovery_url, _client(app, 'google', oauth_provider))
+    mock_redis.flushall()
+    oauth_provider.failing = True
+    
+    client = _client(app, 'google', oauth_provider)
+    metadata_cache.register('google', oauth_provider.discovery_url, client)
+    
+    assert client.load_server_metadata()['issuer'] == oauth_provider.metadata['issuer']
+    assert oauth_provider.requests == ['/.well-known/openid-configuration', '/jwks']
+
+
+def test_refresh_due_refetches_stale_metadata(app, mock_redis, metadata_cache, oauth_provider):
+    """Test that the background refresh replaces metadata older than the interval."""
+    client = _client(app, 'google', oauth_provider)
+    with freeze_time("2023-01-01 12:00:00"):
+        metadata_cache.register('google', oauth_provider.discovery_url, client)
+    
+    oauth_provider.jwks = {'keys': [{'kty': 'RSA', 'kid': 'key-2', 'n': 'AQAB', 'e': 'AQAB'}]}
+    
+    with freeze_time("2023-01-01 12:30:00"):
+        metadata_cache.refresh_due()
+        assert client.fetch_jwk_set()['keys'][0]['kid'] == 'key-1'
+    
+    with freeze_time("2023-01-01 13:00:01"):
+        metadata_cache.refresh_due()
+        assert client.fetch_jwk_set()['keys'][0]['kid'] == 'key-2'
+        assert json.loads(mock_redis.get('oauth_metadata:google'))['jwks'] == oauth_provider.jwks
+
+
+def test_failed_refresh_keeps_cached_metadata(app, mock_redis, metadata_cache, oauth_provider):
+    """Test that a provider outage does not drop the metadata we already have."""
+    client = _client(app, 'google', oauth_provider)
+    with freeze_time("2023-01-01 12:00:00"):
+        metadata_cache.register('google', oauth_provider.discovery_url, client)
+    oauth_provider.failing = True
+    
+    with freeze_time("2023-01-01 14:00:00"):
+        metadata_cache.refresh_due()
+    
+    assert client.fetch_jwk_set() == oauth_provider.jwks
+
+
+def test_refresh_skipped_while_another_worker_fetches(app, mock_redis, metadata_cache, oauth_provider):
+    """Test that only the worker holding the lock fetches from the provider."""
+    metadata_cache.register('google', oauth_provider.discovery_url, _client(app, 'google', oauth_provider))
+    del oauth_provider.requests[:]
+    mock_redis.set('oauth_metadata:google:lock', 1)
+    
+    metadata_cache.refresh('google')
+    
+    assert oauth_provider.requests == []
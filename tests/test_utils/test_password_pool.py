@@ -0,0 +1,112 @@
+import pytest
+from flask_bcrypt import Bcrypt
+from app.utils.password_pool import (
+    PasswordPool,
+    PasswordPoolBusy,
+    password_pool,
+    hash_password,
+    get_hash_rounds,
+    calibrate_rounds,
+    ROUNDS_KEY,
+    ROUNDS_TTL
+)
+
+
+def test_hash_compatible_with_flask_bcrypt(app):
+    """Test that pool hashes and Flask-Bcrypt hashes verify against each other."""
+    flask_bcrypt = Bcrypt(app)
+    
+    pw_hash = password_pool.hash('secret')
+    assert flask_bcrypt.check_password_hash(pw_hash, 'secret') is True
+    
+    legacy_hash = flask_bcrypt.generate_password_hash('secret', 12).decode('utf-8')
+    assert password_pool.verify(legacy_hash, 'secret') is True
+    assert password_pool.verify(legacy_hash, 'wrong') is False
+
+
+def test_hash_rejects_empty_password(app):
+    """Test that empty passwords are refused like Flask-Bcrypt does."""
+    with pytest.raises(ValueError):
+        password_pool.hash('')
+
+
+def test_busy_when_queue_full():
+    """Test that operations beyond max_pending are rejected immediately."""
+    pool = PasswordPool(workers=0, max_pending=1)
+    pool.rounds = 4
+    
+    pool._slots.acquire()
+    try:
+        with pytest.raises(PasswordPoolBusy):
+            pool.hash('secret')
+    finally:
+        pool._slots.release()
+    
+    assert pool.verify(pool.hash('secret'), 'secret') is True
+
+
+def test_runs_in_child_processes():
+    """Test hashing and verification through the process pool."""
+    pool = PasswordPool(workers=1, max_pending=2, timeout=30)
+    pool.rounds = 4
+    try:
+        pw_hash = pool.hash('secret')
+        
+        assert pw_hash.startswith('$2b$04$')
+        assert pool.verify(pw_hash, 'secret') is True
+        assert pool.verify(pw_hash, 'wrong') is False
+    finally:
+        pool.shutdown()
+
+
+def test_get_hash_rounds():
+    """Test reading the prefix and cost stored in a hash."""
+    pw_hash = PasswordPool(workers=0).hash('secret')
+    
+    assert get_hash_rounds(pw_hash) == ('2b', 12)
+    assert get_hash_rounds('not-a-hash') is None
+    assert get_hash_rounds(None) is None
+
+
+def test_calibrate_rounds_within_bounds():
+    """Test that calibration stays between the configured bounds."""
+    assert calibrate_rounds(0, min_rounds=4, max_rounds=8) == 4
+    assert calibrate_rounds(10 ** 9, min_rounds=4, max_rounds=8) == 8
+
+
+def test_calibration_follows_target(app, mock_redis, monkeypatch):
+    """Test that a changed BCRYPT_TARGET_MS is calibrated anew rather than reusing the stored cost."""
+    monkeypatch.setattr(
+        'app.utils.password_pool.calibrate_rounds',
+        lambda target_ms, min_rounds, max_rounds: 10 if target_ms < 200 else 13
+    )
+    pool = PasswordPool(workers=0)
+    pool.init_app(app)
+    
+    pool.target_ms = 100
+    assert pool.calibrate() == 10
+    
+    pool.target_ms = 400
+    assert pool.calibrate() == 13
+    
+    keys = mock_redis.keys(f'{ROUNDS_KEY}:*')
+    assert len(keys) == 2
+    assert all(0 < mock_redis.ttl(key) <= ROUNDS_TTL for key in keys)
+
+
+def test_calibration_shared_between_workers(app, mock_redis, monkeypatch):
+    """Test that a worker booting later reuses the cost stored for the same settings."""
+    pool = PasswordPool(workers=0)
+    pool.init_app(app)
+    pool.target_ms = 100
+    monkeypatch.setattr('app.utils.password_pool.calibrate_rounds', lambda *args: 11)
+    assert pool.calibrate() == 11
+    
+    monkeypatch.setattr('app.utils.password_pool.calibrate_rounds', lambda *args: 14)
+    assert pool.calibrate() == 11
+
+
+def test_needs_rehash(app):
+    """Test flagging hashes made with another cost."""
+    assert password_pool.needs_rehash(hash_password('secret', 4, '2b', False)) is True
+    assert password_pool.needs_rehash(password_pool.hash('secret')) is False
@@ -0,0 +1,122 @@
+from app.models.role import Role, Permission, RolePermission
+from app.models.user_service_role import UserServiceRole
+from app.services.role_service import get_permission_catalog
+from app.utils.permission_bits import (
+    encode_mask,
+    decode_mask,
+    permission_bit,
+    names_for_mask,
+    get_role_mask,
+    get_user_mask
+)
+
+
+def _permissions(db_session, *names):
+    perms = [Permission(name=name) for name in names]
+    db_session.add_all(perms)
+    db_session.commit()
+    return perms
+
+
+def test_bit_indexes_follow_insert_order(db_session):
+    """Test that new permissions take the next free bits in the order they were added."""
+    first = _permissions(db_session, 'b:read', 'a:read')
+    assert first[1].bit_index == first[0].bit_index + 1
+    
+    db_session.delete(first[0])
+    db_session.commit()
+    
+    later = _permissions(db_session, 'c:read')
+    assert later[0].bit_index == first[1].bit_index + 1
+    assert Permission.query.filter_by(name='a:read').first().bit_index == first[1].bit_index
+
+
+def test_highest_freed_bit_not_reused(db_session):
+    """Test that deleting the permission with the highest bit does not hand that bit out again."""
+    read, write = _permissions(db_session, 'doc:read', 'doc:write')
+    freed = write.bit_index
+    db_session.delete(write)
+    db_session.commit()
+    
+    replacement, = _permissions(db_session, 'doc:delete')
+    
+    assert replacement.bit_index == freed + 1
+    assert get_permission_catalog()['permissions'][freed] is None
+
+
+def test_catalog_leaves_freed_bits_empty(db_session):
+    """Test that a deleted permission leaves a gap rather than shifting later bits."""
+    read, write = _permissions(db_session, 'doc:read', 'doc:write')
+    db_session.delete(read)
+    db_session.commit()
+    
+    names = get_permission_catalog()['permissions']
+    assert names[read.bit_index] is None
+    assert names[write.bit_index] == 'doc:write'
+
+
+def test_mask_encoding_round_trip():
+    """Test that masks survive their compact text form."""
+    mask = (1 << 70) | (1 << 3) | 1
+    
+    assert encode_mask(mask) == format(mask, 'x')
+    assert decode_mask(encode_mask(mask)) == mask
+    assert decode_mask(encode_mask(0)) == 0
+    assert decode_mask('') == 0
+
+
+def test_role_mask_cached_until_commit(db_session, test_role, query_counter):
+    """Test that a role's mask is built once and rebuilt after its permissions change."""
+    read, write = _permissions(db_session, 'doc:read', 'doc:write')
+    test_role.add_permission(read)
+    db_session.commit()
+    
+    assert test_role.has_permission('doc:read') is True
+    del query_counter[:]
+    assert test_role.has_permission('doc:read') is True
+    assert test_role.has_permission('doc:write') is False
+    assert test_role.has_permission('doc:missing') is False
+    assert query_counter == []
+    
+    test_role.add_permission(write)
+    db_session.commit()
+    
+    assert get_role_mask(test_role.id) == permission_bit('doc:read') | permission_bit('doc:write')
+
+
+def test_user_mask_is_union_of_roles(db_session, test_user, test_service, test_role):
+    """Test that a user's mask in a service ORs the masks of their roles there."""
+    read, write, admin = _permissions(db_session, 'doc:read', 'doc:write', 'doc:admin')
+    editor = Role(name='editor', service_id=test_service.id)
+    db_session.add(editor)
+    db_session.flush()
+    db_session.add_all([
+        RolePermission(role_id=test_role.id, permission_id=read.id),
+        RolePermission(role_id=editor.id, permission_id=read.id),
+        RolePermission(role_id=editor.id, permission_id=write.id),
+        UserServiceRole(user_id=test_user.id, service_id=test_service.id, role_id=test_role.id),
+        UserServiceRole(user_id=test_user.id, service_id=test_service.id, role_id=editor.id)
+    ])
+    db_session.commit()
+    
+    mask = get_user_mask(test_user.id, test_service.id)
+    
+    assert mask == permission_bit('doc:read') | permission_bit('doc:write')
+    assert names_for_mask(mask) == frozenset({'doc:read', 'doc:write'})
+    assert test_user.has_permission('doc:write', test_service.id) is True
+    assert test_user.has_permission('doc:admin', test_service.id) is False
+    assert get_user_mask(test_user.id, test_service.id + 1) == 0
+
+
+def test_user_mask_single_query(db_session, test_user, test_service, test_role, query_counter):
+    """Test that a user's mask is read from their materialized grants in one query."""
+    read, = _permissions(db_session, 'doc:read')
+    test_role.add_permission(read)
+    db_session.add(UserServiceRole(user_id=test_user.id, service_id=test_service.id, role_id=test_role.id))
+    db_session.commit()
+    user_id, service_id, bit = test_user.id, test_service.id, permission_bit('doc:read')
+    
+    del query_counter[:]
+    assert get_user_mask(user_id, service_id) == bit
+    assert len(query_counter) == 1
+    assert 'user_effective_permissions' in query_counter[0]
@@ -0,0 +1,118 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+from app.models.role import Permission
+from app.models.user_service_role import UserServiceRole
+from app.services.role_service import assign_role_to_user, update_role
+from app.utils.cache import cache
+from app.utils.permission_cache import (
+    permission_cache,
+    get_user_permission_mask,
+    get_user_permissions
+)
+
+
+@pytest.fixture
+def granted_user(db_session, test_user, test_service, test_role):
+    """Test user holding test_role with a single permission."""
+    perm = Permission(name='test:read', description='Test read permission')
+    db_session.add(perm)
+    db_session.commit()
+    
+    test_role.add_permission(perm)
+    db_session.add(UserServiceRole(user_id=test_user.id, service_id=test_service.id, role_id=test_role.id))
+    db_session.commit()
+    return test_user
+
+
+def test_invalidate_by_service(app):
+    """Test invalidating every mask of a service, or a single user's."""
+    permission_cache.get_or_load(1, 1, lambda: 0b001)
+    permission_cache.get_or_load(2, 1, lambda: 0b010)
+    permission_cache.get_or_load(1, 2, lambda: 0b100)
+    
+    permission_cache.invalidate(1)
+    
+    assert permission_cache.get(1, 1) is None
+    assert permission_cache.get(2, 1) is None
+    assert permission_cache.get(1, 2) == 0b100
+    
+    permission_cache.invalidate(2, user_id=1)
+    assert permission_cache.get(1, 2) is None
+
+
+def test_mask_shared_between_workers(granted_user, test_service, mock_redis, query_counter):
+    """Test that a mask loaded by one worker is served to another from Redis."""
+    mask = get_user_permission_mask(granted_user, test_service.id)
+    
+    # A fresh worker: empty L1, shared Redis
+    cache.clear()
+    del query_counter[:]
+    
+    assert get_user_permission_mask(granted_user, test_service.id) == mask
+    assert query_counter == []
+
+
+def test_warm_permission_check_runs_no_queries(granted_user, test_service, query_counter):
+    """Test that a cached permission check does not touch the database."""
+    permissions = get_user_permissions(granted_user, test_service.id)
+    assert 'test:read' in permissions
+    assert len(query_counter) > 0
+    
+    del query_counter[:]
+    permissions = get_user_permissions(granted_user, test_service.id)
+    
+    assert 'test:read' in permissions
+    assert query_counter == []
+
+
+def test_assign_role_invalidates_cache(db_session, test_user, test_service, test_role):
+    """Test that assigning a role drops the cached permission set."""
+    perm = Permission(name='test:write', description='Test write permission')
+    db_session.add(perm)
+    db_session.commit()
+    test_role.add_permission(perm)
+    db_session.commit()
+    
+    assert 'test:write' not in get_user_permissions(test_user, test_service.id)
+    
+    assign_role_to_user(test_user.id, test_service.id, test_role.id)
+    
+    assert permission_cache.get(test_user.id, test_service.id) is None
+    assert 'test:write' in get_user_permissions(test_user, test_service.id)
+
+
+def test_update_role_invalidates_cache(granted_user, test_service, test_role):
+    """Test that changing a role's permissions drops cached sets for its service."""
+    assert 'test:read' in get_user_permissions(granted_user, test_service.id)
+    
+    update_role(test_role.id, permissions=[])
+    
+    assert 'test:read' not in get_user_permissions(granted_user, test_service.id)
+
+
+def test_concurrent_misses_query_once(app):
+    """Test that threads missing on the same user and service share one lookup."""
+    release = threading.Event()
+    results = []
+    user = MagicMock(id=42)
+    
+    def slow_lookup(service_id):
+        release.wait(5)
+        return 0b1
+    
+    def check():
+        with app.app_context():
+            results.append(get_user_permission_mask(user, 7))
+    
+    user.get_permission_mask.side_effect = slow_lookup
+    threads = [threading.Thread(target=check) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert results == [0b1] * 5
+    assert user.get_permission_mask.call_count < 5
+    assert permission_cache.get(42, 7) == 0b1
@@ -0,0 +1,86 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+from freezegun import freeze_time
+from app.services.redis_service import revoke_tokens, is_token_revoked, get_revoked_jtis
+from app.utils.revocation_filter import BloomFilter, revocation_filter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test that every added item is reported and few others are."""
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f'jti-{i}')
+    
+    assert all(f'jti-{i}' in bloom for i in range(1000))
+    false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_adds_are_serialized():
+    """Test that an add waits for one in progress on another thread."""
+    bloom = BloomFilter(1000, 0.01)
+    adder = threading.Thread(target=bloom.add, args=('jti-1',))
+    
+    with bloom._lock:
+        adder.start()
+        adder.join(0.05)
+        assert adder.is_alive()
+        assert 'jti-1' not in bloom
+    
+    adder.join()
+    assert 'jti-1' in bloom
+
+
+def test_unrevoked_token_checked_without_redis(app, mock_redis):
+    """Test that a jti missing from the filter is accepted without a Redis lookup."""
+    revoke_tokens(['revoked-jti'])
+    assert revocation_filter.might_be_revoked('revoked-jti')
+    
+    mock_redis.exists = MagicMock(side_effect=AssertionError('Redis was consulted'))
+    
+    assert revocation_filter._check_token({}, {'jti': 'live-jti'}) is False
+
+
+def test_revoked_token_confirmed_in_redis(app, mock_redis):
+    """Test that filter hits are confirmed against Redis."""
+    revoke_tokens(['revoked-jti'], ttl=60)
+    
+    assert revocation_filter._check_token({}, {'jti': 'revoked-jti'}) is True
+    assert 0 < mock_redis.ttl('revoked:revoked-jti') <= 60
+
+
+def test_filter_loads_existing_revocations(app, mock_redis):
+    """Test that a fresh worker picks up revocations made before it started."""
+    revoke_tokens(['earlier-jti'])
+    revocation_filter.reset()
+    
+    assert revocation_filter._check_token({}, {'jti': 'earlier-jti'}) is True
+
+
+def test_remote_revocation_updates_filter(app, mock_redis):
+    """Test that revocations published by other workers reach the filter."""
+    assert not revocation_filter.might_be_revoked('remote-jti')
+    
+    # Another worker stored the revocation and announced it
+    mock_redis.set('revoked:remote-jti', 1)
+    revocation_filter._handle_revocation({'jtis': ['remote-jti']})
+    
+    assert revocation_filter._check_token({}, {'jti': 'remote-jti'}) is True
+
+
+def test_expired_revocations_not_reloaded(app, mock_redis):
+    """Test that revocations past their token's lifetime drop out of the snapshot."""
+    with freeze_time("2023-01-01 12:00:00"):
+        revoke_tokens(['short-jti'], ttl=60)
+        revoke_tokens(['long-jti'], ttl=3600)
+    
+    with freeze_time("2023-01-01 12:05:00"):
+        assert list(get_revoked_jtis()) == ['long-jti']
+
+
+def test_is_token_revoked_without_redis(app, monkeypatch):
+    """Test that revocation checks fail open without Redis."""
+    monkeypatch.setattr('app.services.redis_service.get_redis', lambda: None)
+    
+    assert is_token_revoked('any-jti') is False
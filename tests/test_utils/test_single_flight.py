@@ -0,0 +1,88 @@
+import threading
+import pytest
+from app.utils.single_flight import SingleFlight
+
+
+def _run_concurrently(count, target):
+    """Start count threads on target and wait for them all."""
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def test_concurrent_calls_share_one_run():
+    """Test that callers arriving during a call wait for it instead of repeating it."""
+    flight = SingleFlight()
+    release = threading.Event()
+    calls, results = [], []
+    
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return 'value'
+    
+    threads = _run_concurrently(8, lambda: results.append(flight.do('key', load)))
+    while len(flight) == 0:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert len(calls) < 8
+    assert results == ['value'] * 8
+    assert len(flight) == 0
+
+
+def test_error_shared_with_waiters():
+    """Test that waiters see the leader's exception."""
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+    
+    def load():
+        started.set()
+        release.wait(5)
+        raise ValueError('database down')
+    
+    def call():
+        try:
+            flight.do('key', load)
+        except ValueError as e:
+            errors.append(e)
+    
+    leader = _run_concurrently(1, call)[0]
+    started.wait(5)
+    waiter = _run_concurrently(1, call)[0]
+    threading.Timer(0.2, release.set).start()
+    leader.join()
+    waiter.join()
+    
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+
+def test_waiter_timeout_runs_itself():
+    """Test that a waiter stops waiting for a stuck leader after the timeout."""
+    flight = SingleFlight(timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+    
+    def stuck():
+        started.set()
+        release.wait(5)
+        return 'late'
+    
+    leader = _run_concurrently(1, lambda: flight.do('key', stuck))[0]
+    started.wait(5)
+    
+    assert flight.do('key', lambda: 'own') == 'own'
+    release.set()
+    leader.join()
+
+
+def test_results_not_kept():
+    """Test that a finished call is not reused by later callers."""
+    flight = SingleFlight()
+    
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
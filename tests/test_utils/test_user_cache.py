@@ -0,0 +1,76 @@
+from app.models.user import User
+from app.services.auth_service import get_user_by_id
+from app.utils.cache import cache
+from app.utils.user_cache import user_cache
+
+
+def test_lookup_served_from_cache(db_session, test_user, mock_redis, query_counter):
+    """Test that a cached user is returned without a SELECT and still behaves like a loaded row."""
+    public_id = test_user.public_id
+    get_user_by_id(public_id)
+    db_session.remove()
+    query_counter.clear()
+    
+    user = get_user_by_id(public_id)
+    
+    assert query_counter == []
+    assert user.email == 'test@example.com'
+    assert user.created_at == test_user.created_at
+    assert user.verify_password('password123')
+
+
+def test_committed_change_invalidates(db_session, test_user, mock_redis):
+    """Test that committing a change to the user drops its cached row."""
+    public_id = test_user.public_id
+    get_user_by_id(public_id)
+    
+    test_user.first_name = 'Renamed'
+    db_session.commit()
+    db_session.expunge_all()
+    
+    assert get_user_by_id(public_id).first_name == 'Renamed'
+    assert cache.stats()[f'users:{public_id}']['misses'] == 2
+
+
+def test_update_through_cached_row(db_session, test_user, mock_redis):
+    """Test that changes made to a cached user are written back on commit."""
+    public_id = test_user.public_id
+    get_user_by_id(public_id)
+    db_session.expunge_all()
+    
+    user = get_user_by_id(public_id)
+    user.is_active = False
+    db_session.commit()
+    db_session.expunge_all()
+    
+    assert get_user_by_id(public_id).is_active is False
+
+
+def test_unknown_user_created_later(db_session, mock_redis):
+    """Test that an unknown id is None until a user with that id is created."""
+    assert get_user_by_id('new-user-id') is None
+    
+    db_session.add(User(public_id='new-user-id', email='new@example.com'))
+    db_session.commit()
+    
+    assert get_user_by_id('new-user-id').email == 'new@example.com'
+
+
+def test_change_during_lookup_not_cached(db_session, test_user, mock_redis):
+    """Test that a row read before a concurrent deactivation commits is not served afterwards."""
+    public_id = test_user.public_id
+    
+    def load_then_deactivate():
+        stale = User.query.filter_by(public_id=public_id).first()
+        db_session.expunge(stale)
+        
+        # Another request deactivates the user while this lookup is in flight
+        user = User.query.filter_by(public_id=public_id).first()
+        user.is_active = False
+        db_session.commit()
+        return stale
+    
+    assert user_cache.get_or_load(public_id, load_then_deactivate).is_active is True
+    db_session.expunge_all()
+    
+    assert get_user_by_id(public_id).is_active is False